@@ -19,25 +19,84 @@ Snippet Status Reports in txt, pb, and csv format.
 
   Usage:
 
-  python generate_ssr.py
+  python generate_ssr.py [--max-results N] [--workers N]
+                         [--cache-dir DIR [--cache-size MB]]
+                         [--state FILE [--delta]]
+                         [--account-ids ID,ID,... [--threads N] [--merge]]
+                         [--input FILE ... | --input-dir DIR] [--index]
+                         [--summary] [--columnar [--parquet]]
+                         [--daemon [--interval SECONDS] [--port PORT]]
+
+Creatives are fetched page by page, the next page being downloaded while the
+current one is converted, so only a few pages of the creatives.list response
+are held in memory at a time.
 
 Output files are SnippetStatusReport.txt, SnippetStatusReport.pb,
 and SnippetStatusReport.csv
+
+With --account-ids, the creatives of each account are listed concurrently
+and written to SnippetStatusReport_<account id>.txt/.pb/.csv, or to a single
+merged report with --merge.
+
+With --state FILE, only creatives that are new or changed since the previous
+run are converted again.  Adding --delta writes SnippetStatusReport_added,
+SnippetStatusReport_changed and SnippetStatusReport_removed reports instead
+of the full reports.
+
+With --cache-dir, creatives.list pages are cached on disk with their ETag,
+and pages the API answers 304 Not Modified for are read from the cache
+instead of being downloaded again.
+
+With --input or --input-dir, creatives.list responses saved as JSON files are
+converted instead of calling the API, without authenticating.
+
+With --index, a SnippetStatusReport.idx index is written next to each .pb
+report, so that ssr_store.ReportStore can look items up by
+buyer_creative_id or creative_id without parsing the whole report.  Without
+--index, an index left over from a previous run is removed.
+
+With --summary, SnippetStatusReport_summary.csv and .json files are written
+next to each report, with the filtering counts by date and status, the
+disapprovals by reason and the items by status and by advertiser.
+
+With --columnar, the fields of the items of each report are also written as
+typed columns to a SnippetStatusReport_columns directory of .npy files.  Adding
+--parquet also writes them to a SnippetStatusReport_parquet directory of
+.parquet files, which requires pyarrow.
+
+With --daemon, the program keeps running and regenerates the reports every
+--interval seconds with the same service and credentials.  Each report file is
+replaced atomically, and http://localhost:PORT/status and
+http://localhost:PORT/creatives/<id> serve the number of items by status and
+the items of a creative from the latest reports.
 """
 
 import argparse
+import collections
 import contextlib
+import cStringIO
 import csv
+import functools
+import glob
+import json
+import multiprocessing
+import multiprocessing.pool
+import os
+import Queue
+import re
 import StringIO
 import sys
-
-from apiclient import sample_tools
-from oauth2client import client
+import threading
 
 from third_party.protobuf_json import protobuf_json
 import snippet_status_report_pb2
+import ssr_cache
+import ssr_profile
+import ssr_state
+import ssr_store
 
 import google.protobuf.descriptor as descriptor
+import google.protobuf.text_encoding as text_encoding
 import google.protobuf.text_format as text_format
 
 
@@ -67,8 +126,169 @@ KEY_TRANSLATION = {
     u'status': u'status',
     u'width': u'width'}
 
+# Elements removed from a list field of translated items: those whose key
+# is value, or that are value when key is None.
+DroppedElements = collections.namedtuple('DroppedElements',
+                                         ('field', 'key', 'value'))
+# Condition on a field of translated items, which holds if the field
+# matches value exactly when present is True.  A list field matches if one
+# of its elements does, and a field or element matches if its key is value,
+# or if it is value when key is None.
+Condition = collections.namedtuple('Condition',
+                                   ('field', 'key', 'value', 'present'))
+# Boolean field of Snippet Status Items, True if all of its conditions hold.
+DerivedField = collections.namedtuple('DerivedField', ('name', 'conditions'))
+
+DROPPED_ELEMENTS = (
+    # This correction reason is not exposed in the protocol buffer.
+    DroppedElements(u'snippet_correction', u'type', FLASHLESS_ATTRIBUTE),
+)
+
+DERIVED_FIELDS = (
+    DerivedField(u'is_ssl_capable', (
+        Condition(u'attribute', None, RICH_MEDIA_CAPABILITY_SSL, True),
+        Condition(u'disapproval_reason', u'reason', INVALID_SSL_DECLARATION,
+                  False),
+        Condition(u'snippet_correction', u'type', SSL_ATTRIBUTE, False))),
+)
+
+REPORT_BASENAME = 'SnippetStatusReport'
+
+_SNIPPET_STATUS_FIELD = (snippet_status_report_pb2.SnippetStatusReport
+                         .DESCRIPTOR.fields_by_name['snippet_status'])
+# Key of a snippet_status element in the wire format: the field number
+# followed by wire type 2 (length-delimited).
+_SNIPPET_STATUS_TAG = chr((_SNIPPET_STATUS_FIELD.number << 3) | 2)
+
+# Changes of creatives since the previous run, with --state.
+ADDED = 'added'
+CHANGED = 'changed'
+UNCHANGED = 'unchanged'
+REMOVED = 'removed'
+
+# Version of the pb renderings of Snippet Status Items saved with --state.
+# Changing the conversion of creatives requires a new version, so that items
+# saved by earlier versions are not reused.
+STATE_VERSION = 2
+
+# Maximum page size accepted by creatives.list.
+DEFAULT_MAX_RESULTS = 1000
+# Number of accounts listed at the same time with --account-ids.
+DEFAULT_THREADS = 4
+# Number of creatives converted at a time by each --workers process.
+DEFAULT_CHUNK_SIZE = 500
+# Retries with exponential backoff of requests failing with rate limit or
+# server errors.
+DEFAULT_NUM_RETRIES = 5
+# Seconds between the refreshes of the reports with --daemon.
+DEFAULT_INTERVAL = 15 * 60
+# Port of the local status server of --daemon.
+DEFAULT_PORT = 8080
+# Seconds a thread blocked on a full queue of pages waits before checking
+# whether the pages are still consumed.
+_PUT_TIMEOUT = 0.1
+
 # Declare command-line flags.
 argparser = argparse.ArgumentParser(add_help=False)
+argparser.add_argument(
+    '--max-results', dest='max_results', type=int,
+    default=DEFAULT_MAX_RESULTS,
+    help='Number of creatives requested per creatives.list page.')
+argparser.add_argument(
+    '--num-retries', dest='num_retries', type=int,
+    default=DEFAULT_NUM_RETRIES,
+    help='Number of times a rate limited or failed request is retried, '
+    'with exponential backoff.')
+argparser.add_argument(
+    '--account-ids', dest='account_ids',
+    type=lambda value: [int(account_id) for account_id in value.split(',')],
+    help='Comma separated buyer account IDs to generate reports for.')
+argparser.add_argument(
+    '--threads', type=int, default=DEFAULT_THREADS,
+    help='Number of accounts listed concurrently with --account-ids.')
+argparser.add_argument(
+    '--workers', type=int, default=1,
+    help='Number of processes converting creatives into Snippet Status '
+    'Items.')
+argparser.add_argument(
+    '--merge', action='store_true',
+    help='Write the creatives of all --account-ids to a single report.')
+argparser.add_argument(
+    '--state',
+    help='File keeping the creatives of the previous run, so that only new '
+    'and changed creatives are converted.  Creatives are then converted in '
+    'a single process, so --workers cannot be combined with --state.')
+argparser.add_argument(
+    '--delta', action='store_true',
+    help='Only write reports of the creatives added, changed and removed '
+    'since the previous --state run.')
+argparser.add_argument(
+    '--profile', nargs='?', const='-', metavar='FILE',
+    help='Write the time spent in each stage, the number of creatives, the '
+    'bytes written per report format and the memory used as JSON to FILE, '
+    'or to stderr if FILE is omitted.  With --daemon, the profile of each '
+    'refresh is written after it.')
+argparser.add_argument(
+    '--cache-dir', dest='cache_dir',
+    help='Directory caching creatives.list pages between runs; cached pages '
+    'are requested again conditionally on their ETag.')
+argparser.add_argument(
+    '--cache-size', dest='cache_size', type=int,
+    default=ssr_cache.DEFAULT_MAX_BYTES // (1024 * 1024),
+    help='Size of --cache-dir in MB above which the least recently used '
+    'pages are evicted.')
+argparser.add_argument(
+    '--input', action='append',
+    help='creatives.list response saved as JSON to convert instead of '
+    'calling the API; may be repeated.  A file holds one response or a '
+    'list of responses.')
+argparser.add_argument(
+    '--input-dir', dest='input_dir',
+    help='Directory of creatives.list responses saved as .json files to '
+    'convert instead of calling the API, in file name order.')
+argparser.add_argument(
+    '--index', action='store_true',
+    help='Index the items of each .pb report by buyer_creative_id and '
+    'creative_id in a .idx file, for ssr_store.ReportStore.')
+argparser.add_argument(
+    '--summary', action='store_true',
+    help='Write a summary of each report to <report>_summary.csv and .json.')
+argparser.add_argument(
+    '--columnar', action='store_true',
+    help='Write the fields of each report as typed columns to a '
+    '<report>_columns directory of .npy files.')
+argparser.add_argument(
+    '--parquet', action='store_true',
+    help='With --columnar, also write the columns to a <report>_parquet '
+    'directory of .parquet files; requires pyarrow.')
+argparser.add_argument(
+    '--daemon', action='store_true',
+    help='Keep running, regenerate the reports every --interval seconds and '
+    'serve their status on http://localhost:PORT/.')
+argparser.add_argument(
+    '--interval', type=int, default=DEFAULT_INTERVAL,
+    help='Seconds between the refreshes of the reports with --daemon.')
+argparser.add_argument(
+    '--port', type=int, default=DEFAULT_PORT,
+    help='Port of the local status server of --daemon.')
+
+
+def _EncodeVarint(value):
+  """Encodes a non-negative integer as a protocol buffer varint."""
+  pieces = []
+  bits = value & 0x7f
+  value >>= 7
+  while value:
+    pieces.append(chr(0x80 | bits))
+    bits = value & 0x7f
+    value >>= 7
+  pieces.append(chr(bits))
+  return ''.join(pieces)
+
+
+def _FrameSnippetStatus(data):
+  """Encodes a serialized SnippetStatusItem as a snippet_status element."""
+  return _SNIPPET_STATUS_TAG + _EncodeVarint(len(data)) + data
 
 
 def _ReplaceKey(dictionary, old_key, new_key):
@@ -96,39 +316,489 @@ def _ReplaceJSONFields(json, translation, prefix):
         _ReplaceJSONFields(json[new_key], translation, full_key + '.')
 
 
-def _RemoveFlashlessAttributeCorrection(item):
-  """Remove FLASHLESS_ATTRIBUTE if it's one of the correction reasons.
+def _CompileKeyTranslation(translation):
+  """Compiles a flat key translation table into a nested translation tree.
+
+  Args:
+    translation: Table of key translations for JSON, keyed by the full
+        dotted path of each key as used by _ReplaceJSONFields.
+  Returns:
+    a list of (old_key, new_key, subtree) tuples for the top level of the
+    JSON hierarchy, where subtree has the same structure and translates the
+    keys nested below old_key.  Entries nested below a key that is not
+    translated itself are dropped, as _ReplaceJSONFields never reaches them.
+  """
+  tree = {}
+  for full_key in sorted(translation, key=lambda key: key.count('.')):
+    path = full_key.split('.')
+    level = tree
+    for key in path[:-1]:
+      if key not in level:
+        break
+      level = level[key][1]
+    else:
+      level[path[-1]] = (translation[full_key], {})
+
+  def Freeze(level):
+    return [(old_key, new_key, Freeze(subtree))
+            for old_key, (new_key, subtree) in sorted(level.iteritems())]
+  return Freeze(tree)
+
+
+_KEY_TRANSLATION_TREE = _CompileKeyTranslation(KEY_TRANSLATION)
+
+
+def _TranslateJSONFields(json, tree=_KEY_TRANSLATION_TREE):
+  """Renames keys of a JSON hierarchy in place using a translation tree.
+
+  Produces the same result as _ReplaceJSONFields(json, KEY_TRANSLATION, '')
+  without building prefix strings or recursing.
+
+  Args:
+    json: JSON data to modify.
+    tree: Translation tree built by _CompileKeyTranslation.
+  """
+  pending = [(json, tree)]
+  while pending:
+    node, level = pending.pop()
+    if type(node) is list:
+      pending.extend((element, level) for element in node)
+    elif type(node) is dict:
+      for old_key, new_key, subtree in level:
+        if old_key not in node:
+          continue
+        if new_key != old_key:
+          node[new_key] = node.pop(old_key)
+        if subtree:
+          pending.append((node[new_key], subtree))
+
+
+def _Matches(value, key, expected):
+  """Whether value, or its key if key is not None, is expected."""
+  if key is None:
+    return value == expected
+  return type(value) is dict and value.get(key) == expected
+
+
+def _Holds(item, condition):
+  """Whether a Condition holds for a translated item."""
+  value = item.get(condition.field)
+  if type(value) is list:
+    matches = any(_Matches(element, condition.key, condition.value)
+                  for element in value)
+  else:
+    matches = (value is not None and
+               _Matches(value, condition.key, condition.value))
+  return matches == condition.present
+
+
+def _NormalizeItem(item, dropped_elements=DROPPED_ELEMENTS,
+                   derived_fields=DERIVED_FIELDS):
+  """Normalizes a creative in place, without copying it.
+
+  Translates the keys of item with _TranslateJSONFields, then removes the
+  dropped elements of its lists and computes the derived fields, each rule
+  only looking at the field it names.  Folding the rules into the traversal
+  of _TranslateJSONFields was slower, as most fields have no rule.
+
+  Args:
+    item: creative dictionary as returned by the creatives.list API
+    dropped_elements: DroppedElements rules, like DROPPED_ELEMENTS
+    derived_fields: DerivedField rules, like DERIVED_FIELDS
+  Returns:
+    a list of the (field name, value) of the derived fields
+  """
+  _TranslateJSONFields(item)
+  for rule in dropped_elements:
+    values = item.get(rule.field)
+    if type(values) is list:
+      values[:] = [value for value in values
+                   if not _Matches(value, rule.key, rule.value)]
+  return [(derived.name, all(_Holds(item, condition)
+                             for condition in derived.conditions))
+          for derived in derived_fields]
+
+
+# Scalar value converters of json2pb, shared so that both conversion paths
+# produce the same values.
+_JS2FTYPE = protobuf_json._js2ftype  # pylint: disable=protected-access
+
+
+def _EnumNameToNumber(field):
+  """Returns a function converting enum names of field into numbers.
+
+  Mirrors protobuf_json._EnumNameToNumber, but looks names up in a table
+  built once instead of going through the enum descriptor for every value.
+  """
+  numbers = dict((value.name, value.number)
+                 for value in field.enum_type.values)
+
+  def Convert(js_value):
+    number = numbers.get(js_value)
+    return int(js_value) if number is None else number
+  return Convert
+
+
+def _CompileJSONToPBPlan(message_descriptor):
+  """Compiles the json2pb conversion of a message type into a plan.
+
+  Field descriptors, value converters and enum lookup tables are resolved
+  once here, instead of for every field of every item as json2pb does.
+
+  Args:
+    message_descriptor: descriptor of the message type to convert to
+  Returns:
+    a list of (field_name, is_repeated, is_message, convert) tuples in field
+    order, where convert is the sub-plan of message fields and the value
+    converter of other fields; or None if the message type uses features
+    the plan does not support, in which case json2pb must be used instead.
+  """
+  plan = []
+  for field in message_descriptor.fields:
+    if field.label == descriptor.FieldDescriptor.LABEL_REQUIRED:
+      return None
+    is_message = field.type == descriptor.FieldDescriptor.TYPE_MESSAGE
+    if is_message:
+      convert = _CompileJSONToPBPlan(field.message_type)
+      if convert is None:
+        return None
+    elif field.type == descriptor.FieldDescriptor.TYPE_ENUM:
+      convert = _EnumNameToNumber(field)
+    elif field.type in _JS2FTYPE:
+      convert = _JS2FTYPE[field.type]
+    else:
+      return None
+    is_repeated = field.label == descriptor.FieldDescriptor.LABEL_REPEATED
+    plan.append((field.name, is_repeated, is_message, convert))
+  return plan
+
+
+def _ApplyJSONToPBPlan(plan, pb, js):
+  """Fills the protobuf pb with the values in the dict js, following plan.
+
+  Args:
+    plan: conversion plan built by _CompileJSONToPBPlan for pb's type
+    pb: An empty protobuf object.
+    js: A dictionary with keys corresponding to protobuf fields.
+  """
+  for field_name, is_repeated, is_message, convert in plan:
+    if field_name not in js:
+      continue
+    js_value = js[field_name]
+    if is_message:
+      if is_repeated:
+        add = getattr(pb, field_name).add
+        for element in js_value:
+          _ApplyJSONToPBPlan(convert, add(), element)
+      else:
+        _ApplyJSONToPBPlan(convert, getattr(pb, field_name), js_value)
+    elif is_repeated:
+      getattr(pb, field_name).extend([convert(v) for v in js_value])
+    else:
+      setattr(pb, field_name, convert(js_value))
+
+
+_SNIPPET_STATUS_PLAN = _CompileJSONToPBPlan(
+    snippet_status_report_pb2.SnippetStatusItem.DESCRIPTOR)
+
+
+def _JSONToSnippetStatusItem(snippet_status, translated_item):
+  """Fills in a SnippetStatusItem from a translated creative.
+
+  Uses the precompiled plan, falling back to the generic json2pb if the
+  SnippetStatusItem schema is not supported by it.
+  """
+  if _SNIPPET_STATUS_PLAN is None:
+    protobuf_json.json2pb(snippet_status, translated_item, True)
+  else:
+    _ApplyJSONToPBPlan(_SNIPPET_STATUS_PLAN, snippet_status, translated_item)
+
+
+def ListCreativePages(service, max_results=DEFAULT_MAX_RESULTS, http=None,
+                      num_retries=0, **kwargs):
+  """Lists creatives one page at a time, following nextPageToken.
+
+  Args:
+    service: adexchangebuyer service object
+    max_results: number of creatives requested per page
+    http: httplib2.Http object to send the requests with, instead of the
+        one the service was built with
+    num_retries: number of times a request failing with a rate limit or
+        server error is retried, with exponential backoff
+    **kwargs: additional parameters for the creatives.list call
+  Yields:
+    creatives.list response dictionaries
+  """
+  creatives = service.creatives()
+  request = creatives.list(maxResults=max_results, **kwargs)
+  while request is not None:
+    response = request.execute(http=http, num_retries=num_retries)
+    yield response
+    request = creatives.list_next(request, response)
+
+
+def _PutUnlessStopped(queue, value, stop):
+  """Puts value in a bounded queue, unless stop is set first.
+
+  Args:
+    queue: Queue.Queue to put value in
+    value: value to put
+    stop: threading.Event set when the values are no longer consumed
+  Returns:
+    whether value was put in queue
+  """
+  while not stop.is_set():
+    try:
+      queue.put(value, timeout=_PUT_TIMEOUT)
+      return True
+    except Queue.Full:
+      pass
+  return False
+
+
+def ListCreatives(service, max_results=DEFAULT_MAX_RESULTS, **kwargs):
+  """Lists creatives one page at a time, following nextPageToken.
+
+  Pages are fetched on a background thread, which downloads the next page
+  while the items of the current one are consumed.  It runs at most one page
+  ahead of the caller, so memory use is bounded by the page size rather than
+  by the number of creatives in the account.  The thread ends when the
+  generator is exhausted or closed.
+
+  Args:
+    service: adexchangebuyer service object
+    max_results: number of creatives requested per page
+    **kwargs: additional parameters for ListCreativePages
+  Yields:
+    creative dictionaries, in the order returned by the API
+  Raises:
+    the error raised while listing the creatives, if any
+  """
+  pages = Queue.Queue(maxsize=1)
+  stop = threading.Event()
+
+  def FetchPages():
+    try:
+      for response in ListCreativePages(service, max_results, **kwargs):
+        if not _PutUnlessStopped(pages, (response.get('items', []), None),
+                                 stop):
+          return
+    except Exception:  # pylint: disable=broad-except
+      _PutUnlessStopped(pages, (None, sys.exc_info()), stop)
+    else:
+      _PutUnlessStopped(pages, (None, None), stop)
+
+  fetcher = threading.Thread(target=FetchPages)
+  fetcher.daemon = True
+  fetcher.start()
+  try:
+    while True:
+      items, error = pages.get()
+      if error:
+        raise error[0], error[1], error[2]
+      if items is None:
+        return
+      for item in items:
+        yield item
+  finally:
+    stop.set()
+    fetcher.join()
+
+
+def SavedPagePaths(inputs=None, input_dir=None):
+  """Returns the paths of saved creatives.list responses to convert.
+
+  Args:
+    inputs: paths of JSON files, converted in the given order
+    input_dir: directory whose .json files are converted after inputs, in
+        file name order
+  """
+  paths = list(inputs or [])
+  if input_dir:
+    paths.extend(sorted(glob.glob(os.path.join(input_dir, '*.json'))))
+  return paths
+
+
+def ReadSavedPages(paths):
+  """Reads creatives.list responses saved as JSON, one file at a time.
+
+  Args:
+    paths: paths of JSON files each holding a creatives.list response, or a
+        list of responses
+  Yields:
+    creatives.list response dictionaries
+  """
+  for path in paths:
+    with open(path) as saved_file:
+      saved = json.load(saved_file)
+    if isinstance(saved, list):
+      for response in saved:
+        yield response
+    else:
+      yield saved
+
+
+def ListSavedCreatives(paths):
+  """Lists the creatives of saved creatives.list responses, like ListCreatives.
+
+  Args:
+    paths: paths of the saved responses, as passed to ReadSavedPages
+  Yields:
+    creative dictionaries, in the order they were saved
+  """
+  for response in ReadSavedPages(paths):
+    for item in response.get('items', []):
+      yield item
+
+
+class HttpPool(object):
+  """Pool of Http objects shared by the threads listing creatives.
+
+  httplib2.Http objects are not thread safe, so each thread borrows one for
+  as long as it sends requests.  Returned objects keep their connections
+  open for the next borrower, and no more objects are created than there
+  are concurrent borrowers.
+  """
+
+  def __init__(self, http_factory):
+    self._http_factory = http_factory
+    self._idle = Queue.Queue()
+
+  @contextlib.contextmanager
+  def Connection(self):
+    try:
+      http = self._idle.get_nowait()
+    except Queue.Empty:
+      http = self._http_factory()
+    try:
+      yield http
+    finally:
+      self._idle.put(http)
+
+
+def _AuthorizedHttpFactory(service, cache=None):
+  """Returns a function creating Http objects authorized like service's.
+
+  sample_tools.init does not return the credentials, but oauth2client makes
+  them available as the credentials property of the request method of the
+  Http object it authorizes.
+
+  Args:
+    service: adexchangebuyer service object
+    cache: httplib2 cache of the responses, e.g. an ssr_cache.FileCache,
+        shared by the Http objects created
+  """
+  import httplib2  # pylint: disable=g-import-not-at-top
+
+  # pylint: disable=protected-access
+  credentials = service._http.request.credentials
+  return lambda: credentials.authorize(httplib2.Http(cache=cache))
+
+
+def ListAccountsCreatives(service, account_ids, http_pool,
+                          threads=DEFAULT_THREADS,
+                          max_results=DEFAULT_MAX_RESULTS,
+                          num_retries=DEFAULT_NUM_RETRIES):
+  """Lists the creatives of several accounts concurrently.
+
+  Up to threads accounts are listed at the same time, each through an Http
+  object borrowed from http_pool.  Pages are handed over to the caller
+  through a bounded queue, so fetching runs ahead of the caller by at most
+  a few pages.  When the generator is exhausted, closed or raises, the
+  threads stop after their current request and are joined.
 
-  This correction reason is not exposed in the protobol buffer, and therefore
-  it needs to be removed
   Args:
-    item: snippet status item to process
+    service: adexchangebuyer service object
+    account_ids: buyer account IDs to list the creatives of
+    http_pool: HttpPool the requests are sent through
+    threads: maximum number of accounts listed concurrently
+    max_results: number of creatives requested per page
+    num_retries: number of times a request failing with a rate limit or
+        server error is retried, with exponential backoff
+  Yields:
+    (account_id, creative dictionary) tuples; creatives of one account are
+    in API order, but creatives of different accounts are interleaved.
+  Raises:
+    the first error raised while listing the creatives of any account
   """
-  for snippet_correction in item.get('snippet_correction', []):
-    if snippet_correction.get('type', None) == FLASHLESS_ATTRIBUTE:
-      item['snippet_correction'].remove(snippet_correction)
+  pages = Queue.Queue(maxsize=2 * threads)
+  stop = threading.Event()
 
+  def ListAccount(account_id):
+    if stop.is_set():
+      return
+    try:
+      with http_pool.Connection() as http:
+        for response in ListCreativePages(
+            service, max_results, http=http, num_retries=num_retries,
+            accountId=account_id):
+          if not _PutUnlessStopped(
+              pages, (account_id, response.get('items', []), None), stop):
+            return
+    except Exception:  # pylint: disable=broad-except
+      _PutUnlessStopped(pages, (account_id, None, sys.exc_info()), stop)
+    else:
+      _PutUnlessStopped(pages, (account_id, None, None), stop)
+
+  pool = multiprocessing.pool.ThreadPool(threads)
+  try:
+    for account_id in account_ids:
+      pool.apply_async(ListAccount, (account_id,))
+    pool.close()
+    remaining = len(account_ids)
+    while remaining:
+      account_id, items, error = pages.get()
+      if error:
+        raise error[0], error[1], error[2]
+      if items is None:
+        remaining -= 1
+        continue
+      for item in items:
+        yield account_id, item
+  finally:
+    # Threads blocked on the full queue see stop within _PUT_TIMEOUT, and
+    # accounts not started yet are skipped.
+    stop.set()
+    while True:
+      try:
+        pages.get_nowait()
+      except Queue.Empty:
+        break
+    pool.close()
+    pool.join()
 
-def _IsSSLCapable(item):
-  """Checkes whether a Snippet Status Item is SSL Capable.
+
+def _FillSnippetStatusItem(snippet_status, item):
+  """Converts one creative from the creatives.list API into a protobuf.
 
   Args:
-    item: a dictionary that represents one Snippet Status Item
+    snippet_status: empty SnippetStatusItem to fill in
+    item: creative dictionary; its keys are translated in place
+  """
+  derived_fields = _NormalizeItem(item)
+  _JSONToSnippetStatusItem(snippet_status, item)
+
+  # Fill in fields that are not directly read from the response:
+  snippet_status.source = snippet_status_report_pb2.SnippetStatusItem.RTB
+  for field_name, value in derived_fields:
+    setattr(snippet_status, field_name, value)
+
+
+def GenerateSnippetStatusReportFromItems(items):
+  """Generates a Snippet Status Report from an iterable of creatives.
+
+  Args:
+    items: iterable of creative dictionaries, e.g. a ListCreatives generator
   Returns:
-    True if 1. RICH_MEDIA_CAPABILITY_SSL is declared in the attribute
-            2. The snippet is not disapproved for INVALID_SSL_DECLARATION
-            3. The snippet is not corrected for SSL_ATTRIBUTE
-    False otherwise
+    a Snippet Status Report Protocol Buffer Object
   """
-  if RICH_MEDIA_CAPABILITY_SSL not in item.get('attribute', []):
-    return False
-  for disapproval_reason in item.get('disapproval_reason', []):
-    if disapproval_reason.get('reason', None) == INVALID_SSL_DECLARATION:
-      return False
-  for snippet_correction in item.get('snippet_correction', []):
-    if snippet_correction.get('type', None) == SSL_ATTRIBUTE:
-      return False
-  return True
+  report = snippet_status_report_pb2.SnippetStatusReport()
+
+  # Convert the report to a protocol buffer
+  for item in items:
+    _FillSnippetStatusItem(report.snippet_status.add(), item)
+
+  return report
 
 
 def GenerateSnippetStatusReportPBObject(response):
@@ -140,21 +810,214 @@ def GenerateSnippetStatusReportPBObject(response):
   Returns:
     a Snippet Status Report Protocol Buffer Object
   """
-  report = snippet_status_report_pb2.SnippetStatusReport()
+  return GenerateSnippetStatusReportFromItems(response['items'])
 
-  # Convert the report to a protocol buffer
-  for item in response['items']:
-    snippet_status = report.snippet_status.add()
-    _ReplaceJSONFields(item, KEY_TRANSLATION, '')
-    translated_item = item.copy()  # Make a copy so we can keep the original
-    _RemoveFlashlessAttributeCorrection(item)
-    protobuf_json.json2pb(snippet_status, translated_item, True)
 
-    # Fill in fields that are not directly read from the response:
-    snippet_status.source = snippet_status_report_pb2.SnippetStatusItem.RTB
-    snippet_status.is_ssl_capable = _IsSSLCapable(translated_item)
+class TextReportWriter(object):
+  """Appends Snippet Status Items to a report in protobuf text format.
+
+  The output is identical to text_format.PrintMessage of the whole
+  SnippetStatusReport, without ever holding the report in memory.
+  """
+
+  def __init__(self, report_txt):
+    self._out = report_txt
+
+  @staticmethod
+  def Render(snippet_status):
+    """Returns the text appended to the report for snippet_status."""
+    # text_format escapes strings to ASCII, which cStringIO accepts.
+    with contextlib.closing(cStringIO.StringIO()) as buf:
+      text_format.PrintField(_SNIPPET_STATUS_FIELD, snippet_status, buf)
+      return buf.getvalue()
+
+  def Write(self, snippet_status):
+    text_format.PrintField(_SNIPPET_STATUS_FIELD, snippet_status, self._out)
+
+  def WriteRendered(self, data):
+    """Appends text returned by Render."""
+    self._out.write(data)
+
+
+class ProtoReportWriter(object):
+  """Appends Snippet Status Items to a serialized SnippetStatusReport.
+
+  Each item is written with the wire encoding of one element of the
+  repeated snippet_status field, so the concatenated output parses as a
+  SnippetStatusReport.
+  """
+
+  def __init__(self, report_pb):
+    self._out = report_pb
+
+  @staticmethod
+  def Render(snippet_status):
+    """Returns the bytes appended to the report for snippet_status."""
+    return _FrameSnippetStatus(snippet_status.SerializeToString())
+
+  def Write(self, snippet_status):
+    self._out.write(self.Render(snippet_status))
+
+  def WriteRendered(self, data):
+    """Appends bytes returned by Render."""
+    self._out.write(data)
 
-  return report
+
+def _FieldSingletonAsString(field, value):
+  """Generates string value for a field singleton using text_format."""
+  with contextlib.closing(StringIO.StringIO()) as buf:
+    text_format.PrintFieldValue(field, value, buf, as_one_line=True)
+    return buf.getvalue()
+
+
+# Characters that text_encoding.CEscape does not output verbatim.
+_NEEDS_C_ESCAPE = re.compile(r'[^ -~]|["\'\\]')
+
+
+def _IsPlainMessageType(message_type):
+  """Whether _CompileMessageFormatter can format messages of this type."""
+  return (getattr(message_type, 'syntax', 'proto2') == 'proto2' and
+          not message_type.extension_ranges and
+          not message_type.GetOptions().map_entry and
+          message_type.full_name != 'google.protobuf.Any')
+
+
+def _CompileMessageFormatter(message_type):
+  """Returns a function formatting a message like text_format.
+
+  Args:
+    message_type: descriptor of a message type accepted by
+        _IsPlainMessageType
+  Returns:
+    a function returning the same string as text_format.PrintFieldValue with
+    as_one_line=True for a message of that type, i.e. its set fields in
+    field number order between braces.
+  """
+  fields = []
+  for field in sorted(message_type.fields, key=lambda field: field.number):
+    if field.cpp_type == descriptor.FieldDescriptor.CPPTYPE_MESSAGE:
+      prefix = field.name
+    else:
+      prefix = field.name + ': '
+    fields.append((field.name,
+                   field.label == descriptor.FieldDescriptor.LABEL_REPEATED,
+                   prefix, _CompileValueFormatter(field)))
+
+  def FormatMessage(message):
+    parts = [' { ']
+    for field_name, is_repeated, prefix, format_value in fields:
+      if is_repeated:
+        for value in getattr(message, field_name):
+          parts.extend((prefix, format_value(value), ' '))
+      elif message.HasField(field_name):
+        parts.extend((prefix, format_value(getattr(message, field_name)), ' '))
+    parts.append('}')
+    return ''.join(parts)
+  return FormatMessage
+
+
+def _CompileValueFormatter(field):
+  """Returns a function formatting a single value of field.
+
+  The function returns the same string as text_format.PrintFieldValue with
+  as_one_line=True, with type dispatch, enum name tables and sub-message
+  layouts resolved once per field instead of once per value.
+
+  Args:
+    field: field descriptor
+  Returns:
+    a function taking one value of field, or one element if it is repeated
+  """
+  if field.cpp_type == descriptor.FieldDescriptor.CPPTYPE_MESSAGE:
+    if (field.type == descriptor.FieldDescriptor.TYPE_GROUP or
+        not _IsPlainMessageType(field.message_type)):
+      return functools.partial(_FieldSingletonAsString, field)
+    return _CompileMessageFormatter(field.message_type)
+  elif field.cpp_type == descriptor.FieldDescriptor.CPPTYPE_ENUM:
+    names = dict((value.number, value.name) for value in field.enum_type.values)
+
+    def FormatEnum(value):
+      name = names.get(value)
+      return str(value) if name is None else name
+    return FormatEnum
+  elif field.cpp_type == descriptor.FieldDescriptor.CPPTYPE_STRING:
+    def FormatString(value):
+      if isinstance(value, unicode):
+        value = value.encode('utf-8')
+      if _NEEDS_C_ESCAPE.search(value):
+        value = text_encoding.CEscape(value, False)
+      return '"%s"' % value
+    return FormatString
+  elif field.cpp_type == descriptor.FieldDescriptor.CPPTYPE_BOOL:
+    return lambda value: 'true' if value else 'false'
+  else:
+    return str
+
+
+def _CompileColumnFormatter(field):
+  """Returns a function generating the csv column of a field.
+
+  Repeated fields are formatted as [value1;value2;...].
+  """
+  format_value = _CompileValueFormatter(field)
+  if field.label == descriptor.FieldDescriptor.LABEL_REPEATED:
+    return lambda values: '[%s]' % ';'.join([format_value(value)
+                                             for value in values])
+  return format_value
+
+
+# (field name, column formatter) for each column of the csv report.
+_CSV_COLUMNS = [
+    (field.name, _CompileColumnFormatter(field))
+    for field in snippet_status_report_pb2.SnippetStatusItem.DESCRIPTOR.fields
+    if not field.name.startswith('DEPRECATED_')]
+
+
+class _RowBuffer(object):
+  """File-like object collecting the rows written by a csv.writer."""
+
+  def __init__(self):
+    self.rows = []
+    self.write = self.rows.append
+
+  def Pop(self):
+    data = ''.join(self.rows)
+    del self.rows[:]
+    return data
+
+
+class CSVReportWriter(object):
+  """Appends Snippet Status Items to a report in csv format.
+
+  The header row is written when the writer is created.
+  """
+
+  _row_buffer = _RowBuffer()
+  _row_writer = csv.writer(_row_buffer)
+
+  def __init__(self, report_csv):
+    self._out = report_csv
+    self._writer = csv.writer(report_csv)
+    header_row = [field_name for field_name, _ in _CSV_COLUMNS]
+    self._writer.writerow(header_row)
+
+  @staticmethod
+  def _Columns(snippet_status):
+    return [format_column(getattr(snippet_status, field_name))
+            for field_name, format_column in _CSV_COLUMNS]
+
+  @classmethod
+  def Render(cls, snippet_status):
+    """Returns the csv row appended to the report for snippet_status."""
+    cls._row_writer.writerow(cls._Columns(snippet_status))
+    return cls._row_buffer.Pop()
+
+  def Write(self, snippet_status):
+    self._writer.writerow(self._Columns(snippet_status))
+
+  def WriteRendered(self, data):
+    """Appends a csv row returned by Render."""
+    self._out.write(data)
 
 
 def WriteSnippetStatusReportInCSV(report, report_csv):
@@ -167,63 +1030,608 @@ def WriteSnippetStatusReportInCSV(report, report_csv):
   if not report_csv:
     return
 
-  writer = csv.writer(report_csv)
-  fields = snippet_status_report_pb2.SnippetStatusItem.DESCRIPTOR.fields
-  active_fields = [field for field in fields
-                   if not field.name.startswith('DEPRECATED_')]
+  writer = CSVReportWriter(report_csv)
+  for snippet_status in report.snippet_status:
+    writer.Write(snippet_status)
 
-  header_row = [field.name for field in active_fields]
-  writer.writerow(header_row)
 
-  def FieldSingletonAsString(field, value):
-    """Generates string value for a field singleton."""
-    with contextlib.closing(StringIO.StringIO()) as buf:
-      text_format.PrintFieldValue(field, value, buf, as_one_line=True)
-      return buf.getvalue()
+class ReportFiles(object):
+  """The txt, pb and csv report files sharing a base name.
+
+  Snippet Status Items passed to Write are appended to all three files.
+
+  Args:
+    basename: path of the report files, without extension
+    profile: ssr_profile.Profile timing the writes and counting the bytes
+        written to each file, if any
+  """
+
+  _OUTPUTS = (('txt', 'w', TextReportWriter),
+              ('pb', 'wb', ProtoReportWriter),
+              ('csv', 'w', CSVReportWriter))
+
+  def __init__(self, basename, profile=None):
+    self.basename = basename
+    self._profile = profile
+    self._files = []
+    self._writers = []
+    for extension, mode, writer_class in self._OUTPUTS:
+      report_file = open('%s.%s' % (basename, extension), mode)
+      self._files.append(report_file)
+      self._writers.append(writer_class(report_file))
+
+  @classmethod
+  def Render(cls, snippet_status, profile=None):
+    """Renders snippet_status for each report file.
+
+    Rendering can be done in another process, in which case only the
+    returned strings are sent back to be written by WriteRendered.
+
+    Args:
+      snippet_status: SnippetStatusItem to render
+      profile: ssr_profile.Profile timing the rendering of each format, if
+          any
+    Returns:
+      a tuple of the data appended to each report file
+    """
+    if profile is None:
+      return tuple(writer_class.Render(snippet_status)
+                   for _, _, writer_class in cls._OUTPUTS)
+    rendered = []
+    for extension, _, writer_class in cls._OUTPUTS:
+      with profile.Stage('render_' + extension):
+        rendered.append(writer_class.Render(snippet_status))
+    return tuple(rendered)
+
+  @classmethod
+  def RenderFramed(cls, framed, profile=None):
+    """Renders a Snippet Status Item from its pb rendering.
+
+    Args:
+      framed: the pb rendering of the item, as returned by Render
+      profile: ssr_profile.Profile timing the rendering of each format, if
+          any
+    Returns:
+      the same tuple as Render, with framed as the pb rendering
+    """
+    report = snippet_status_report_pb2.SnippetStatusReport()
+    report.MergeFromString(framed)
+    snippet_status = report.snippet_status[0]
+    rendered = []
+    for extension, _, writer_class in cls._OUTPUTS:
+      if writer_class is ProtoReportWriter:
+        rendered.append(framed)
+      elif profile is None:
+        rendered.append(writer_class.Render(snippet_status))
+      else:
+        with profile.Stage('render_' + extension):
+          rendered.append(writer_class.Render(snippet_status))
+    return tuple(rendered)
+
+  def Write(self, snippet_status):
+    for writer in self._writers:
+      writer.Write(snippet_status)
+
+  def WriteRendered(self, rendered):
+    """Appends a Snippet Status Item rendered by Render."""
+    if self._profile is None:
+      for writer, data in zip(self._writers, rendered):
+        writer.WriteRendered(data)
+      return
+    for (extension, _, _), writer, data in zip(self._OUTPUTS, self._writers,
+                                               rendered):
+      with self._profile.Stage('write_' + extension):
+        writer.WriteRendered(data)
+
+  def Close(self):
+    for (extension, _, _), report_file in zip(self._OUTPUTS, self._files):
+      if self._profile is not None:
+        self._profile.AddBytes(extension, report_file.tell())
+      report_file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, unused_type, unused_value, unused_traceback):
+    self.Close()
+
+
+@contextlib.contextmanager
+def _Stage(profile, stage):
+  """Times the body of a with statement as stage of profile, if any.
+
+  Generator-based context managers cost microseconds even without a profile,
+  so per-creative code branches on profile instead.
+  """
+  if profile is None:
+    yield
+  else:
+    with profile.Stage(stage):
+      yield
+
+
+def _ConvertAndRender(item, profile=None):
+  """Converts a creative and renders it with ReportFiles.Render.
+
+  Args:
+    item: creative dictionary; its keys are translated in place
+    profile: ssr_profile.Profile timing the conversion and rendering, if any
+  Returns:
+    the output of ReportFiles.Render for the creative
+  """
+  snippet_status = snippet_status_report_pb2.SnippetStatusItem()
+  if profile is None:
+    _FillSnippetStatusItem(snippet_status, item)
+    return ReportFiles.Render(snippet_status)
+  with profile.Stage('convert'):
+    _FillSnippetStatusItem(snippet_status, item)
+  return ReportFiles.Render(snippet_status, profile)
+
+
+def _RenderChunk(keyed_items):
+  """Converts and renders a chunk of creatives in a worker process.
+
+  Args:
+    keyed_items: list of (key, creative dictionary) tuples
+  Returns:
+    a list of (key, rendered) tuples, where rendered is the output of
+    ReportFiles.Render for the creative
+  """
+  return [(key, _ConvertAndRender(item)) for key, item in keyed_items]
+
+
+def RenderSnippetStatusItems(keyed_items, workers,
+                             chunk_size=DEFAULT_CHUNK_SIZE):
+  """Converts and renders creatives in a pool of worker processes.
+
+  Creatives are sent to the workers in chunks, and at most two chunks per
+  worker are in flight at a time, so memory use does not depend on the
+  number of creatives.  Workers send back the serialized Snippet Status
+  Items along with their text and csv renderings, which the caller appends
+  to the reports with ReportFiles.WriteRendered without parsing them again.
+
+  Args:
+    keyed_items: iterable of (key, creative dictionary) tuples; keys are
+        passed through unchanged, e.g. to tell accounts apart
+    workers: number of worker processes
+    chunk_size: number of creatives sent to a worker at a time
+  Yields:
+    (key, rendered) tuples, in the order of keyed_items
+  """
+  pool = multiprocessing.Pool(workers)
+  try:
+    pending = collections.deque()
+    chunk = []
+    for keyed_item in keyed_items:
+      chunk.append(keyed_item)
+      if len(chunk) == chunk_size:
+        pending.append(pool.apply_async(_RenderChunk, (chunk,)))
+        chunk = []
+        if len(pending) >= 2 * workers:
+          for rendered_item in pending.popleft().get():
+            yield rendered_item
+    if chunk:
+      pending.append(pool.apply_async(_RenderChunk, (chunk,)))
+    while pending:
+      for rendered_item in pending.popleft().get():
+        yield rendered_item
+    pool.close()
+  finally:
+    pool.terminate()
+    pool.join()
 
-  def FieldAsString(field, value):
-    """Generates string value for a field.  Handles repeated fields."""
-    if field.label == descriptor.FieldDescriptor.LABEL_REPEATED:
-      items = [FieldSingletonAsString(field, item) for item in value]
-      return '[%s]' % (';'.join(items))
+
+def _RenderSerially(keyed_items, profile=None):
+  """Converts and renders creatives one at a time, like _RenderChunk."""
+  for key, item in keyed_items:
+    yield key, _ConvertAndRender(item, profile)
+
+
+def _LookUpPrevious(item, state):
+  """Returns the key, content hash and previous (hash, item) of a creative."""
+  creative_key = ssr_state.CreativeKey(item)
+  content_hash = ssr_state.ContentHash(item)
+  return creative_key, content_hash, state.Get(creative_key)
+
+
+def _RenderIncrementally(keyed_items, state, changes, profile=None):
+  """Renders creatives, reusing the Snippet Status Items of unchanged ones.
+
+  Only creatives that were not in the previous run, or whose content has
+  changed since, are converted again.  The pb renderings of the items are
+  recorded in state, and the other formats rendered from them.
+
+  Args:
+    keyed_items: iterable of (key, creative dictionary) tuples
+    state: ssr_state.ReportState of the previous run; the current creatives
+        are recorded in it
+    changes: dictionary counting the creatives of each change
+    profile: ssr_profile.Profile timing the stages, if any
+  Yields:
+    (key, change, rendered) tuples, where change is ADDED, CHANGED or
+    UNCHANGED
+  """
+  for key, item in keyed_items:
+    if profile is None:
+      creative_key, content_hash, previous = _LookUpPrevious(item, state)
     else:
-      return FieldSingletonAsString(field, value)
+      with profile.Stage('state_lookup'):
+        creative_key, content_hash, previous = _LookUpPrevious(item, state)
+    if previous is not None and previous[0] == content_hash:
+      change = UNCHANGED
+      rendered = ReportFiles.RenderFramed(previous[1], profile)
+    else:
+      change = ADDED if previous is None else CHANGED
+      rendered = _ConvertAndRender(item, profile)
+    state.Put(creative_key, content_hash, _PbRendering(rendered))
+    changes[change] += 1
+    yield key, change, rendered
 
-  def SnippetStatusColumns(snippet_status):
-    """Generates columns for a snippet status row."""
-    for field in active_fields:
-      yield FieldAsString(field, getattr(snippet_status, field.name, None))
 
-  for snippet_status in report.snippet_status:
-    columns = list(SnippetStatusColumns(snippet_status))
-    writer.writerow(columns)
+def _PbRendering(rendered):
+  """Returns the pb rendering of a tuple returned by ReportFiles.Render."""
+  return rendered[[writer_class for _, _, writer_class
+                   in ReportFiles._OUTPUTS].index(ProtoReportWriter)]
 
 
-def main(argv):
+def OpenReports(keys, merge=False, basename=REPORT_BASENAME, profile=None):
+  """Opens the report files creatives are written to.
+
+  Args:
+    keys: keys of the creatives, e.g. buyer account IDs, or None for the
+        creatives of the authorized account
+    merge: whether to write a single report for all keys
+    basename: base name of the report files; reports of keys other than
+        None are named <basename>_<key> unless merged
+    profile: ssr_profile.Profile of the writes to the reports, if any
+  Returns:
+    a dictionary of the ReportFiles of each key
+  """
+  reports = {}
+  merged_report = None
+  try:
+    for key in keys:
+      if merge or key is None:
+        if merged_report is None:
+          merged_report = ReportFiles(basename, profile)
+        reports[key] = merged_report
+      else:
+        reports[key] = ReportFiles('%s_%s' % (basename, key), profile)
+  except IOError:
+    CloseReports(reports)
+    raise
+  return reports
+
+
+def OpenDeltaReports(basename=REPORT_BASENAME, profile=None):
+  """Opens the reports of added, changed and removed creatives.
+
+  Returns:
+    a dictionary of the ReportFiles of ADDED, CHANGED and REMOVED, named
+    <basename>_<change>
+  """
+  return OpenReports((ADDED, CHANGED, REMOVED), basename=basename,
+                     profile=profile)
+
+
+def CloseReports(reports):
+  """Closes the ReportFiles returned by OpenReports."""
+  for report in set(reports.itervalues()):
+    report.Close()
+
+
+def WriteReports(keyed_creatives, reports, workers=1, state=None,
+                 delta_reports=None, profile=None):
+  """Converts creatives and appends them to their reports.
+
+  Args:
+    keyed_creatives: iterable of (key, creative dictionary) tuples
+    reports: dictionary of the ReportFiles each key is written to, as
+        returned by OpenReports; may be empty to only write delta reports
+    workers: number of processes converting the creatives; must be 1 with
+        state
+    state: ssr_state.ReportState of the previous run.  Creatives unchanged
+        since are not converted again, and the current creatives are
+        recorded in it.
+    delta_reports: ReportFiles of the added, changed and removed creatives,
+        as returned by OpenDeltaReports; requires state
+    profile: ssr_profile.Profile timing the conversion and rendering, if any.
+        With several workers, only the time spent waiting for them is known.
+  Returns:
+    a dictionary counting the creatives of each change when state is given,
+    i.e. the number of ADDED, CHANGED, UNCHANGED and REMOVED creatives
+  Raises:
+    ValueError: if both several workers and state are given
+  """
+  if state is not None and workers > 1:
+    raise ValueError('creatives are converted by a single process with state')
+  if state is None:
+    if workers > 1:
+      rendered_items = RenderSnippetStatusItems(keyed_creatives, workers)
+      if profile is not None:
+        rendered_items = profile.Iterate('render_workers', rendered_items)
+    else:
+      rendered_items = _RenderSerially(keyed_creatives, profile)
+    for key, rendered in rendered_items:
+      reports[key].WriteRendered(rendered)
+    return None
+
+  changes = dict.fromkeys((ADDED, CHANGED, UNCHANGED, REMOVED), 0)
+  delta_reports = delta_reports or {}
+  for key, change, rendered in _RenderIncrementally(keyed_creatives, state,
+                                                    changes, profile):
+    if key in reports:
+      reports[key].WriteRendered(rendered)
+    if change in delta_reports:
+      delta_reports[change].WriteRendered(rendered)
+  for framed in state.Removed():
+    if REMOVED in delta_reports:
+      delta_reports[REMOVED].WriteRendered(
+          ReportFiles.RenderFramed(framed, profile))
+    changes[REMOVED] += 1
+  return changes
+
+
+def WriteAccountReports(creatives, account_ids, merge=False,
+                        basename=REPORT_BASENAME, workers=1):
+  """Writes the reports of several accounts.
+
+  Args:
+    creatives: (account_id, creative dictionary) tuples, as returned by
+        ListAccountsCreatives
+    account_ids: buyer account IDs the creatives belong to
+    merge: whether to write a single report for all accounts instead of one
+        report per account
+    basename: base name of the report files; per account reports are named
+        <basename>_<account id>
+    workers: number of processes converting the creatives
+  """
+  reports = OpenReports(account_ids, merge, basename)
+  try:
+    WriteReports(creatives, reports, workers)
+  finally:
+    CloseReports(reports)
+
+
+def _WriteProfile(profile, path):
+  """Writes the JSON summary of profile to path, or to stderr for '-'."""
+  if path == '-':
+    profile.Write(sys.stderr)
+  else:
+    with open(path, 'w') as profile_file:
+      profile.Write(profile_file)
+
+
+def _KeyedCreativesLister(service, flags):
+  """Returns a function listing the creatives to convert from the API.
+
+  The cache of --cache-dir and the Http objects are created once, and reused
+  by every call of the function, e.g. by each refresh of --daemon.
+
+  The function returns a tuple of an iterable of (report key, creative
+  dictionary) tuples and of the report keys.
+  """
+  cache = None
+  if flags.cache_dir:
+    cache = ssr_cache.FileCache(flags.cache_dir,
+                                flags.cache_size * 1024 * 1024)
+  if flags.account_ids:
+    # List the accounts concurrently, each thread sending its requests
+    # through its own authorized Http object.
+    http_pool = HttpPool(_AuthorizedHttpFactory(service, cache))
+
+    def ListAccounts():
+      creatives = ListAccountsCreatives(
+          service, flags.account_ids, http_pool, flags.threads,
+          flags.max_results, flags.num_retries)
+      return creatives, flags.account_ids
+    return ListAccounts
+  # Fetch the creatives page by page; they are converted as they arrive and
+  # each Snippet Status Item is appended to the reports.
+  http = None
+  if cache is not None:
+    http = _AuthorizedHttpFactory(service, cache)()
+
+  def ListAll():
+    creatives = ListCreatives(service, flags.max_results, http=http,
+                              num_retries=flags.num_retries)
+    return ((None, item) for item in creatives), [None]
+  return ListAll
+
+
+def _ListSavedKeyedCreatives(flags):
+  """Lists the creatives to convert from the --input responses.
+
+  Returns:
+    a tuple of an iterable of (report key, creative dictionary) tuples and
+    of the report keys
+  """
+  creatives = ListSavedCreatives(SavedPagePaths(flags.input, flags.input_dir))
+  if not flags.account_ids:
+    return ((None, item) for item in creatives), [None]
+  # Only the creatives of the requested accounts are converted, each into
+  # the report of its account.
+  account_ids = frozenset(flags.account_ids)
+  creatives = ((item.get(u'accountId'), item) for item in creatives
+               if item.get(u'accountId') in account_ids)
+  return creatives, flags.account_ids
+
+
+def _GenerateReports(creatives, keys, flags, profile,
+                     basename=REPORT_BASENAME):
+  """Writes the reports of the creatives as requested by flags.
+
+  Args:
+    creatives: iterable of (report key, creative dictionary) tuples
+    keys: report keys of the creatives, as passed to OpenReports
+    flags: parsed command-line flags
+    profile: ssr_profile.Profile of the run, if any
+    basename: base name of the reports, as passed to OpenReports
+  Returns:
+    the sorted base names of the reports written
+  """
+  state = None
+  if flags.state:
+    with _Stage(profile, 'state_load'):
+      state = ssr_state.ReportState.Load(flags.state, STATE_VERSION)
+
+  if profile is not None:
+    creatives = profile.Iterate('fetch', creatives, 'creatives')
+  reports = {}
+  delta_reports = {}
+  try:
+    if flags.delta:
+      delta_reports = OpenDeltaReports(basename, profile)
+    else:
+      reports = OpenReports(keys, flags.merge, basename, profile)
+    changes = WriteReports(creatives, reports, flags.workers, state,
+                           delta_reports, profile)
+    if state is not None:
+      with _Stage(profile, 'state_save'):
+        state.Save()
+  finally:
+    CloseReports(reports)
+    CloseReports(delta_reports)
+    if state is not None:
+      # Discards the creatives of the current run if they were not saved.
+      state.Close()
+
+  written_reports = set(reports.values() + delta_reports.values())
+  if flags.index:
+    with _Stage(profile, 'index'):
+      for report in written_reports:
+        ssr_store.WriteIndex(report.basename + '.pb')
+  else:
+    # An index left over from a previous run no longer matches its report.
+    for report in written_reports:
+      index_path = ssr_store.IndexPath(report.basename + '.pb')
+      if os.path.exists(index_path):
+        os.remove(index_path)
+  if flags.summary:
+    # ssr_summary loads numpy, which is only needed with --summary.
+    import ssr_summary  # pylint: disable=g-import-not-at-top
+    with _Stage(profile, 'summary'):
+      for report in written_reports:
+        ssr_summary.WriteSummary(
+            ssr_summary.SummarizeReport(report.basename + '.pb'),
+            report.basename + ssr_summary.SUMMARY_SUFFIX)
+  if flags.columnar:
+    # ssr_columnar loads numpy and pyarrow, which are only needed with
+    # --columnar.
+    import ssr_columnar  # pylint: disable=g-import-not-at-top
+    with _Stage(profile, 'columnar'):
+      for report in written_reports:
+        ssr_columnar.WriteColumns(
+            ssr_store.ReadItems(report.basename + '.pb'), report.basename,
+            flags.parquet)
+  if profile is not None:
+    profile.Snapshot('reports_written')
+  if state is not None:
+    if profile is not None:
+      for change, count in changes.iteritems():
+        profile.Count(change, count)
+    print ('%(added)d added, %(changed)d changed, %(unchanged)d unchanged and '
+           '%(removed)d removed creatives' % changes)
+  return sorted(report.basename for report in written_reports)
+
+
+def _Run(list_creatives, flags, profile, fatal_errors=()):
+  """Generates the reports once, or every --interval seconds with --daemon.
+
+  Args:
+    list_creatives: function returning the creatives to convert and their
+        report keys, like the one returned by _KeyedCreativesLister
+    flags: parsed command-line flags
+    profile: ssr_profile.Profile of the run, if any.  With --daemon, it is
+        written to --profile and reset after each refresh.
+    fatal_errors: exception classes ending the --daemon refreshes
+  """
+  def GenerateReports(directory):
+    try:
+      creatives, keys = list_creatives()
+      return _GenerateReports(creatives, keys, flags, profile,
+                              os.path.join(directory, REPORT_BASENAME))
+    finally:
+      if flags.daemon and profile is not None:
+        _WriteProfile(profile, flags.profile)
+        profile.Reset()
+
+  if not flags.daemon:
+    GenerateReports('')
+    return
+  import ssr_daemon  # pylint: disable=g-import-not-at-top
+
+  report_daemon = ssr_daemon.ReportDaemon(
+      GenerateReports, flags.interval, ('localhost', flags.port),
+      fatal_errors=fatal_errors)
+  try:
+    report_daemon.Run()
+  except KeyboardInterrupt:
+    pass
+
+
+def _Init(argv, offline):
+  """Parses the command-line flags and builds the API service.
+
+  Args:
+    argv: command-line arguments
+    offline: whether saved responses are converted instead of calling the
+        API, in which case there is no service
+  Returns:
+    a (service, flags) tuple
+  """
+  if offline:
+    # Saved responses are converted without authenticating, and without
+    # loading the API client libraries.
+    return None, argparse.ArgumentParser(
+        description=__doc__, parents=[argparser],
+        formatter_class=argparse.RawDescriptionHelpFormatter).parse_args(
+            argv[1:])
+  from apiclient import sample_tools  # pylint: disable=g-import-not-at-top
+
   # Authenticate and construct service.
-  service, _ = sample_tools.init(
-      argv, 'adexchangebuyer', 'v1.3', __doc__, __file__, parents=[argparser],
+  return sample_tools.init(
+      argv, 'adexchangebuyer', 'v1.3', __doc__, __file__,
+      parents=[argparser],
       scope='https://www.googleapis.com/auth/adexchange.buyer')
 
+
+def main(argv):
+  # --profile is read ahead of the other flags so that authentication and
+  # the construction of the service are timed as well.
+  known_flags = argparser.parse_known_args(argv[1:])[0]
+  profile = None
+  if known_flags.profile:
+    profile = ssr_profile.Profile()
+  offline = bool(known_flags.input or known_flags.input_dir)
   try:
-    # Construct a list request.
-    request = service.creatives().list()
-    # Execute the request and store the response.
-    response = request.execute()
-  except client.AccessTokenRefreshError:
-    print ('The credentials have been revoked or expired, please re-run the '
-           'application to re-authorize')
-
-  # Generate a Snippet Status Report Protocol buffer object
-  report = GenerateSnippetStatusReportPBObject(response)
-
-  # Write the report to files in txt, pb and csv format
-  with open('SnippetStatusReport.txt', 'w') as report_txt:
-    text_format.PrintMessage(report, report_txt)
-  with open('SnippetStatusReport.pb', 'wb') as report_pb:
-    report_pb.write(report.SerializeToString())
-  with open('SnippetStatusReport.csv', 'w') as report_csv:
-    WriteSnippetStatusReportInCSV(report, report_csv)
+    with _Stage(profile, 'init'):
+      service, flags = _Init(argv, offline)
+
+    if flags.delta and not flags.state:
+      print '--delta requires --state'
+      return
+    if flags.workers > 1 and flags.state:
+      print '--workers cannot be combined with --state'
+      return
+    if flags.parquet and not flags.columnar:
+      print '--parquet requires --columnar'
+      return
+    if offline:
+      _Run(functools.partial(_ListSavedKeyedCreatives, flags), flags, profile)
+      return
+
+    from oauth2client import client  # pylint: disable=g-import-not-at-top
+    try:
+      _Run(_KeyedCreativesLister(service, flags), flags, profile,
+           (client.AccessTokenRefreshError,))
+    except client.AccessTokenRefreshError:
+      print ('The credentials have been revoked or expired, please re-run the '
+             'application to re-authorize')
+  finally:
+    # With --daemon, the profile of each refresh is written by _Run.
+    if profile is not None and not known_flags.daemon:
+      _WriteProfile(profile, known_flags.profile)
 
 if __name__ == '__main__':
   main(sys.argv)
@@ -0,0 +1,373 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark suite for generate_ssr.
+
+Times each stage of the Snippet Status Report pipeline on synthetic
+creatives.list responses of increasing size, and records the memory used
+while running it.  Creatives are generated from a seed, so runs with the
+same flags process the same data.
+
+Each stage runs in its own process, which streams the generated creatives
+through the stages before it without timing them, and then through the
+timed stage.  The peak RSS of that process, and its tracemalloc peak where
+tracemalloc is available, are recorded with the stage time.
+
+  Usage:
+
+  python generate_ssr_benchmark.py [--sizes N,N,...] [--stages S,S,...]
+                                   [--output FILE]
+                                   [--baseline FILE [--tolerance F]]
+
+Results are written as JSON to --output.  With --baseline, per-item stage
+times are compared with those of an earlier results file, and the program
+exits with status 1 if any stage got slower by more than --tolerance.
+"""
+
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import generate_ssr
+from third_party.protobuf_json import protobuf_json
+import snippet_status_report_pb2
+import ssr_profile
+
+from google.protobuf import __version__ as protobuf_version
+from google.protobuf.internal import api_implementation
+
+try:
+  import tracemalloc  # pylint: disable=g-import-not-at-top
+except ImportError:
+  tracemalloc = None
+
+
+DEFAULT_SIZES = '1000,10000,100000,1000000'
+DEFAULT_SEED = 2014
+
+
+class StageError(Exception):
+  """Raised when the process running a stage fails."""
+
+
+def _IntList(value):
+  return [int(element) for element in value.split(',')]
+
+
+argparser = argparse.ArgumentParser(
+    description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+argparser.add_argument('--sizes', default=_IntList(DEFAULT_SIZES),
+                       type=_IntList,
+                       help='Comma separated numbers of creatives to '
+                       'benchmark.')
+argparser.add_argument('--stages', type=lambda value: value.split(','),
+                       help='Comma separated stages to benchmark; all of them '
+                       'by default.')
+argparser.add_argument('--seed', type=int, default=DEFAULT_SEED,
+                       help='Seed of the synthetic creatives.')
+argparser.add_argument('--max-corrections', dest='max_corrections',
+                       type=int, default=3,
+                       help='Maximum number of corrections per creative.')
+argparser.add_argument('--max-disapproval-reasons',
+                       dest='max_disapproval_reasons', type=int, default=3,
+                       help='Maximum number of disapprovalReasons per '
+                       'creative.')
+argparser.add_argument('--max-filtering-reasons',
+                       dest='max_filtering_reasons', type=int, default=10,
+                       help='Maximum number of filteringReasons.reasons per '
+                       'creative.')
+argparser.add_argument('--max-product-categories',
+                       dest='max_product_categories', type=int, default=20,
+                       help='Maximum number of productCategories per '
+                       'creative.')
+argparser.add_argument('--output', default='benchmark_results.json',
+                       help='File the JSON results are written to.')
+argparser.add_argument('--baseline',
+                       help='Results file of an earlier run to compare with.')
+argparser.add_argument('--tolerance', type=float, default=0.2,
+                       help='Relative per-item slowdown of a stage over the '
+                       'baseline that is reported as a regression.')
+
+
+_CORRECTION_REASONS = (u'VENDOR_IDS', generate_ssr.SSL_ATTRIBUTE,
+                       u'FLASH_ATTRIBUTE', generate_ssr.FLASHLESS_ATTRIBUTE)
+_DISAPPROVAL_REASONS = tuple(
+    value.name for value in snippet_status_report_pb2.SnippetStatusItem
+    .DisapprovalReason.DESCRIPTOR.values)
+_STATUSES = (u'APPROVED', u'DISAPPROVED', u'NOT_CHECKED')
+_AD_SIZES = ((300, 250), (728, 90), (160, 600), (320, 50), (300, 600))
+_ATTRIBUTES = (7, 9, 30, 32, generate_ssr.RICH_MEDIA_CAPABILITY_SSL, 70)
+
+
+def GenerateCreatives(num_items, seed=DEFAULT_SEED, max_corrections=3,
+                      max_disapproval_reasons=3, max_filtering_reasons=10,
+                      max_product_categories=20):
+  """Generates synthetic creatives as returned by creatives.list.
+
+  Args:
+    num_items: number of creatives to generate
+    seed: seed of the random generator; the same seed generates the same
+        creatives
+    max_corrections: maximum number of corrections per creative
+    max_disapproval_reasons: maximum number of disapprovalReasons per
+        disapproved creative
+    max_filtering_reasons: maximum number of filteringReasons.reasons per
+        creative
+    max_product_categories: maximum number of productCategories per creative
+  Yields:
+    creative dictionaries
+  """
+  rand = random.Random(seed)
+  for index in xrange(num_items):
+    width, height = rand.choice(_AD_SIZES)
+    status = rand.choice(_STATUSES)
+    item = {
+        u'kind': u'adexchangebuyer#creative',
+        u'accountId': 10000 + index % 7,
+        u'buyerCreativeId': u'creative-%d' % index,
+        u'HTMLSnippet': u'<a href="http://www.test.com/%d">Ad %d</a>' % (
+            index, index),
+        u'advertiserId': [unicode(rand.randint(1, 99999))
+                          for _ in xrange(rand.randint(1, 2))],
+        u'advertiserName': u'advertiser %d' % rand.randint(1, 500),
+        u'clickThroughUrl': [u'http://www.test.com/landing/%d' %
+                             rand.randint(1, 10000)
+                             for _ in xrange(rand.randint(1, 2))],
+        u'attribute': rand.sample(_ATTRIBUTES, rand.randint(0, 3)),
+        u'width': width,
+        u'height': height,
+        u'status': status,
+        u'productCategories': sorted(rand.sample(
+            xrange(10000, 14000), rand.randint(0, max_product_categories))),
+        u'sensitiveCategories': sorted(rand.sample(xrange(1, 30),
+                                                   rand.randint(0, 2))),
+    }
+    # Creatives have at most one correction of each type.
+    num_corrections = min(rand.randint(0, max_corrections),
+                          len(_CORRECTION_REASONS))
+    item[u'corrections'] = [
+        {u'reason': reason,
+         u'details': [u'correction detail %d' % rand.randint(1, 100)
+                      for _ in xrange(rand.randint(1, 2))]}
+        for reason in rand.sample(_CORRECTION_REASONS, num_corrections)]
+    if status == u'DISAPPROVED' and max_disapproval_reasons:
+      item[u'disapprovalReasons'] = [
+          {u'reason': rand.choice(_DISAPPROVAL_REASONS),
+           u'details': [u'disapproval detail %d' % rand.randint(1, 100)]}
+          for _ in xrange(rand.randint(1, max_disapproval_reasons))]
+    num_filtering_reasons = rand.randint(0, max_filtering_reasons)
+    if num_filtering_reasons:
+      item[u'filteringReasons'] = {
+          u'date': u'2014-%02d-%02d' % (rand.randint(1, 12),
+                                        rand.randint(1, 28)),
+          u'reasons': [{u'filteringStatus': rand.randint(1, 100),
+                        u'filteringCount': rand.randint(1, 1000000)}
+                       for _ in xrange(num_filtering_reasons)]}
+    yield item
+
+
+def _Identity(item):
+  return item
+
+
+def _Normalize(item):
+  generate_ssr._NormalizeItem(item)
+  return item
+
+
+def _Convert(item):
+  snippet_status = snippet_status_report_pb2.SnippetStatusItem()
+  generate_ssr._FillSnippetStatusItem(snippet_status, item)
+  return snippet_status
+
+
+def _ReplaceJSONFields(item):
+  generate_ssr._ReplaceJSONFields(item, generate_ssr.KEY_TRANSLATION, '')
+
+
+def _JSON2PB(item):
+  protobuf_json.json2pb(snippet_status_report_pb2.SnippetStatusItem(), item,
+                        True)
+
+
+def _JSONToPBPlan(item):
+  generate_ssr._JSONToSnippetStatusItem(
+      snippet_status_report_pb2.SnippetStatusItem(), item)
+
+
+# Stages of the pipeline, as (name, prepare, run, writer class) tuples.
+# prepare turns a generated creative into the input of the stage and is not
+# timed; run is the timed stage.  Stages with a writer class time its Write
+# method on a report file instead of run.
+STAGES = collections.OrderedDict((stage[0], stage) for stage in (
+    ('replace_json_fields', _Identity, _ReplaceJSONFields, None),
+    ('translate_json_fields', _Identity, generate_ssr._TranslateJSONFields,
+     None),
+    ('json2pb', _Normalize, _JSON2PB, None),
+    ('json_to_pb_plan', _Normalize, _JSONToPBPlan, None),
+    ('normalize_item', _Identity, generate_ssr._NormalizeItem, None),
+    ('write_txt', _Convert, None, generate_ssr.TextReportWriter),
+    ('write_pb', _Convert, None, generate_ssr.ProtoReportWriter),
+    ('write_csv', _Convert, None, generate_ssr.CSVReportWriter),
+))
+
+
+def RunStage(stage_name, num_items, generator_args):
+  """Runs one stage of the pipeline over synthetic creatives.
+
+  Args:
+    stage_name: key of STAGES
+    num_items: number of creatives to run the stage on
+    generator_args: keyword arguments of GenerateCreatives
+  Returns:
+    a dictionary with the time and memory used by the stage, and the size of
+    the report written by writer stages
+  """
+  _, prepare, run, writer_class = STAGES[stage_name]
+  if tracemalloc:
+    tracemalloc.start()
+  output_dir = tempfile.mkdtemp()
+  try:
+    output_path = os.path.join(output_dir, stage_name)
+    output_bytes = None
+    if writer_class:
+      output = open(output_path, 'wb')
+      run = writer_class(output).Write
+    start_rss = ssr_profile.PeakRSSKilobytes()
+    elapsed = 0.0
+    for item in GenerateCreatives(num_items, **generator_args):
+      stage_input = prepare(item)
+      start = time.time()
+      run(stage_input)
+      elapsed += time.time() - start
+    if writer_class:
+      output.close()
+      output_bytes = os.path.getsize(output_path)
+  finally:
+    shutil.rmtree(output_dir)
+
+  results = {'stage': stage_name,
+             'items': num_items,
+             'seconds': elapsed,
+             'us_per_item': elapsed * 1e6 / num_items if num_items else 0.0,
+             'start_rss_kb': start_rss,
+             'peak_rss_kb': ssr_profile.PeakRSSKilobytes(),
+             'output_bytes': output_bytes,
+             'tracemalloc_peak_kb': None}
+  if tracemalloc:
+    results['tracemalloc_peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+    tracemalloc.stop()
+  return results
+
+
+def _SendStageResults(connection, stage_name, num_items, generator_args):
+  connection.send(RunStage(stage_name, num_items, generator_args))
+  connection.close()
+
+
+def RunStageInProcess(stage_name, num_items, generator_args):
+  """Runs RunStage in a new process, so that its memory is measured alone."""
+  parent_connection, child_connection = multiprocessing.Pipe(duplex=False)
+  process = multiprocessing.Process(
+      target=_SendStageResults,
+      args=(child_connection, stage_name, num_items, generator_args))
+  process.start()
+  # Only the child holds the sending end, so recv fails rather than blocking
+  # forever if the child dies before sending the results.
+  child_connection.close()
+  try:
+    results = parent_connection.recv()
+  except EOFError:
+    results = None
+  finally:
+    parent_connection.close()
+  process.join()
+  if results is None or process.exitcode:
+    raise StageError('stage %s with %d items failed with exit code %s' % (
+        stage_name, num_items, process.exitcode))
+  return results
+
+
+def FindRegressions(results, baseline, tolerance):
+  """Compares per-item stage times with those of a baseline run.
+
+  Args:
+    results: results dictionary of this run
+    baseline: results dictionary of an earlier run
+    tolerance: relative slowdown reported as a regression
+  Returns:
+    a list of (stage, items, baseline us_per_item, us_per_item) tuples for
+    the stages that got slower by more than tolerance
+  """
+  baseline_times = dict(((result['stage'], result['items']),
+                         result['us_per_item'])
+                        for result in baseline['results'])
+  regressions = []
+  for result in results['results']:
+    key = (result['stage'], result['items'])
+    if key in baseline_times and (
+        result['us_per_item'] > baseline_times[key] * (1 + tolerance)):
+      regressions.append(key + (baseline_times[key], result['us_per_item']))
+  return regressions
+
+
+def main(argv):
+  flags = argparser.parse_args(argv[1:])
+  stages = flags.stages or STAGES.keys()
+  for stage_name in stages:
+    if stage_name not in STAGES:
+      argparser.error('unknown stage %s, expected one of %s' % (
+          stage_name, ', '.join(STAGES)))
+  generator_args = {
+      'seed': flags.seed,
+      'max_corrections': flags.max_corrections,
+      'max_disapproval_reasons': flags.max_disapproval_reasons,
+      'max_filtering_reasons': flags.max_filtering_reasons,
+      'max_product_categories': flags.max_product_categories}
+
+  results = {'python': platform.python_version(),
+             'protobuf': protobuf_version,
+             'protobuf_implementation': api_implementation.Type(),
+             'generator': generator_args,
+             'results': []}
+  for num_items in flags.sizes:
+    for stage_name in stages:
+      result = RunStageInProcess(stage_name, num_items, generator_args)
+      results['results'].append(result)
+      print '%-22s %8d items %10.2f us/item %10d KB peak RSS' % (
+          stage_name, num_items, result['us_per_item'], result['peak_rss_kb'])
+
+  with open(flags.output, 'w') as output:
+    json.dump(results, output, indent=2, sort_keys=True)
+
+  if flags.baseline:
+    with open(flags.baseline) as baseline_file:
+      baseline = json.load(baseline_file)
+    regressions = FindRegressions(results, baseline, flags.tolerance)
+    for stage_name, num_items, before, after in regressions:
+      print 'Regression in %s with %d items: %.2f -> %.2f us/item' % (
+          stage_name, num_items, before, after)
+    if regressions:
+      sys.exit(1)
+
+if __name__ == '__main__':
+  main(sys.argv)
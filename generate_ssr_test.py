@@ -15,11 +15,35 @@
 
 """Tests for generate_ssr."""
 
+import BaseHTTPServer
 import contextlib
+import copy
+import csv
+import hashlib
+import json
+import os
+import shutil
+import SocketServer
 import StringIO
+import subprocess
 import sys
+import tempfile
+import threading
+import time
+import urlparse
+
+from apiclient import discovery
+from apiclient import errors
+import httplib2
 
 import generate_ssr
+from third_party.protobuf_json import protobuf_json
+import snippet_status_report_pb2
+import ssr_cache
+import ssr_columnar
+import ssr_profile
+import ssr_state
+import ssr_store
 
 import google.protobuf.text_format as text_format
 
@@ -62,6 +86,9 @@ SAMPLE_RESPONSE = {u'items': [
      u'status': u'DISAPPROVED',
      u'width': 300}]}
 
+# SAMPLE_RESPONSE is translated in place by some of the tests below.
+SAMPLE_RESPONSE_UNTRANSLATED = copy.deepcopy(SAMPLE_RESPONSE)
+
 SAMPLE_RESPONSE_TRANSLATED= {u'items': [
     {u'HTMLSnippet': u'<a href="http://www.test.com">Hi there!</a>',
      u'accountId': 123456789,
@@ -138,6 +165,667 @@ FLASHLESS_ATTRIBUTE_INCLUDED = {
                             FLASHLESS_ATTRIBUTE_CORRECTION]}
 
 
+def _IsSSLCapable(item):
+  """Reference implementation of the is_ssl_capable derived field.
+
+  Args:
+    item: a dictionary that represents one Snippet Status Item
+  Returns:
+    True if 1. RICH_MEDIA_CAPABILITY_SSL is declared in the attribute
+            2. The snippet is not disapproved for INVALID_SSL_DECLARATION
+            3. The snippet is not corrected for SSL_ATTRIBUTE
+    False otherwise
+  """
+  if generate_ssr.RICH_MEDIA_CAPABILITY_SSL not in item.get('attribute', []):
+    return False
+  for disapproval_reason in item.get('disapproval_reason', []):
+    if (disapproval_reason.get('reason', None) ==
+        generate_ssr.INVALID_SSL_DECLARATION):
+      return False
+  for snippet_correction in item.get('snippet_correction', []):
+    if snippet_correction.get('type', None) == generate_ssr.SSL_ATTRIBUTE:
+      return False
+  return True
+
+
+class FakeRequest(object):
+  """Stand-in for an apiclient HttpRequest serving one canned page."""
+
+  def __init__(self, pages, page_index, log):
+    self.pages = pages
+    self.page_index = page_index
+    self.log = log
+
+  def execute(self, http=None, num_retries=0):
+    self.log.append(self.page_index)
+    page = self.pages[self.page_index]
+    if isinstance(page, Exception):
+      raise page
+    return page
+
+
+class FakeCreatives(object):
+  """Stand-in for service.creatives() serving canned creatives.list pages."""
+
+  def __init__(self, pages):
+    self.pages = pages
+    self.executed = []
+    self.list_kwargs = None
+
+  def list(self, **kwargs):
+    self.list_kwargs = kwargs
+    return FakeRequest(self.pages, 0, self.executed)
+
+  def list_next(self, request, response):
+    if 'nextPageToken' not in response:
+      return None
+    return FakeRequest(self.pages, request.page_index + 1, self.executed)
+
+
+class FakeService(object):
+
+  def __init__(self, pages):
+    self._creatives = FakeCreatives(pages)
+
+  def creatives(self):
+    return self._creatives
+
+
+def TestListCreatives():
+  pages = [{u'items': [{u'buyerCreativeId': u'a'}, {u'buyerCreativeId': u'b'}],
+            u'nextPageToken': u'token1'},
+           {u'nextPageToken': u'token2'},
+           {u'items': [{u'buyerCreativeId': u'c'}]}]
+  service = FakeService(pages)
+  creatives = generate_ssr.ListCreatives(service, max_results=2)
+
+  # Pages are only fetched once the creatives are consumed.
+  assert service.creatives().executed == []
+  assert creatives.next()[u'buyerCreativeId'] == u'a'
+  assert service.creatives().list_kwargs == {'maxResults': 2}
+
+  remaining = [item[u'buyerCreativeId'] for item in creatives]
+  assert remaining == [u'b', u'c']
+  assert service.creatives().executed == [0, 1, 2]
+
+
+def TestListCreativesPrefetch():
+  threads = threading.active_count()
+  pages = [{u'items': [{u'buyerCreativeId': unicode(index)}],
+            u'nextPageToken': u'token'} for index in xrange(10)]
+  service = FakeService(pages)
+  creatives = generate_ssr.ListCreatives(service)
+  assert creatives.next()[u'buyerCreativeId'] == u'0'
+  # The fetching thread runs ahead by a page in the queue and one waiting
+  # to be put in it, and then blocks until the next page is consumed.
+  executed = service.creatives().executed
+  deadline = time.time() + 10
+  while len(executed) < 3 and time.time() < deadline:
+    time.sleep(0.01)
+  assert executed == [0, 1, 2], executed
+  creatives.close()
+  assert threading.active_count() == threads
+
+  service = FakeService([pages[0], ValueError('failed')])
+  creatives = generate_ssr.ListCreatives(service)
+  assert creatives.next()[u'buyerCreativeId'] == u'0'
+  try:
+    creatives.next()
+  except ValueError:
+    pass
+  else:
+    assert False, 'ValueError not raised'
+  assert threading.active_count() == threads
+
+
+# Minimal discovery document for creatives.list of the Ad Exchange Buyer API.
+DISCOVERY_DOCUMENT = {
+    'kind': 'discovery#restDescription',
+    'discoveryVersion': 'v1',
+    'id': 'adexchangebuyer:v1.3',
+    'name': 'adexchangebuyer',
+    'version': 'v1.3',
+    'protocol': 'rest',
+    'servicePath': 'adexchangebuyer/v1.3/',
+    'resources': {'creatives': {'methods': {'list': {
+        'id': 'adexchangebuyer.creatives.list',
+        'path': 'creatives',
+        'httpMethod': 'GET',
+        'parameters': {
+            'accountId': {'type': 'integer', 'repeated': True,
+                          'location': 'query'},
+            'maxResults': {'type': 'integer', 'location': 'query'},
+            'pageToken': {'type': 'string', 'location': 'query'}},
+        'response': {'$ref': 'CreativesList'}}}}},
+    'schemas': {'CreativesList': {
+        'id': 'CreativesList',
+        'type': 'object',
+        'properties': {'items': {'type': 'array', 'items': {'type': 'any'}},
+                       'nextPageToken': {'type': 'string'}}}}}
+
+
+class FakeAdExchangeBuyerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """Serves canned creatives.list pages of FakeAdExchangeBuyerServer."""
+
+  def do_GET(self):  # pylint: disable=invalid-name
+    query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+    account_id = int(query['accountId'][0])
+    page_index = int(query.get('pageToken', ['0'])[0])
+    with self.server.lock:
+      self.server.requests.append((account_id, page_index))
+      rate_limited = account_id in self.server.rate_limited
+      self.server.rate_limited.discard(account_id)
+    if rate_limited:
+      self.send_response(429)
+      self.end_headers()
+      return
+
+    pages = self.server.pages.get(account_id, [{}])
+    page = dict(pages[page_index])
+    if page_index + 1 < len(pages):
+      page['nextPageToken'] = str(page_index + 1)
+    content = json.dumps(page)
+    etag = '"%s"' % hashlib.sha1(content).hexdigest()
+    if self.headers.get('If-None-Match') == etag:
+      with self.server.lock:
+        self.server.not_modified.append((account_id, page_index))
+      self.send_response(304)
+      self.send_header('ETag', etag)
+      self.end_headers()
+      return
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(content)))
+    # Like the API, responses have an ETag but have to be revalidated.
+    self.send_header('ETag', etag)
+    self.send_header('Cache-Control', 'private, max-age=0, must-revalidate')
+    self.end_headers()
+    self.wfile.write(content)
+
+  def log_message(self, *unused_args):
+    pass
+
+
+class FakeAdExchangeBuyerServer(SocketServer.ThreadingMixIn,
+                                BaseHTTPServer.HTTPServer):
+  """Local stand-in for the Ad Exchange Buyer API serving creatives.list.
+
+  Args:
+    pages: dictionary of the creatives.list pages of each account ID; page
+        tokens are page indexes, and unknown accounts have no creatives
+    rate_limited: account IDs whose first request is answered with a 429
+  """
+  daemon_threads = True
+
+  def __init__(self, pages, rate_limited=()):
+    BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                       FakeAdExchangeBuyerHandler)
+    self.pages = pages
+    self.rate_limited = set(rate_limited)
+    self.requests = []
+    self.not_modified = []
+    self.lock = threading.Lock()
+
+  def __enter__(self):
+    self._thread = threading.Thread(target=self.serve_forever)
+    self._thread.daemon = True
+    self._thread.start()
+    return self
+
+  def __exit__(self, unused_type, unused_value, unused_traceback):
+    self.shutdown()
+    # shutdown returns before the serving thread has ended.
+    self._thread.join()
+    self.server_close()
+
+  def BuildService(self):
+    document = dict(DISCOVERY_DOCUMENT,
+                    rootUrl='http://127.0.0.1:%d/' % self.server_address[1])
+    return discovery.build_from_document(json.dumps(document),
+                                         http=httplib2.Http())
+
+
+def _AccountPages(account_id, page_sizes):
+  """Generates creatives.list pages for an account."""
+  pages = []
+  for page_index, page_size in enumerate(page_sizes):
+    items = []
+    for item_index in xrange(page_size):
+      item = copy.deepcopy(SAMPLE_RESPONSE_UNTRANSLATED['items'][0])
+      item[u'accountId'] = account_id
+      item[u'buyerCreativeId'] = u'%d-%d-%d' % (account_id, page_index,
+                                                item_index)
+      items.append(item)
+    pages.append({u'items': items} if items else {})
+  return pages
+
+
+def TestListAccountsCreatives():
+  pages = {1: _AccountPages(1, [2, 0, 1]),
+           2: _AccountPages(2, [3]),
+           3: _AccountPages(3, [1, 1])}
+  created = []
+
+  def HttpFactory():
+    created.append(httplib2.Http())
+    return created[-1]
+
+  with FakeAdExchangeBuyerServer(pages, rate_limited=[2]) as server:
+    service = server.BuildService()
+    creatives = generate_ssr.ListAccountsCreatives(
+        service, [1, 2, 3], generate_ssr.HttpPool(HttpFactory), threads=2,
+        num_retries=1)
+    listed = {}
+    for account_id, item in creatives:
+      listed.setdefault(account_id, []).append(item[u'buyerCreativeId'])
+
+  assert listed == {1: [u'1-0-0', u'1-0-1', u'1-2-0'],
+                    2: [u'2-0-0', u'2-0-1', u'2-0-2'],
+                    3: [u'3-0-0', u'3-1-0']}
+  # The rate limited request was retried.
+  assert server.requests.count((2, 0)) == 2
+  assert 1 <= len(created) <= 2
+
+
+def TestListAccountsCreativesError():
+  with FakeAdExchangeBuyerServer({1: _AccountPages(1, [1])},
+                                 rate_limited=[1]) as server:
+    creatives = generate_ssr.ListAccountsCreatives(
+        server.BuildService(), [1], generate_ssr.HttpPool(httplib2.Http),
+        num_retries=0)
+    try:
+      list(creatives)
+    except errors.HttpError as e:
+      assert e.resp.status == 429
+    else:
+      assert False, 'HttpError not raised'
+
+
+def TestListAccountsCreativesClosed():
+  # Enough pages for the listing threads to block on the full queue.
+  pages = dict((account_id, _AccountPages(account_id, [1] * 10))
+               for account_id in (1, 2, 3))
+  threads = threading.active_count()
+  with FakeAdExchangeBuyerServer(pages) as server:
+    server_threads = threading.active_count()
+    creatives = generate_ssr.ListAccountsCreatives(
+        server.BuildService(), [1, 2, 3], generate_ssr.HttpPool(httplib2.Http),
+        threads=2)
+    assert creatives.next()[1][u'buyerCreativeId'].endswith(u'-0-0')
+    time.sleep(0.5)
+    creatives.close()
+    assert threading.active_count() == server_threads
+  # The accounts not listed yet were skipped.
+  assert len(server.requests) < 30
+  assert threading.active_count() == threads
+
+
+def TestListCreativesCached():
+  pages = {1: _AccountPages(1, [2, 1])}
+  cache_dir = tempfile.mkdtemp()
+  try:
+    with FakeAdExchangeBuyerServer(pages) as server:
+      service = server.BuildService()
+      listed = []
+      for _ in xrange(2):
+        http = httplib2.Http(cache=ssr_cache.FileCache(cache_dir))
+        listed.append([item[u'buyerCreativeId']
+                       for item in generate_ssr.ListCreatives(
+                           service, http=http, accountId=1)])
+      # The second listing was answered from the cache.
+      assert listed == [[u'1-0-0', u'1-0-1', u'1-1-0']] * 2
+      assert server.requests == [(1, 0), (1, 1)] * 2
+      assert server.not_modified == [(1, 0), (1, 1)]
+
+      # A changed page is downloaded again.
+      pages[1][1][u'items'][0][u'buyerCreativeId'] = u'changed'
+      http = httplib2.Http(cache=ssr_cache.FileCache(cache_dir))
+      assert [item[u'buyerCreativeId']
+              for item in generate_ssr.ListCreatives(
+                  service, http=http, accountId=1)] == [
+                      u'1-0-0', u'1-0-1', u'changed']
+      assert server.not_modified == [(1, 0), (1, 1), (1, 0)]
+  finally:
+    shutil.rmtree(cache_dir)
+
+
+def TestKeyedCreativesLister():
+  pages = {1: _AccountPages(1, [2, 1]), 2: _AccountPages(2, [1])}
+  cache_dir = tempfile.mkdtemp()
+  authorized_http_factory = generate_ssr._AuthorizedHttpFactory
+  caches = []
+  https = []
+
+  def UnauthorizedHttpFactory(unused_service, cache=None):
+    caches.append(cache)
+
+    def NewHttp():
+      https.append(httplib2.Http(cache=cache))
+      return https[-1]
+    return NewHttp
+
+  generate_ssr._AuthorizedHttpFactory = UnauthorizedHttpFactory
+  try:
+    with FakeAdExchangeBuyerServer(pages) as server:
+      flags = generate_ssr.argparser.parse_args([
+          '--account-ids', '1,2', '--threads', '1', '--cache-dir', cache_dir])
+      list_creatives = generate_ssr._KeyedCreativesLister(
+          server.BuildService(), flags)
+      for _ in xrange(3):
+        creatives, keys = list_creatives()
+        assert keys == [1, 2]
+        assert len(list(creatives)) == 4
+      # The cache and the Http objects are shared by the listings.
+      assert len(caches) == 1
+      assert isinstance(caches[0], ssr_cache.FileCache)
+      assert len(https) == 1
+      assert len(server.not_modified) == 6
+  finally:
+    generate_ssr._AuthorizedHttpFactory = authorized_http_factory
+    shutil.rmtree(cache_dir)
+
+
+def TestWriteAccountReports():
+  pages = {1: _AccountPages(1, [2]), 2: _AccountPages(2, [1])}
+  output_dir = tempfile.mkdtemp()
+  try:
+    basename = os.path.join(output_dir, 'SnippetStatusReport')
+    with FakeAdExchangeBuyerServer(pages) as server:
+      service = server.BuildService()
+      http_pool = generate_ssr.HttpPool(httplib2.Http)
+      generate_ssr.WriteAccountReports(
+          generate_ssr.ListAccountsCreatives(service, [1, 2, 3], http_pool),
+          [1, 2, 3], basename=basename)
+      generate_ssr.WriteAccountReports(
+          generate_ssr.ListAccountsCreatives(service, [1, 2, 3], http_pool),
+          [1, 2, 3], merge=True, basename=basename)
+
+    def ReadReport(path):
+      report = snippet_status_report_pb2.SnippetStatusReport()
+      with open(path, 'rb') as report_pb:
+        report.ParseFromString(report_pb.read())
+      return sorted(snippet_status.buyer_creative_id
+                    for snippet_status in report.snippet_status)
+
+    assert ReadReport(basename + '_1.pb') == [u'1-0-0', u'1-0-1']
+    assert ReadReport(basename + '_2.pb') == [u'2-0-0']
+    assert ReadReport(basename + '_3.pb') == []
+    assert os.path.exists(basename + '_3.csv')
+    assert ReadReport(basename + '.pb') == [u'1-0-0', u'1-0-1', u'2-0-0']
+  finally:
+    shutil.rmtree(output_dir)
+
+
+def _ReadReportFiles(basename):
+  contents = []
+  for extension in ('.txt', '.pb', '.csv'):
+    with open(basename + extension, 'rb') as report_file:
+      contents.append(report_file.read())
+  return contents
+
+
+def TestRenderSnippetStatusItemsMatchesSerial():
+  items = (_AccountPages(1, [7])[0][u'items'] +
+           _AccountPages(2, [5])[0][u'items'])
+  output_dir = tempfile.mkdtemp()
+  try:
+    serial = os.path.join(output_dir, 'serial')
+    with generate_ssr.ReportFiles(serial) as report:
+      generate_ssr.WriteReports([(None, item) for item in copy.deepcopy(items)],
+                                {None: report})
+
+    parallel = os.path.join(output_dir, 'parallel')
+    with generate_ssr.ReportFiles(parallel) as report:
+      keyed_items = [(item[u'accountId'], item) for item in items]
+      rendered_items = list(generate_ssr.RenderSnippetStatusItems(
+          keyed_items, workers=2, chunk_size=3))
+      assert [key for key, _ in rendered_items] == [1] * 7 + [2] * 5
+      for _, rendered in rendered_items:
+        report.WriteRendered(rendered)
+
+    assert _ReadReportFiles(parallel) == _ReadReportFiles(serial)
+
+    keyed_items = [(item[u'accountId'], item) for item in items]
+    generate_ssr.WriteAccountReports(
+        copy.deepcopy(keyed_items), [1, 2], basename=serial)
+    generate_ssr.WriteAccountReports(
+        copy.deepcopy(keyed_items), [1, 2], basename=parallel, workers=3)
+    for account_id in (1, 2):
+      assert (_ReadReportFiles('%s_%d' % (parallel, account_id)) ==
+              _ReadReportFiles('%s_%d' % (serial, account_id)))
+  finally:
+    shutil.rmtree(output_dir)
+
+
+def TestWriteReportsIncrementally():
+  creatives = _AccountPages(1, [4])[0][u'items']
+  output_dir = tempfile.mkdtemp()
+  fill_snippet_status_item = generate_ssr._FillSnippetStatusItem
+  converted = []
+
+  def CountingFillSnippetStatusItem(snippet_status, item):
+    converted.append(item[u'buyerCreativeId'])
+    fill_snippet_status_item(snippet_status, item)
+
+  def Run(creatives, basename, delta=False):
+    reports = {}
+    delta_reports = {}
+    try:
+      if delta:
+        delta_reports = generate_ssr.OpenDeltaReports(basename)
+      else:
+        reports = generate_ssr.OpenReports([None], basename=basename)
+      keyed_creatives = [(None, item) for item in copy.deepcopy(creatives)]
+      return generate_ssr.WriteReports(keyed_creatives, reports, state=state,
+                                       delta_reports=delta_reports)
+    finally:
+      generate_ssr.CloseReports(reports)
+      generate_ssr.CloseReports(delta_reports)
+
+  def ReadIds(path):
+    report = snippet_status_report_pb2.SnippetStatusReport()
+    with open(path, 'rb') as report_pb:
+      report.ParseFromString(report_pb.read())
+    return [snippet_status.buyer_creative_id
+            for snippet_status in report.snippet_status]
+
+  generate_ssr._FillSnippetStatusItem = CountingFillSnippetStatusItem
+  try:
+    state_path = os.path.join(output_dir, 'state')
+    basename = os.path.join(output_dir, 'SnippetStatusReport')
+    state = ssr_state.ReportState.Load(state_path, generate_ssr.STATE_VERSION)
+    changes = Run(creatives, basename + '_first')
+    assert changes == {'added': 4, 'changed': 0, 'unchanged': 0, 'removed': 0}
+    assert len(converted) == 4
+    state.Save()
+
+    # Change one creative, remove another and add a new one.
+    creatives[1][u'status'] = u'APPROVED'
+    del creatives[2]
+    creatives.append(_AccountPages(1, [5])[0][u'items'][4])
+    del converted[:]
+    state = ssr_state.ReportState.Load(state_path, generate_ssr.STATE_VERSION)
+    changes = Run(creatives, basename)
+    assert changes == {'added': 1, 'changed': 1, 'unchanged': 2, 'removed': 1}
+    assert converted == [u'1-0-1', u'1-0-4']
+
+    # Reused renderings produce the same reports as a full run.
+    generate_ssr.WriteAccountReports(
+        [(None, item) for item in copy.deepcopy(creatives)], [None],
+        basename=basename + '_full')
+    assert _ReadReportFiles(basename) == _ReadReportFiles(basename + '_full')
+    state.Save()
+
+    # Delta reports only contain the changes.
+    del converted[:]
+    state = ssr_state.ReportState.Load(state_path, generate_ssr.STATE_VERSION)
+    creatives[0][u'width'] = 728
+    changes = Run(creatives, basename + '_delta', delta=True)
+    assert changes == {'added': 0, 'changed': 1, 'unchanged': 3, 'removed': 0}
+    assert converted == [u'1-0-0']
+    assert ReadIds(basename + '_delta_changed.pb') == [u'1-0-0']
+    assert ReadIds(basename + '_delta_added.pb') == []
+    assert ReadIds(basename + '_delta_removed.pb') == []
+    assert not os.path.exists(basename + '_delta.pb')
+  finally:
+    generate_ssr._FillSnippetStatusItem = fill_snippet_status_item
+    shutil.rmtree(output_dir)
+
+
+def TestStage():
+  with generate_ssr._Stage(None, 'unprofiled'):
+    pass
+  profile = ssr_profile.Profile(trace_memory=False)
+  try:
+    with generate_ssr._Stage(profile, 'failing'):
+      raise ValueError('failed')
+  except ValueError:
+    pass
+  # The stage was exited, so the next one is not nested in it.
+  with generate_ssr._Stage(profile, 'next'):
+    time.sleep(0.01)
+  stages = profile.Summary()['stage_seconds']
+  assert sorted(stages) == ['failing', 'next']
+  assert stages['failing'] < stages['next']
+
+
+def TestWriteReportsProfile():
+  creatives = _AccountPages(1, [3])[0][u'items']
+  output_dir = tempfile.mkdtemp()
+  try:
+    basename = os.path.join(output_dir, 'SnippetStatusReport')
+    generate_ssr.WriteAccountReports(
+        [(None, item) for item in copy.deepcopy(creatives)], [None],
+        basename=basename + '_plain')
+    profile = ssr_profile.Profile(trace_memory=False)
+    reports = generate_ssr.OpenReports([None], basename=basename,
+                                       profile=profile)
+    try:
+      generate_ssr.WriteReports(
+          profile.Iterate('fetch', [(None, item) for item in creatives],
+                          'creatives'),
+          reports, profile=profile)
+    finally:
+      generate_ssr.CloseReports(reports)
+
+    # Profiling does not change the reports.
+    assert _ReadReportFiles(basename) == _ReadReportFiles(basename + '_plain')
+    summary = profile.Summary()
+    assert summary['counters'] == {'creatives': 3}
+    for extension in ('txt', 'pb', 'csv'):
+      assert (summary['bytes_written'][extension] ==
+              os.path.getsize('%s.%s' % (basename, extension)))
+      assert 'render_' + extension in summary['stage_seconds']
+      assert 'write_' + extension in summary['stage_seconds']
+    assert 'convert' in summary['stage_seconds']
+  finally:
+    shutil.rmtree(output_dir)
+
+
+def TestOfflineInput():
+  pages = _AccountPages(1, [2, 1]) + _AccountPages(2, [2])
+  output_dir = tempfile.mkdtemp()
+  cwd = os.getcwd()
+  try:
+    input_dir = os.path.join(output_dir, 'pages')
+    os.mkdir(input_dir)
+    for index, page in enumerate(pages[:2]):
+      with open(os.path.join(input_dir, 'page%d.json' % index), 'w') as f:
+        json.dump(page, f)
+    list_path = os.path.join(output_dir, 'pages.json')
+    with open(list_path, 'w') as f:
+      json.dump(pages[2:], f)
+
+    paths = generate_ssr.SavedPagePaths([list_path], input_dir)
+    assert [os.path.basename(path) for path in paths] == [
+        'pages.json', 'page0.json', 'page1.json']
+    assert [item[u'buyerCreativeId']
+            for item in generate_ssr.ListSavedCreatives(paths)] == [
+                u'2-0-0', u'2-0-1', u'1-0-0', u'1-0-1', u'1-1-0']
+
+    # Saved pages are converted in the order of SavedPagePaths.
+    items = [item for page in pages[2:] + pages[:2]
+             for item in page.get(u'items', [])]
+    generate_ssr.WriteAccountReports(
+        [(None, item) for item in items], [None],
+        basename=os.path.join(output_dir, 'expected'))
+    os.chdir(output_dir)
+    generate_ssr.main(['generate_ssr.py', '--input-dir', input_dir,
+                       '--input', list_path, '--index', '--summary',
+                       '--columnar'])
+    assert (_ReadReportFiles('SnippetStatusReport') ==
+            _ReadReportFiles('expected'))
+    with ssr_store.ReportStore('SnippetStatusReport.pb') as store:
+      assert [item.buyer_creative_id for item in store.Lookup(u'1-1-0')] == [
+          u'1-1-0']
+    with open('SnippetStatusReport_summary.json') as summary_json:
+      assert json.load(summary_json)['items'] == len(items)
+    manifest = ssr_columnar.ReadManifest('SnippetStatusReport_columns')
+    assert manifest['snippet_status']['rows'] == len(items)
+
+    # Without --index, the index of the previous run is removed.
+    generate_ssr.main(['generate_ssr.py', '--input', list_path])
+    assert not os.path.exists('SnippetStatusReport.idx')
+  finally:
+    os.chdir(cwd)
+    shutil.rmtree(output_dir)
+
+
+class FatalError(Exception):
+  pass
+
+
+def TestRunDaemonProfiles():
+  items = _AccountPages(1, [3])[0][u'items']
+  output_dir = tempfile.mkdtemp()
+  cwd = os.getcwd()
+  profile_path = os.path.join(output_dir, 'profile.json')
+  flags = generate_ssr.argparser.parse_args([
+      '--daemon', '--interval', '0', '--port', '0', '--profile',
+      profile_path])
+  profiled_creatives = []
+
+  def ListCreatives():
+    # Each refresh finds the profile of the previous one.
+    if os.path.exists(profile_path):
+      with open(profile_path) as profile_file:
+        profiled_creatives.append(
+            json.load(profile_file)['counters']['creatives'])
+    if len(profiled_creatives) == 2:
+      raise FatalError()
+    creatives = copy.deepcopy(items[:3 - len(profiled_creatives)])
+    return [(None, item) for item in creatives], [None]
+
+  try:
+    os.chdir(output_dir)
+    try:
+      generate_ssr._Run(ListCreatives, flags,
+                        ssr_profile.Profile(trace_memory=False),
+                        (FatalError,))
+    except FatalError:
+      pass
+    else:
+      assert False, 'FatalError not raised'
+    # The metrics of a refresh do not include those of the previous ones.
+    assert profiled_creatives == [3, 2]
+    assert os.path.exists('SnippetStatusReport.pb')
+  finally:
+    os.chdir(cwd)
+    shutil.rmtree(output_dir)
+
+
+def TestLazyAPIClientImports():
+  # The API client libraries are only loaded for live fetches, the daemon
+  # with --daemon, the summaries with --summary and the columnar exports,
+  # with numpy and pyarrow, with --columnar.
+  modules = subprocess.check_output([
+      sys.executable, '-c',
+      'import sys, generate_ssr; print sorted(sys.modules)'])
+  for module in ('apiclient', 'httplib2', 'oauth2client', 'ssr_daemon',
+                 'ssr_summary', 'ssr_columnar', 'numpy', 'pyarrow'):
+    assert repr(module) not in modules, module
+
+
 def TestReplaceKey():
   d = {'old': 'foo'}
   generate_ssr._ReplaceKey(d, 'old', 'new')
@@ -152,19 +840,106 @@ def TestReplaceJSONFields():
   assert translated_response == SAMPLE_RESPONSE_TRANSLATED
 
 
+def TestCompileKeyTranslation():
+  tree = generate_ssr._CompileKeyTranslation({u'a': u'x',
+                                              u'a.b': u'y',
+                                              u'a.b.c': u'z',
+                                              u'd': u'd',
+                                              u'e.f': u'unreachable'})
+  assert tree == [(u'a', u'x', [(u'b', u'y', [(u'c', u'z', [])])]),
+                  (u'd', u'd', [])]
+
+
+def TestTranslateJSONFields():
+  translated_item = copy.deepcopy(SAMPLE_RESPONSE_UNTRANSLATED['items'][0])
+  generate_ssr._TranslateJSONFields(translated_item)
+  assert translated_item == SAMPLE_RESPONSE_TRANSLATED['items'][0]
+
+  replaced_item = copy.deepcopy(SAMPLE_RESPONSE_UNTRANSLATED['items'][0])
+  generate_ssr._ReplaceJSONFields(replaced_item, generate_ssr.KEY_TRANSLATION,
+                                  '')
+  assert translated_item == replaced_item
+
+
 def TestRemoveFlashlessAttributeCorrection():
-  generate_ssr._RemoveFlashlessAttributeCorrection(FLASHLESS_ATTRIBUTE_INCLUDED)
-  assert (SSL_ATTRIBUTE_CORRECTION in
-          FLASHLESS_ATTRIBUTE_INCLUDED['snippet_correction'])
-  assert (FLASHLESS_ATTRIBUTE_CORRECTION not in
-          FLASHLESS_ATTRIBUTE_INCLUDED['snippet_correction'])
+  item = copy.deepcopy(FLASHLESS_ATTRIBUTE_INCLUDED)
+  generate_ssr._NormalizeItem(item)
+  assert SSL_ATTRIBUTE_CORRECTION in item['snippet_correction']
+  assert FLASHLESS_ATTRIBUTE_CORRECTION not in item['snippet_correction']
 
 
 def TestIsSSLCapable():
-  assert generate_ssr._IsSSLCapable(SSL_DECLARED)
-  assert not generate_ssr._IsSSLCapable(SSL_NOT_DECLARED)
-  assert not generate_ssr._IsSSLCapable(SSL_DECLARED_DISAPPROVED_FOR_SSL)
-  assert not generate_ssr._IsSSLCapable(SSL_DECLARED_CORRECTED_FOR_SSL)
+  for item, is_ssl_capable in ((SSL_DECLARED, True),
+                               (SSL_NOT_DECLARED, False),
+                               (SSL_DECLARED_DISAPPROVED_FOR_SSL, False),
+                               (SSL_DECLARED_CORRECTED_FOR_SSL, False)):
+    assert _IsSSLCapable(item) == is_ssl_capable
+    assert generate_ssr._NormalizeItem(copy.deepcopy(item)) == [
+        (u'is_ssl_capable', is_ssl_capable)]
+
+
+def TestNormalizeItem():
+  ssl = generate_ssr.RICH_MEDIA_CAPABILITY_SSL
+  flashless = {u'reason': generate_ssr.FLASHLESS_ATTRIBUTE,
+               u'details': [u'flashless']}
+  ssl_correction = {u'reason': generate_ssr.SSL_ATTRIBUTE,
+                    u'details': [u'ssl']}
+  ssl_disapproval = {u'reason': generate_ssr.INVALID_SSL_DECLARATION}
+  cases = [
+      ({u'attribute': [ssl]}, True),
+      ({u'attribute': [1]}, False),
+      ({}, False),
+      ({u'attribute': [ssl], u'disapprovalReasons': [ssl_disapproval]},
+       False),
+      ({u'attribute': [ssl], u'corrections': [flashless, ssl_correction]},
+       False),
+      ({u'attribute': [ssl], u'corrections': [flashless, flashless]}, True),
+  ]
+  for item, is_ssl_capable in cases:
+    expected = copy.deepcopy(item)
+    generate_ssr._TranslateJSONFields(expected)
+    expected_corrections = [
+        correction for correction in expected.get(u'snippet_correction', [])
+        if correction[u'type'] != generate_ssr.FLASHLESS_ATTRIBUTE]
+    if u'snippet_correction' in expected:
+      expected[u'snippet_correction'] = expected_corrections
+    assert _IsSSLCapable(expected) == is_ssl_capable
+
+    item = copy.deepcopy(item)
+    derived = generate_ssr._NormalizeItem(item)
+    assert derived == [(u'is_ssl_capable', is_ssl_capable)], item
+    assert item == expected, item
+
+  item = copy.deepcopy(SAMPLE_RESPONSE_UNTRANSLATED['items'][0])
+  generate_ssr._NormalizeItem(item)
+  assert item == SAMPLE_RESPONSE_TRANSLATED['items'][0]
+
+
+def TestNormalizationRules():
+  # New derived fields and dropped elements only need new rules.
+  dropped_elements = [
+      generate_ssr.DroppedElements(u'detected_product_category', None, 13)]
+  derived_fields = [
+      generate_ssr.DerivedField(u'has_vendor_correction', [
+          generate_ssr.Condition(u'snippet_correction', u'type',
+                                 u'VENDOR_IDS', True)]),
+      generate_ssr.DerivedField(u'is_not_300_wide', [
+          generate_ssr.Condition(u'width', None, 300, False)])]
+  item = {u'productCategories': [13, 14, 13],
+          u'corrections': [{u'reason': u'VENDOR_IDS'}]}
+  derived = generate_ssr._NormalizeItem(item, dropped_elements,
+                                        derived_fields)
+  assert derived == [(u'has_vendor_correction', True),
+                     (u'is_not_300_wide', True)]
+  assert item == {u'detected_product_category': [14],
+                  u'snippet_correction': [{u'type': u'VENDOR_IDS'}]}
+
+  # Conditions on scalar fields compare the value of the field.
+  for width, is_not_300_wide in ((300, False), (728, True)):
+    derived = generate_ssr._NormalizeItem({u'width': width}, (),
+                                          derived_fields)
+    assert derived == [(u'has_vendor_correction', False),
+                       (u'is_not_300_wide', is_not_300_wide)]
 
 
 def TestGenerateSnippetStatusReport():
@@ -186,12 +961,129 @@ def TestGenerateSnippetStatusReport():
       assert report_csv.getvalue() == expected_csv.read()
 
 
+def TestJSONToPBPlan():
+  assert generate_ssr._SNIPPET_STATUS_PLAN is not None
+
+  translated_item = copy.deepcopy(SAMPLE_RESPONSE_UNTRANSLATED['items'][0])
+  generate_ssr._TranslateJSONFields(translated_item)
+  translated_item[u'status'] = u'2'  # Numeric enum values are accepted too.
+
+  planned = snippet_status_report_pb2.SnippetStatusItem()
+  generate_ssr._ApplyJSONToPBPlan(generate_ssr._SNIPPET_STATUS_PLAN, planned,
+                                  translated_item)
+  generic = snippet_status_report_pb2.SnippetStatusItem()
+  protobuf_json.json2pb(generic, translated_item, True)
+  assert planned.SerializeToString() == generic.SerializeToString()
+  assert planned.status == snippet_status_report_pb2.SnippetStatusItem.APPROVED
+
+
+def TestJSONToSnippetStatusItemMatchesExpectedPB():
+  report = snippet_status_report_pb2.SnippetStatusReport()
+  item = copy.deepcopy(SAMPLE_RESPONSE_UNTRANSLATED['items'][0])
+  generate_ssr._FillSnippetStatusItem(report.snippet_status.add(), item)
+  with open('expected.pb', 'rb') as expected_pb:
+    assert report.SerializeToString() == expected_pb.read()
+
+
+def _TextFormatCSVRow(snippet_status):
+  """Generates a csv row by printing every field value with text_format."""
+  columns = []
+  for field in snippet_status.DESCRIPTOR.fields:
+    if field.name.startswith('DEPRECATED_'):
+      continue
+    value = getattr(snippet_status, field.name)
+    if field.label == field.LABEL_REPEATED:
+      values = [_TextFormatFieldValue(field, element) for element in value]
+      columns.append('[%s]' % ';'.join(values))
+    else:
+      columns.append(_TextFormatFieldValue(field, value))
+  return columns
+
+
+def _TextFormatFieldValue(field, value):
+  with contextlib.closing(StringIO.StringIO()) as buf:
+    text_format.PrintFieldValue(field, value, buf, as_one_line=True)
+    return buf.getvalue()
+
+
+def TestCSVColumnFormatters():
+  snippet_status = snippet_status_report_pb2.SnippetStatusItem(
+      buyer_creative_id=u'quote " backslash \\ newline \n caf\xe9',
+      width=300,
+      is_ssl_capable=False,
+      click_through_url=[u'http://a.test/\u2603', 'http://b.test/'])
+  snippet_status.disapproval_reason.add(detail=[u'no reason set'])
+  snippet_status.snippet_correction.add(
+      type=snippet_status_report_pb2.SnippetStatusItem.SSL_ATTRIBUTE)
+
+  with contextlib.closing(StringIO.StringIO()) as report_csv:
+    writer = generate_ssr.CSVReportWriter(report_csv)
+    report_csv.truncate(0)
+    writer.Write(snippet_status)
+    with contextlib.closing(StringIO.StringIO()) as expected_csv:
+      csv.writer(expected_csv).writerow(_TextFormatCSVRow(snippet_status))
+      assert report_csv.getvalue() == expected_csv.getvalue()
+
+
+def TestEncodeVarint():
+  assert generate_ssr._EncodeVarint(0) == '\x00'
+  assert generate_ssr._EncodeVarint(127) == '\x7f'
+  assert generate_ssr._EncodeVarint(300) == '\xac\x02'
+
+
+def TestStreamingReportWriters():
+  response = copy.deepcopy(SAMPLE_RESPONSE)
+  response['items'].append(copy.deepcopy(response['items'][0]))
+  expected = generate_ssr.GenerateSnippetStatusReportPBObject(
+      copy.deepcopy(response))
+
+  with contextlib.closing(StringIO.StringIO()) as report_txt, \
+       contextlib.closing(StringIO.StringIO()) as report_pb, \
+       contextlib.closing(StringIO.StringIO()) as report_csv:
+    writers = [generate_ssr.TextReportWriter(report_txt),
+               generate_ssr.ProtoReportWriter(report_pb),
+               generate_ssr.CSVReportWriter(report_csv)]
+    for snippet_status in expected.snippet_status:
+      for writer in writers:
+        writer.Write(snippet_status)
+
+    assert report_txt.getvalue() == text_format.MessageToString(expected)
+    assert report_pb.getvalue() == expected.SerializeToString()
+    with contextlib.closing(StringIO.StringIO()) as expected_csv:
+      generate_ssr.WriteSnippetStatusReportInCSV(expected, expected_csv)
+      assert report_csv.getvalue() == expected_csv.getvalue()
+
+
 def main(_):
+  TestListCreatives()
+  TestListCreativesPrefetch()
+  TestListAccountsCreatives()
+  TestListAccountsCreativesError()
+  TestListAccountsCreativesClosed()
+  TestListCreativesCached()
+  TestKeyedCreativesLister()
+  TestWriteAccountReports()
+  TestRenderSnippetStatusItemsMatchesSerial()
+  TestWriteReportsIncrementally()
+  TestStage()
+  TestWriteReportsProfile()
+  TestOfflineInput()
+  TestRunDaemonProfiles()
+  TestLazyAPIClientImports()
   TestReplaceKey()
   TestReplaceJSONFields()
+  TestCompileKeyTranslation()
+  TestTranslateJSONFields()
   TestIsSSLCapable()
+  TestNormalizeItem()
+  TestNormalizationRules()
   TestRemoveFlashlessAttributeCorrection()
   TestGenerateSnippetStatusReport()
+  TestJSONToPBPlan()
+  TestJSONToSnippetStatusItemMatchesExpectedPB()
+  TestCSVColumnFormatters()
+  TestEncodeVarint()
+  TestStreamingReportWriters()
   print 'All Tests Passed'
 
 if __name__ == '__main__':
@@ -0,0 +1,150 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""On-disk cache of HTTP responses, bounded in size.
+
+FileCache implements the cache interface of httplib2, so that an
+httplib2.Http(cache=FileCache(directory)) stores the responses it receives
+with their ETag, sends an If-None-Match conditional request when the URI is
+requested again, and replays the cached response when the server answers
+304 Not Modified.  creatives.list pages that did not change since the
+previous run are then not downloaded again.
+
+Each response is stored in its own file, named after the SHA-1 of its cache
+key, and written to a temporary file first so that concurrent readers only
+see complete entries; temporary files left over by interrupted writes are
+deleted once stale.  When the entries exceed max_bytes, the least recently
+used ones are deleted.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+_ENTRY_SUFFIX = '.cache'
+_TEMP_SUFFIX = '.tmp'
+# Seconds after which a temporary file is left over from an interrupted
+# write rather than being written by another process sharing the directory.
+_STALE_TEMP_SECONDS = 60 * 60
+
+
+class FileCache(object):
+  """Stores cached responses as files of directory.
+
+  Args:
+    directory: directory of the entries, created if it does not exist
+    max_bytes: total size of the entries above which the least recently used
+        ones are evicted
+  """
+
+  def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+    self.directory = directory
+    self.max_bytes = max_bytes
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    self._lock = threading.Lock()
+    self._sizes = {}
+    stale = time.time() - _STALE_TEMP_SECONDS
+    for name in os.listdir(directory):
+      path = os.path.join(directory, name)
+      try:
+        if name.endswith(_ENTRY_SUFFIX):
+          self._sizes[name] = os.path.getsize(path)
+        elif name.endswith(_TEMP_SUFFIX) and os.path.getmtime(path) < stale:
+          os.remove(path)
+      except OSError:
+        # Removed meanwhile, e.g. by another process sharing the directory.
+        pass
+    self._total_bytes = sum(self._sizes.itervalues())
+
+  def _Path(self, key):
+    if isinstance(key, unicode):
+      key = key.encode('utf-8')
+    return os.path.join(self.directory,
+                        hashlib.sha1(key).hexdigest() + _ENTRY_SUFFIX)
+
+  # The lower case method names are those of the httplib2 cache interface.
+  def get(self, key):  # pylint: disable=invalid-name
+    """Returns the cached response of key, or None."""
+    path = self._Path(key)
+    try:
+      with open(path, 'rb') as entry:
+        value = entry.read()
+      # Entries are evicted in the order of their modification times.
+      os.utime(path, None)
+    except (IOError, OSError):
+      return None
+    return value
+
+  def set(self, key, value):  # pylint: disable=invalid-name
+    """Caches the response value of key, evicting entries as needed."""
+    path = self._Path(key)
+    name = os.path.basename(path)
+    if len(value) > self.max_bytes:
+      self.delete(key)
+      return
+    fd, temp_path = tempfile.mkstemp(suffix=_TEMP_SUFFIX, dir=self.directory)
+    try:
+      with os.fdopen(fd, 'wb') as entry:
+        entry.write(value)
+      os.rename(temp_path, path)
+    except (IOError, OSError):
+      try:
+        os.remove(temp_path)
+      except OSError:
+        pass
+      raise
+    with self._lock:
+      self._total_bytes += len(value) - self._sizes.get(name, 0)
+      self._sizes[name] = len(value)
+      if self._total_bytes > self.max_bytes:
+        self._Evict(keep=name)
+
+  def delete(self, key):  # pylint: disable=invalid-name
+    """Removes the cached response of key, if any."""
+    path = self._Path(key)
+    with self._lock:
+      self._Remove(os.path.basename(path))
+
+  def _Remove(self, name):
+    try:
+      os.remove(os.path.join(self.directory, name))
+    except OSError:
+      pass
+    self._total_bytes -= self._sizes.pop(name, 0)
+
+  def _Evict(self, keep):
+    """Deletes the least recently used entries but keep until they fit."""
+    mtimes = []
+    for name in self._sizes:
+      try:
+        mtime = os.path.getmtime(os.path.join(self.directory, name))
+      except OSError:
+        mtime = 0
+      mtimes.append((mtime, name))
+    for _, name in sorted(mtimes):
+      if self._total_bytes <= self.max_bytes:
+        break
+      if name != keep:
+        self._Remove(name)
+
+  @property
+  def total_bytes(self):
+    """The total size of the entries."""
+    return self._total_bytes
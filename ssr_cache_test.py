@@ -0,0 +1,124 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for ssr_cache."""
+
+import os
+import shutil
+import sys
+import tempfile
+
+import ssr_cache
+
+
+def _Touch(cache, key, mtime):
+  """Sets the last use of the entry of key, which orders evictions."""
+  os.utime(cache._Path(key), (mtime, mtime))  # pylint: disable=protected-access
+
+
+def TestFileCache():
+  cache_dir = tempfile.mkdtemp()
+  try:
+    cache = ssr_cache.FileCache(cache_dir)
+    assert cache.get('http://a/') is None
+    cache.set('http://a/', 'response a')
+    cache.set(u'http://b/\xe9', 'response b')
+    assert cache.get('http://a/') == 'response a'
+    assert cache.get(u'http://b/\xe9') == 'response b'
+    cache.set('http://a/', 'new response a')
+    assert cache.get('http://a/') == 'new response a'
+    assert cache.total_bytes == len('new response a') + len('response b')
+
+    # Entries outlive the cache object.
+    cache = ssr_cache.FileCache(cache_dir)
+    assert cache.get('http://a/') == 'new response a'
+    assert cache.total_bytes == len('new response a') + len('response b')
+    cache.delete('http://a/')
+    cache.delete('http://missing/')
+    assert cache.get('http://a/') is None
+    assert cache.total_bytes == len('response b')
+  finally:
+    shutil.rmtree(cache_dir)
+
+
+def TestEviction():
+  cache_dir = tempfile.mkdtemp()
+  try:
+    cache = ssr_cache.FileCache(cache_dir, max_bytes=25)
+    for mtime, key in enumerate(['a', 'b', 'c']):
+      cache.set(key, key * 10)
+      _Touch(cache, key, 1000 + mtime)
+    # Adding c evicted a, the least recently used entry.
+    assert cache.get('a') is None
+    assert cache.total_bytes == 20
+
+    _Touch(cache, 'b', 2000)
+    cache.set('d', 'd' * 10)
+    assert cache.get('c') is None
+    assert cache.get('b') == 'b' * 10
+    assert cache.get('d') == 'd' * 10
+
+    # Responses larger than the cache are not kept.
+    cache.set('b', 'b' * 30)
+    assert cache.get('b') is None
+    assert cache.total_bytes == 10
+    assert len(os.listdir(cache_dir)) == 1
+  finally:
+    shutil.rmtree(cache_dir)
+
+
+def TestTemporaryFiles():
+  cache_dir = tempfile.mkdtemp()
+  rename = os.rename
+  try:
+    cache = ssr_cache.FileCache(cache_dir)
+
+    def FailingRename(unused_source, unused_destination):
+      raise OSError('rename failed')
+    ssr_cache.os.rename = FailingRename
+    try:
+      cache.set('a', 'response a')
+    except OSError:
+      pass
+    else:
+      assert False, 'OSError not raised'
+    finally:
+      ssr_cache.os.rename = rename
+    # The failed write left no temporary file.
+    assert os.listdir(cache_dir) == []
+
+    # Temporary files left by interrupted writes are removed once stale,
+    # but not while another process may still be writing them.
+    for name, mtime in (('stale.tmp', 1000), ('fresh.tmp', None)):
+      with open(os.path.join(cache_dir, name), 'w') as temp_file:
+        temp_file.write('partial')
+      if mtime is not None:
+        os.utime(os.path.join(cache_dir, name), (mtime, mtime))
+    cache = ssr_cache.FileCache(cache_dir)
+    assert os.listdir(cache_dir) == ['fresh.tmp']
+    assert cache.total_bytes == 0
+  finally:
+    ssr_cache.os.rename = rename
+    shutil.rmtree(cache_dir)
+
+
+def main(_):
+  TestFileCache()
+  TestEviction()
+  TestTemporaryFiles()
+  print 'All Tests Passed'
+
+if __name__ == '__main__':
+  main(sys.argv)
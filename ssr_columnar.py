@@ -0,0 +1,362 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Columnar export of Snippet Status Items.
+
+The items are split into tables of typed columns, derived from the
+SnippetStatusItem descriptor:
+  - the snippet_status table has one row per item and one column per scalar
+    field,
+  - each repeated field and sub-message is a child table, e.g.
+    snippet_status.advertiser_id or snippet_status.disapproval_reason.detail,
+    whose rows are those of all the parent rows in turn.  The
+    <field>.offsets column of the parent table has one more entry than the
+    parent has rows, and the children of parent row i are the child rows
+    offsets[i] to offsets[i + 1].  Repeated scalar fields have a single value
+    column, and an optional sub-message has zero or one child row,
+  - a string column is a pair of <column>.offsets and <column>.data columns,
+    where the UTF-8 encoded value of row i is data[offsets[i]:offsets[i + 1]].
+
+WriteColumns writes each column to <basename>_columns/<table>/<column>.npy,
+with a columns.json manifest of the tables.  The .npy files are written
+without NumPy, and LoadTable memory-maps only the columns asked for with
+numpy.load.  WriteColumns(..., parquet=True) also writes each table, with
+pyarrow, to <basename>_parquet/<table>.parquet.  String columns are Arrow
+strings there, and the rows of child tables have a parent column of the row
+of the parent table they belong to instead of the offsets of the parent.
+"""
+
+import array
+import collections
+import json
+import os
+import struct
+import sys
+
+import snippet_status_report_pb2
+
+import google.protobuf.descriptor as descriptor
+
+try:
+  import numpy  # pylint: disable=g-import-not-at-top
+except ImportError:
+  numpy = None
+try:
+  import pyarrow  # pylint: disable=g-import-not-at-top
+  import pyarrow.parquet  # pylint: disable=g-import-not-at-top
+except ImportError:
+  pyarrow = None
+
+
+COLUMNS_SUFFIX = '_columns'
+MANIFEST_NAME = 'columns.json'
+PARQUET_SUFFIX = '_parquet'
+PARQUET_EXTENSION = '.parquet'
+PARENT_COLUMN = 'parent'
+ROOT_TABLE = 'snippet_status'
+VALUE_COLUMN = 'value'
+
+_FIELD = descriptor.FieldDescriptor
+# array typecodes of the columns of each scalar type.  'l' arrays hold C
+# longs, which is why the .npy dtypes are derived from the item sizes.
+_TYPECODES = {
+    _FIELD.CPPTYPE_INT32: 'i',
+    _FIELD.CPPTYPE_INT64: 'l',
+    _FIELD.CPPTYPE_UINT32: 'I',
+    _FIELD.CPPTYPE_UINT64: 'L',
+    _FIELD.CPPTYPE_DOUBLE: 'd',
+    _FIELD.CPPTYPE_FLOAT: 'f',
+    _FIELD.CPPTYPE_BOOL: 'b',
+    _FIELD.CPPTYPE_ENUM: 'i',
+}
+# Offsets are 64 bit where C longs are, 32 bit otherwise.
+_OFFSET_TYPECODE = 'l'
+_DATA_TYPECODE = 'B'
+# .npy kinds of the typecodes; 'b' is only used for bools.
+_NPY_KINDS = {'b': 'b', 'B': 'u', 'i': 'i', 'I': 'u', 'l': 'i', 'L': 'u',
+              'f': 'f', 'd': 'f'}
+_NPY_MAGIC = '\x93NUMPY\x01\x00'
+_NPY_ALIGNMENT = 64
+_BYTE_ORDER = '<' if sys.byteorder == 'little' else '>'
+
+
+def ColumnsPath(basename):
+  """Returns the directory of the columns of the report at basename."""
+  return basename + COLUMNS_SUFFIX
+
+
+def ParquetPath(basename):
+  """Returns the directory of the Parquet tables of the report at basename."""
+  return basename + PARQUET_SUFFIX
+
+
+def _NpyDtype(column):
+  if column.itemsize == 1:
+    return '|%s1' % _NPY_KINDS[column.typecode]
+  return '%s%s%d' % (_BYTE_ORDER, _NPY_KINDS[column.typecode],
+                     column.itemsize)
+
+
+def _WriteNpy(path, column):
+  """Writes an array.array to path in the .npy format."""
+  header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (
+      _NpyDtype(column), len(column))
+  # The data starts aligned, so that memory-mapped columns are too.
+  header += ' ' * (-(len(_NPY_MAGIC) + 2 + len(header) + 1) % _NPY_ALIGNMENT)
+  header += '\n'
+  with open(path, 'wb') as npy_file:
+    npy_file.write(_NPY_MAGIC)
+    npy_file.write(struct.pack('<H', len(header)))
+    npy_file.write(header)
+    column.tofile(npy_file)
+
+
+class _Column(object):
+  """A column of scalar values."""
+
+  def __init__(self, typecode):
+    self.values = array.array(typecode)
+
+  def Append(self, value):
+    self.values.append(value)
+
+  def Arrays(self, name):
+    """Returns the (column name, array.array) of the column."""
+    return [(name, self.values)]
+
+
+class _StringColumn(object):
+  """A column of strings, as the offsets of their ends in UTF-8 data."""
+
+  def __init__(self, utf8=True):
+    self.utf8 = utf8
+    self.offsets = array.array(_OFFSET_TYPECODE, [0])
+    self.data = array.array(_DATA_TYPECODE)
+
+  def Append(self, value):
+    if isinstance(value, unicode):
+      value = value.encode('utf-8')
+    self.data.fromstring(value)
+    self.offsets.append(len(self.data))
+
+  def Arrays(self, name):
+    return [(name + '.offsets', self.offsets), (name + '.data', self.data)]
+
+
+def _NewColumn(field):
+  if field.cpp_type == _FIELD.CPPTYPE_STRING:
+    return _StringColumn(field.type == _FIELD.TYPE_STRING)
+  return _Column(_TYPECODES[field.cpp_type])
+
+
+class _Table(object):
+  """Collects the rows of a table and of its child tables.
+
+  Args:
+    name: name of the table
+    message_type: Descriptor of the messages of the rows, or None for a
+        table of the values of a repeated scalar field
+    value_field: FieldDescriptor of the repeated scalar field, if
+        message_type is None
+  """
+
+  def __init__(self, name, message_type=None, value_field=None):
+    self.name = name
+    self.num_rows = 0
+    self.value_column = None
+    self._columns = []
+    self._children = []
+    if message_type is None:
+      self.value_column = _NewColumn(value_field)
+      self._columns.append((VALUE_COLUMN, self.value_column))
+      return
+    for field in message_type.fields:
+      if (field.label != _FIELD.LABEL_REPEATED and
+          field.cpp_type != _FIELD.CPPTYPE_MESSAGE):
+        self._columns.append((field.name, _NewColumn(field)))
+        continue
+      child_name = '%s.%s' % (name, field.name)
+      if field.cpp_type == _FIELD.CPPTYPE_MESSAGE:
+        child = _Table(child_name, field.message_type)
+      else:
+        child = _Table(child_name, value_field=field)
+      offsets = array.array(_OFFSET_TYPECODE, [0])
+      self._children.append((field, offsets, child))
+
+  def Add(self, row):
+    """Appends a message, or a value of a repeated scalar field, as a row."""
+    self.num_rows += 1
+    if self.value_column is not None:
+      self.value_column.Append(row)
+      return
+    for field_name, column in self._columns:
+      column.Append(getattr(row, field_name))
+    for field, offsets, child in self._children:
+      if field.label == _FIELD.LABEL_REPEATED:
+        for value in getattr(row, field.name):
+          child.Add(value)
+      elif row.HasField(field.name):
+        child.Add(getattr(row, field.name))
+      offsets.append(child.num_rows)
+
+  def Tables(self):
+    """Yields this table and its descendants, parents first."""
+    yield self
+    for _, _, child in self._children:
+      for table in child.Tables():
+        yield table
+
+  def Arrays(self):
+    """Returns the (column name, array.array) of the columns of the table."""
+    arrays = []
+    for name, column in self._columns:
+      arrays.extend(column.Arrays(name))
+    for field, offsets, _ in self._children:
+      arrays.append((field.name + '.offsets', offsets))
+    return arrays
+
+  def ArrowTables(self, parents=None):
+    """Yields the (name, pyarrow.Table) of this table and its descendants.
+
+    Args:
+      parents: numpy array of the parent row of each row of a child table
+    """
+    names = [name for name, _ in self._columns]
+    arrays = [_ArrowArray(column) for _, column in self._columns]
+    if parents is not None:
+      names.insert(0, PARENT_COLUMN)
+      arrays.insert(0, pyarrow.array(parents))
+    yield self.name, pyarrow.Table.from_arrays(arrays, names)
+    rows = numpy.arange(self.num_rows, dtype=numpy.int64)
+    for _, offsets, child in self._children:
+      child_parents = numpy.repeat(rows, numpy.diff(_NumpyArray(offsets)))
+      for table in child.ArrowTables(child_parents):
+        yield table
+
+
+def _NumpyArray(values):
+  """Returns a numpy view of an array.array; pyarrow depends on numpy."""
+  return numpy.frombuffer(values, dtype=_NpyDtype(values))
+
+
+def _ArrowArray(column):
+  """Returns the pyarrow.Array of a column."""
+  if isinstance(column, _StringColumn):
+    # Arrow string offsets are 32 bit.
+    offsets = array.array('i', column.offsets)
+    return pyarrow.Array.from_buffers(
+        pyarrow.string() if column.utf8 else pyarrow.binary(),
+        len(column.offsets) - 1,
+        [None, pyarrow.py_buffer(offsets.tostring()),
+         pyarrow.py_buffer(column.data.tostring())])
+  if column.values.typecode == 'b':
+    # Arrow packs bools into bits.
+    return pyarrow.array([bool(value) for value in column.values],
+                         type=pyarrow.bool_())
+  return pyarrow.array(_NumpyArray(column.values))
+
+
+class ColumnsBuilder(object):
+  """Collects Snippet Status Items into the tables of the columnar export."""
+
+  def __init__(self):
+    self._root = _Table(
+        ROOT_TABLE, snippet_status_report_pb2.SnippetStatusItem.DESCRIPTOR)
+
+  def Add(self, snippet_status):
+    """Appends a SnippetStatusItem to the tables."""
+    self._root.Add(snippet_status)
+
+  def Write(self, directory):
+    """Writes the tables to directory, as .npy columns and a manifest."""
+    manifest = collections.OrderedDict()
+    for table in self._root.Tables():
+      table_directory = os.path.join(directory, table.name)
+      if not os.path.isdir(table_directory):
+        os.makedirs(table_directory)
+      columns = collections.OrderedDict()
+      for name, values in table.Arrays():
+        _WriteNpy(os.path.join(table_directory, name + '.npy'), values)
+        columns[name] = _NpyDtype(values)
+      manifest[table.name] = {'rows': table.num_rows, 'columns': columns}
+    with open(os.path.join(directory, MANIFEST_NAME), 'w') as manifest_file:
+      json.dump(manifest, manifest_file, indent=2)
+
+  def WriteParquet(self, directory):
+    """Writes each table to directory as a .parquet file; requires pyarrow."""
+    if pyarrow is None:
+      raise ImportError('pyarrow is required to write Parquet files')
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    for name, table in self._root.ArrowTables():
+      pyarrow.parquet.write_table(
+          table, os.path.join(directory, name + PARQUET_EXTENSION))
+
+
+def WriteColumns(snippet_statuses, basename, parquet=False):
+  """Writes the columnar export of an iterable of SnippetStatusItems.
+
+  Args:
+    snippet_statuses: iterable of SnippetStatusItems
+    basename: path of the report, without extension
+    parquet: whether to also write the tables as Parquet files, which
+        requires pyarrow
+  Returns:
+    the paths written: the directory of the .npy columns, followed by the
+    directory of the .parquet tables with parquet
+  """
+  builder = ColumnsBuilder()
+  for snippet_status in snippet_statuses:
+    builder.Add(snippet_status)
+  paths = [ColumnsPath(basename)]
+  builder.Write(paths[0])
+  if parquet:
+    paths.append(ParquetPath(basename))
+    builder.WriteParquet(paths[1])
+  return paths
+
+
+def ReadManifest(directory):
+  """Returns the manifest of the tables of a columnar export."""
+  with open(os.path.join(directory, MANIFEST_NAME)) as manifest_file:
+    return json.load(manifest_file,
+                     object_pairs_hook=collections.OrderedDict)
+
+
+def LoadTable(directory, table, columns=None):
+  """Memory-maps columns of a table of a columnar export; requires NumPy.
+
+  Args:
+    directory: directory written by WriteColumns
+    table: name of the table, e.g. 'snippet_status.advertiser_id'
+    columns: names of the columns to load, as listed in the manifest;
+        defaults to all of them
+  Returns:
+    an OrderedDict of read-only numpy arrays by column name
+  """
+  if numpy is None:
+    raise ImportError('NumPy is required to load columns')
+  if columns is None:
+    columns = ReadManifest(directory)[table]['columns'].keys()
+  return collections.OrderedDict(
+      (column, numpy.load(os.path.join(directory, table, column + '.npy'),
+                          mmap_mode='r'))
+      for column in columns)
+
+
+def DecodeStrings(offsets, data):
+  """Returns the unicode strings of a string column as a list."""
+  data = data.tostring() if hasattr(data, 'tostring') else data
+  return [data[start:end].decode('utf-8')
+          for start, end in zip(offsets[:-1], offsets[1:])]
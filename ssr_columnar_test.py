@@ -0,0 +1,164 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for ssr_columnar."""
+
+import os
+import shutil
+import sys
+import tempfile
+
+import snippet_status_report_pb2
+import ssr_columnar
+
+
+def _Items():
+  """Returns SnippetStatusItems with empty, single and repeated fields."""
+  item_type = snippet_status_report_pb2.SnippetStatusItem
+  first = item_type(buyer_creative_id=u'c\xe9', width=300, height=2 ** 40,
+                    status=item_type.DISAPPROVED, is_ssl_capable=True,
+                    advertiser_id=[7, 8], click_through_url=[u'a', u'bc'])
+  first.disapproval_reason.add(reason=item_type.BROKEN_URL,
+                               detail=[u'x', u'yz'])
+  first.disapproval_reason.add(reason=item_type.NO_BORDER)
+  first.snippet_filtering.date = u'2014-02-01'
+  first.snippet_filtering.item.add(filtering_status=1, filtering_count=10)
+  second = item_type(creative_id=u'42', advertiser_id=[9])
+  third = item_type(buyer_creative_id=u'empty-filtering')
+  third.snippet_filtering.date = u'2014-02-02'
+  return [first, second, third]
+
+
+def _Values(table):
+  return dict((column, values.tolist())
+              for column, values in table.iteritems())
+
+
+def TestWriteColumns():
+  output_dir = tempfile.mkdtemp()
+  try:
+    basename = os.path.join(output_dir, 'SnippetStatusReport')
+    paths = ssr_columnar.WriteColumns(_Items(), basename)
+    directory = os.path.join(output_dir, 'SnippetStatusReport_columns')
+    assert paths[0] == directory
+
+    manifest = ssr_columnar.ReadManifest(directory)
+    assert manifest['snippet_status']['rows'] == 3
+    assert manifest['snippet_status']['columns']['width'] == '<i4'
+    assert manifest['snippet_status.disapproval_reason.detail']['rows'] == 2
+
+    root = ssr_columnar.LoadTable(directory, 'snippet_status')
+    assert root['width'].tolist() == [300, 0, 0]
+    assert root['height'].tolist() == [2 ** 40, 0, 0]
+    assert root['status'].tolist() == [3, 1, 1]
+    assert root['is_ssl_capable'].tolist() == [True, False, False]
+    assert ssr_columnar.DecodeStrings(root['buyer_creative_id.offsets'],
+                                      root['buyer_creative_id.data']) == [
+                                          u'c\xe9', u'', u'empty-filtering']
+    assert root['advertiser_id.offsets'].tolist() == [0, 2, 3, 3]
+    assert root['snippet_filtering.offsets'].tolist() == [0, 1, 1, 2]
+
+    # Only the columns asked for are loaded.
+    advertiser_ids = ssr_columnar.LoadTable(
+        directory, 'snippet_status.advertiser_id', ['value'])
+    assert _Values(advertiser_ids) == {'value': [7, 8, 9]}
+    urls = ssr_columnar.LoadTable(directory, 'snippet_status.click_through_url')
+    assert ssr_columnar.DecodeStrings(urls['value.offsets'],
+                                      urls['value.data']) == [u'a', u'bc']
+
+    disapprovals = ssr_columnar.LoadTable(
+        directory, 'snippet_status.disapproval_reason')
+    assert _Values(disapprovals) == {'reason': [1, 7],
+                                     'detail.offsets': [0, 2, 2]}
+    filtering = ssr_columnar.LoadTable(
+        directory, 'snippet_status.snippet_filtering.item')
+    assert _Values(filtering) == {'filtering_status': [1],
+                                  'filtering_count': [10]}
+  finally:
+    shutil.rmtree(output_dir)
+
+
+def TestWriteNoColumns():
+  output_dir = tempfile.mkdtemp()
+  try:
+    basename = os.path.join(output_dir, 'SnippetStatusReport')
+    directory = ssr_columnar.WriteColumns([], basename)[0]
+    root = ssr_columnar.LoadTable(directory, 'snippet_status')
+    assert root['width'].tolist() == []
+    assert root['advertiser_id.offsets'].tolist() == [0]
+  finally:
+    shutil.rmtree(output_dir)
+
+
+def _ReadParquet(directory, table):
+  """Returns the columns of a Parquet table as lists."""
+  return ssr_columnar.pyarrow.parquet.read_table(
+      os.path.join(directory, table + '.parquet')).to_pydict()
+
+
+def TestWriteParquet():
+  if ssr_columnar.pyarrow is None:
+    print 'pyarrow is not installed, skipping TestWriteParquet'
+    return
+  output_dir = tempfile.mkdtemp()
+  try:
+    basename = os.path.join(output_dir, 'SnippetStatusReport')
+    paths = ssr_columnar.WriteColumns(_Items(), basename, parquet=True)
+    directory = os.path.join(output_dir, 'SnippetStatusReport_parquet')
+    assert paths[1] == directory
+
+    root = _ReadParquet(directory, 'snippet_status')
+    assert 'parent' not in root
+    assert root['width'] == [300, 0, 0]
+    assert root['height'] == [2 ** 40, 0, 0]
+    assert root['status'] == [3, 1, 1]
+    assert root['is_ssl_capable'] == [True, False, False]
+    assert root['buyer_creative_id'] == [u'c\xe9', u'', u'empty-filtering']
+    assert root['creative_id'] == [u'', u'42', u'']
+
+    # Child rows point to the row of their parent table.
+    assert _ReadParquet(directory, 'snippet_status.advertiser_id') == {
+        'parent': [0, 0, 1], 'value': [7, 8, 9]}
+    assert _ReadParquet(directory, 'snippet_status.click_through_url') == {
+        'parent': [0, 0], 'value': [u'a', u'bc']}
+    assert _ReadParquet(directory, 'snippet_status.disapproval_reason') == {
+        'parent': [0, 0], 'reason': [1, 7]}
+    assert _ReadParquet(
+        directory, 'snippet_status.disapproval_reason.detail') == {
+            'parent': [0, 0], 'value': [u'x', u'yz']}
+    filtering = _ReadParquet(directory, 'snippet_status.snippet_filtering')
+    assert filtering['parent'] == [0, 2]
+    assert filtering['date'] == [u'2014-02-01', u'2014-02-02']
+    assert _ReadParquet(
+        directory, 'snippet_status.snippet_filtering.item') == {
+            'parent': [0], 'filtering_status': [1], 'filtering_count': [10]}
+
+    # Reports without items have empty tables.
+    directory = ssr_columnar.WriteColumns([], basename, parquet=True)[1]
+    assert _ReadParquet(directory, 'snippet_status')['width'] == []
+    assert _ReadParquet(directory, 'snippet_status.advertiser_id') == {
+        'parent': [], 'value': []}
+  finally:
+    shutil.rmtree(output_dir)
+
+
+def main(_):
+  TestWriteColumns()
+  TestWriteNoColumns()
+  TestWriteParquet()
+  print 'All Tests Passed'
+
+if __name__ == '__main__':
+  main(sys.argv)
@@ -0,0 +1,264 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Regenerates Snippet Status Reports on a schedule and serves them.
+
+ReportDaemon calls a function generating the reports every interval, for as
+long as it runs, so that the service object and credentials it was built
+with are reused rather than rebuilt for every report.  Reports are generated
+into a staging directory of the output directory, indexed, and then renamed
+into the output directory one file at a time, so that readers never see a
+partially written file.  Staging directories left behind by a daemon that
+was killed are removed when the next one starts.
+
+A local HTTP server answers, from the latest published reports:
+  /status: the number of items of each report by status, and the time and
+      error, if any, of the last refresh
+  /creatives/<id>: the items whose buyer_creative_id or creative_id is <id>
+"""
+
+import BaseHTTPServer
+import collections
+import json
+import os
+import shutil
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import urllib
+
+from third_party.protobuf_json import protobuf_json
+import snippet_status_report_pb2
+import ssr_store
+
+
+_STAGING_PREFIX = '.ssr_daemon'
+_CREATIVES_PATH = '/creatives/'
+_STATUS_VALUES = (snippet_status_report_pb2.SnippetStatusItem.Status
+                  .DESCRIPTOR.values_by_number)
+
+
+def _Publish(staging_dir, output_dir):
+  """Moves the files and directories of staging_dir into output_dir.
+
+  Files are replaced atomically by os.rename, indexes after their reports.
+  A directory, e.g. the columns of a report, is renamed away before the new
+  one takes its place.
+  """
+  for name in sorted(os.listdir(staging_dir),
+                     key=lambda name: (name.endswith(ssr_store.INDEX_EXTENSION),
+                                       name)):
+    source = os.path.join(staging_dir, name)
+    destination = os.path.join(output_dir, name)
+    if os.path.isdir(source):
+      previous = None
+      if os.path.exists(destination):
+        previous = tempfile.mkdtemp(prefix=_STAGING_PREFIX, dir=output_dir)
+        os.rename(destination, os.path.join(previous, name))
+      os.rename(source, destination)
+      if previous is not None:
+        shutil.rmtree(previous)
+    else:
+      os.rename(source, destination)
+
+
+def _RemoveStagingDirs(output_dir):
+  """Removes the staging directories left in output_dir by a killed daemon."""
+  for name in os.listdir(output_dir):
+    path = os.path.join(output_dir, name)
+    if name.startswith(_STAGING_PREFIX) and os.path.isdir(path):
+      shutil.rmtree(path, ignore_errors=True)
+
+
+def _IndexAndCount(report_path):
+  """Indexes a .pb report, unless it already is, and counts its items.
+
+  Items are counted while the report is indexed, or read once if it already
+  has an index.
+
+  Returns:
+    the number of items of the report, in total and by status
+  """
+  statuses = collections.defaultdict(int)
+
+  def Count(snippet_status):
+    statuses[snippet_status.status] += 1
+  if os.path.exists(ssr_store.IndexPath(report_path)):
+    for snippet_status in ssr_store.ReadItems(report_path):
+      Count(snippet_status)
+  else:
+    ssr_store.WriteIndex(report_path, item_callback=Count)
+  items_by_status = {}
+  for status, items in statuses.iteritems():
+    value = _STATUS_VALUES.get(status)
+    items_by_status[value.name if value else str(status)] = items
+  return {'items': sum(statuses.itervalues()),
+          'items_by_status': items_by_status}
+
+
+class ReportDaemon(object):
+  """Refreshes reports every interval and serves their status.
+
+  Args:
+    generate_reports: function writing the reports into the directory it is
+        passed, and returning the base names of the reports written
+    interval: seconds between the starts of consecutive refreshes
+    address: (host, port) tuple the status server listens on
+    output_dir: directory the reports are published to
+    fatal_errors: exception classes which end the daemon when raised by
+        generate_reports; other errors are reported, and the reports
+        refreshed again at the next interval
+  """
+
+  def __init__(self, generate_reports, interval, address, output_dir='.',
+               fatal_errors=()):
+    self._generate_reports = generate_reports
+    self._interval = interval
+    self._output_dir = output_dir
+    self._fatal_errors = tuple(fatal_errors)
+    self._stop = threading.Event()
+    self._lock = threading.Lock()
+    self._stores = {}
+    self._status = {'refreshes': 0, 'last_refresh': None, 'last_error': None,
+                    'reports': {}}
+    _RemoveStagingDirs(output_dir)
+    self.server = _StatusServer(address, self)
+
+  def Refresh(self):
+    """Generates and publishes the reports, then serves them."""
+    staging_dir = tempfile.mkdtemp(prefix=_STAGING_PREFIX,
+                                   dir=self._output_dir)
+    try:
+      names = []
+      counts = {}
+      for basename in self._generate_reports(staging_dir):
+        name = os.path.basename(basename)
+        names.append(name)
+        counts[name] = _IndexAndCount(basename + '.pb')
+      _Publish(staging_dir, self._output_dir)
+    finally:
+      shutil.rmtree(staging_dir, ignore_errors=True)
+
+    stores = {}
+    try:
+      for name in names:
+        stores[name] = ssr_store.ReportStore(
+            os.path.join(self._output_dir, name + '.pb'))
+    except (IOError, ssr_store.Error):
+      for store in stores.itervalues():
+        store.Close()
+      raise
+    with self._lock:
+      previous_stores = self._stores
+      self._stores = stores
+      self._status.update(
+          refreshes=self._status['refreshes'] + 1,
+          last_refresh=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+          last_error=None, reports=counts)
+      # Lookups hold the lock, so the previous stores are no longer in use.
+      for store in previous_stores.itervalues():
+        store.Close()
+
+  def Status(self):
+    """Returns the status served at /status, as a JSON serializable dict."""
+    with self._lock:
+      return json.loads(json.dumps(self._status))
+
+  def Lookup(self, creative_id):
+    """Returns the (report name, item) of the items of a creative."""
+    with self._lock:
+      items = []
+      for name, store in sorted(self._stores.iteritems()):
+        for snippet_status in (store.Lookup(creative_id) +
+                               store.LookupCreativeId(creative_id)):
+          items.append((name, snippet_status))
+      return items
+
+  def Run(self):
+    """Serves the status and refreshes the reports until Stop is called."""
+    server_thread = threading.Thread(target=self.server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    try:
+      while not self._stop.is_set():
+        started = time.time()
+        try:
+          self.Refresh()
+        except self._fatal_errors:
+          raise
+        except Exception as e:  # pylint: disable=broad-except
+          traceback.print_exc(file=sys.stderr)
+          with self._lock:
+            self._status['last_error'] = '%s: %s' % (type(e).__name__, e)
+        self._stop.wait(max(0, self._interval - (time.time() - started)))
+    finally:
+      self.server.shutdown()
+      self.Close()
+
+  def Stop(self):
+    """Ends Run once the current refresh, if any, is over."""
+    self._stop.set()
+
+  def Close(self):
+    self.server.server_close()
+    with self._lock:
+      for store in self._stores.itervalues():
+        store.Close()
+      self._stores = {}
+
+
+class _StatusHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """Answers the requests of _StatusServer."""
+
+  def _SendJSON(self, status, value):
+    content = json.dumps(value, indent=2, sort_keys=True)
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(content)))
+    self.end_headers()
+    self.wfile.write(content)
+
+  def do_GET(self):  # pylint: disable=invalid-name
+    path = self.path.split('?', 1)[0]
+    report_daemon = self.server.report_daemon
+    if path == '/status':
+      self._SendJSON(200, report_daemon.Status())
+    elif path.startswith(_CREATIVES_PATH) and len(path) > len(_CREATIVES_PATH):
+      try:
+        creative_id = urllib.unquote(path[len(_CREATIVES_PATH):]).decode(
+            'utf-8')
+      except UnicodeDecodeError:
+        self._SendJSON(400, {'error': 'creative IDs are UTF-8 encoded'})
+        return
+      items = [{'report': name,
+                'snippet_status': protobuf_json.pb2json(snippet_status, True)}
+               for name, snippet_status in report_daemon.Lookup(creative_id)]
+      self._SendJSON(200 if items else 404, {'items': items})
+    else:
+      self._SendJSON(404, {'error': 'unknown path %s' % path})
+
+  def log_message(self, *unused_args):
+    pass
+
+
+class _StatusServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """HTTP server of the status of a ReportDaemon."""
+  daemon_threads = True
+
+  def __init__(self, address, report_daemon):
+    BaseHTTPServer.HTTPServer.__init__(self, address, _StatusHandler)
+    self.report_daemon = report_daemon
@@ -0,0 +1,250 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for ssr_daemon."""
+
+import json
+import os
+import shutil
+import StringIO
+import subprocess
+import sys
+import tempfile
+import threading
+import urllib2
+
+import snippet_status_report_pb2
+import ssr_daemon
+
+
+class FakeReportGenerator(object):
+  """Writes a report of the next list of items on each call.
+
+  Args:
+    runs: for each call, a list of (buyer_creative_id, status) items, or
+        an exception to raise
+    columns: whether to write a directory next to the report, like
+        --columnar does
+  """
+
+  def __init__(self, runs, columns=False):
+    self._runs = list(runs)
+    self._columns = columns
+    self.calls = 0
+
+  def __call__(self, directory):
+    self.calls += 1
+    run = self._runs.pop(0)
+    if isinstance(run, Exception):
+      raise run
+    basename = os.path.join(directory, 'SnippetStatusReport')
+    report = snippet_status_report_pb2.SnippetStatusReport()
+    for buyer_creative_id, status in run:
+      report.snippet_status.add(buyer_creative_id=buyer_creative_id,
+                                status=status)
+    with open(basename + '.pb', 'wb') as report_pb:
+      report_pb.write(report.SerializeToString())
+    if self._columns:
+      os.mkdir(basename + '_columns')
+      with open(os.path.join(basename + '_columns', 'run'), 'w') as run_file:
+        run_file.write(str(self.calls))
+    return [basename]
+
+
+def _Get(server, path):
+  """Returns the status and the decoded JSON of a request to server."""
+  url = 'http://127.0.0.1:%d%s' % (server.server_address[1], path)
+  try:
+    response = urllib2.urlopen(url)
+  except urllib2.HTTPError as e:
+    response = e
+  return response.getcode(), json.load(response)
+
+
+def TestRefreshAndServe():
+  item_type = snippet_status_report_pb2.SnippetStatusItem
+  output_dir = tempfile.mkdtemp()
+  generator = FakeReportGenerator(
+      [[(u'a', item_type.APPROVED), (u'b', item_type.DISAPPROVED),
+        (u'c\xe9', item_type.APPROVED)],
+       [(u'a', item_type.DISAPPROVED)]], columns=True)
+  daemon = ssr_daemon.ReportDaemon(generator, 60, ('127.0.0.1', 0),
+                                   output_dir)
+  server_thread = threading.Thread(target=daemon.server.serve_forever)
+  server_thread.daemon = True
+  server_thread.start()
+  try:
+    assert _Get(daemon.server, '/status')[1]['refreshes'] == 0
+    daemon.Refresh()
+    # Only the published reports are left in the output directory.
+    assert sorted(os.listdir(output_dir)) == [
+        'SnippetStatusReport.idx', 'SnippetStatusReport.pb',
+        'SnippetStatusReport_columns']
+    status, body = _Get(daemon.server, '/status')
+    assert status == 200
+    assert body['refreshes'] == 1
+    assert body['last_error'] is None
+    assert body['reports'] == {'SnippetStatusReport': {
+        'items': 3, 'items_by_status': {'APPROVED': 2, 'DISAPPROVED': 1}}}
+
+    status, body = _Get(daemon.server, '/creatives/b')
+    assert status == 200
+    assert body['items'] == [{'report': 'SnippetStatusReport',
+                              'snippet_status': {'buyer_creative_id': 'b',
+                                                 'status': 'DISAPPROVED'}}]
+    status, body = _Get(daemon.server, '/creatives/c%C3%A9')
+    assert status == 200
+    assert body['items'][0]['snippet_status']['buyer_creative_id'] == u'c\xe9'
+    assert _Get(daemon.server, '/creatives/missing') == (404, {'items': []})
+    assert _Get(daemon.server, '/unknown')[0] == 404
+
+    # The reports of the next refresh replace the previous ones.
+    daemon.Refresh()
+    assert _Get(daemon.server, '/status')[1]['reports'] == {
+        'SnippetStatusReport': {'items': 1,
+                                'items_by_status': {'DISAPPROVED': 1}}}
+    assert _Get(daemon.server, '/creatives/b')[0] == 404
+    assert _Get(daemon.server, '/creatives/a')[1]['items'][0][
+        'snippet_status']['status'] == 'DISAPPROVED'
+    with open(os.path.join(output_dir, 'SnippetStatusReport_columns',
+                           'run')) as run_file:
+      assert run_file.read() == '2'
+    assert len(os.listdir(output_dir)) == 3
+  finally:
+    daemon.server.shutdown()
+    daemon.Close()
+    shutil.rmtree(output_dir)
+
+
+def TestCountsWithoutSummary():
+  # Status counts do not load ssr_summary, and with it numpy.
+  modules = subprocess.check_output([
+      sys.executable, '-c',
+      'import sys, ssr_daemon; print sorted(sys.modules)'])
+  for module in ('ssr_summary', 'numpy'):
+    assert repr(module) not in modules, module
+
+  item_type = snippet_status_report_pb2.SnippetStatusItem
+  output_dir = tempfile.mkdtemp()
+  try:
+    basename = FakeReportGenerator(
+        [[(u'a', item_type.APPROVED), (u'b', item_type.APPROVED)]])(
+            output_dir)[0]
+    expected = {'items': 2, 'items_by_status': {'APPROVED': 2}}
+    # Counted while indexing, and by reading the report once it is indexed.
+    assert ssr_daemon._IndexAndCount(basename + '.pb') == expected
+    assert os.path.exists(basename + '.idx')
+    assert ssr_daemon._IndexAndCount(basename + '.pb') == expected
+  finally:
+    shutil.rmtree(output_dir)
+
+
+def TestRemoveStaleStagingDirs():
+  output_dir = tempfile.mkdtemp()
+  try:
+    stale_dir = tempfile.mkdtemp(prefix=ssr_daemon._STAGING_PREFIX,
+                                 dir=output_dir)
+    open(os.path.join(stale_dir, 'SnippetStatusReport.pb'), 'w').close()
+    open(os.path.join(output_dir, 'SnippetStatusReport.pb'), 'w').close()
+    daemon = ssr_daemon.ReportDaemon(FakeReportGenerator([]), 60,
+                                     ('127.0.0.1', 0), output_dir)
+    daemon.Close()
+    assert os.listdir(output_dir) == ['SnippetStatusReport.pb']
+  finally:
+    shutil.rmtree(output_dir)
+
+
+def TestPublishOrder():
+  staging_dir = tempfile.mkdtemp()
+  output_dir = tempfile.mkdtemp()
+  rename = os.rename
+  renamed = []
+
+  def RecordingRename(source, destination):
+    renamed.append(os.path.basename(source))
+    rename(source, destination)
+  try:
+    for name in ('a.idx', 'a.pb', 'b.idx', 'b.pb', 'a.csv'):
+      open(os.path.join(staging_dir, name), 'w').close()
+    ssr_daemon.os.rename = RecordingRename
+    ssr_daemon._Publish(staging_dir, output_dir)
+    # Indexes replace the previous ones only once their reports have.
+    assert renamed == ['a.csv', 'a.pb', 'b.pb', 'a.idx', 'b.idx']
+    assert sorted(os.listdir(output_dir)) == sorted(renamed)
+  finally:
+    ssr_daemon.os.rename = rename
+    shutil.rmtree(staging_dir)
+    shutil.rmtree(output_dir)
+
+
+class FatalError(Exception):
+  pass
+
+
+def TestRun():
+  output_dir = tempfile.mkdtemp()
+  try:
+    daemon = None
+
+    class StoppingGenerator(FakeReportGenerator):
+
+      def __call__(self, directory):
+        if self.calls == 2:
+          daemon.Stop()
+        return FakeReportGenerator.__call__(self, directory)
+
+    generator = StoppingGenerator([[(u'a', 2)], ValueError('failed'),
+                                   [(u'b', 2)]])
+    daemon = ssr_daemon.ReportDaemon(generator, 0, ('127.0.0.1', 0),
+                                     output_dir)
+    stderr = sys.stderr
+    sys.stderr = StringIO.StringIO()
+    try:
+      daemon.Run()
+      # The failed refresh was reported and retried at the next interval.
+      assert 'ValueError: failed' in sys.stderr.getvalue()
+    finally:
+      sys.stderr = stderr
+    assert generator.calls == 3
+    status = daemon.Status()
+    assert status['refreshes'] == 2
+    assert status['last_error'] is None
+
+    # Fatal errors end the daemon.
+    generator = FakeReportGenerator([FatalError()])
+    daemon = ssr_daemon.ReportDaemon(generator, 0, ('127.0.0.1', 0),
+                                     output_dir, fatal_errors=[FatalError])
+    try:
+      daemon.Run()
+    except FatalError:
+      pass
+    else:
+      assert False, 'FatalError not raised'
+    assert [name for name in os.listdir(output_dir)
+            if name.startswith('.')] == []
+  finally:
+    shutil.rmtree(output_dir)
+
+
+def main(_):
+  TestRefreshAndServe()
+  TestCountsWithoutSummary()
+  TestRemoveStaleStagingDirs()
+  TestPublishOrder()
+  TestRun()
+  print 'All Tests Passed'
+
+if __name__ == '__main__':
+  main(sys.argv)
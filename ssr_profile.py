@@ -0,0 +1,155 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Stage timers and counters of a Snippet Status Report run.
+
+A Profile is only created when profiling is requested.  Code paths taking a
+profile check for None once and otherwise run exactly as without profiling.
+
+Stages nest: the time spent in a stage does not include the time spent in
+the stages entered from it, so the stage times of a run add up to at most
+its wall time.  A Profile must only be used from one thread.
+"""
+
+import collections
+import contextlib
+import json
+import resource
+import sys
+import time
+
+try:
+  import tracemalloc  # pylint: disable=g-import-not-at-top
+except ImportError:
+  tracemalloc = None
+
+
+def PeakRSSKilobytes():
+  """Returns the peak resident set size of this process in kilobytes."""
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  if sys.platform == 'darwin':
+    peak //= 1024  # ru_maxrss is in bytes on OS X.
+  return peak
+
+
+class Profile(object):
+  """Collects the time, counts, output sizes and memory of a run.
+
+  Args:
+    trace_memory: whether to trace Python allocations with tracemalloc,
+        where it is available
+  """
+
+  def __init__(self, trace_memory=True):
+    self._start = time.time()
+    self._stages = collections.defaultdict(float)
+    self._stack = []
+    self._mark = self._start
+    self._counters = collections.defaultdict(int)
+    self._bytes = collections.defaultdict(int)
+    self._memory = []
+    self._tracing = bool(trace_memory and tracemalloc)
+    if self._tracing and not tracemalloc.is_tracing():
+      tracemalloc.start()
+
+  def Reset(self):
+    """Discards the metrics collected so far, keeping the stages entered."""
+    self._start = self._mark = time.time()
+    self._stages.clear()
+    self._counters.clear()
+    self._bytes.clear()
+    del self._memory[:]
+
+  def Enter(self, stage):
+    """Starts timing stage, pausing the stage it is entered from."""
+    now = time.time()
+    if self._stack:
+      self._stages[self._stack[-1]] += now - self._mark
+    self._stack.append(stage)
+    self._mark = now
+
+  def Exit(self):
+    """Stops timing the current stage and resumes the enclosing one."""
+    now = time.time()
+    self._stages[self._stack.pop()] += now - self._mark
+    self._mark = now
+
+  @contextlib.contextmanager
+  def Stage(self, stage):
+    """Times the body of a with statement as stage."""
+    self.Enter(stage)
+    try:
+      yield
+    finally:
+      self.Exit()
+
+  def Iterate(self, stage, iterable, counter=None):
+    """Times the production of each element of iterable as stage.
+
+    Args:
+      stage: name of the stage
+      iterable: iterable to time, e.g. a generator fetching creatives
+      counter: name of the counter incremented for each element, if any
+    Yields:
+      the elements of iterable
+    """
+    iterator = iter(iterable)
+    while True:
+      self.Enter(stage)
+      try:
+        element = next(iterator)
+      except StopIteration:
+        return
+      finally:
+        self.Exit()
+      if counter:
+        self._counters[counter] += 1
+      yield element
+
+  def Count(self, counter, value=1):
+    """Adds value to counter."""
+    self._counters[counter] += value
+
+  def AddBytes(self, output_format, num_bytes):
+    """Records num_bytes written in output_format, e.g. 'csv'."""
+    self._bytes[output_format] += num_bytes
+
+  def Snapshot(self, label):
+    """Records the memory used by the process at a point of the run."""
+    snapshot = {'label': label, 'peak_rss_kb': PeakRSSKilobytes()}
+    if self._tracing:
+      current, peak = tracemalloc.get_traced_memory()
+      snapshot['tracemalloc_current_kb'] = current // 1024
+      snapshot['tracemalloc_peak_kb'] = peak // 1024
+    self._memory.append(snapshot)
+
+  def Summary(self):
+    """Returns the metrics of the run as a JSON serializable dictionary."""
+    self.Snapshot('summary')
+    now = time.time()
+    stages = dict(self._stages)
+    if self._stack:
+      # Include the time spent so far in a stage that was not exited.
+      stages[self._stack[-1]] = (stages.get(self._stack[-1], 0.0) +
+                                 now - self._mark)
+    return {'wall_seconds': now - self._start,
+            'stage_seconds': stages,
+            'counters': dict(self._counters),
+            'bytes_written': dict(self._bytes),
+            'memory': list(self._memory)}
+
+  def Write(self, output):
+    """Writes the summary of the run as JSON to the output stream."""
+    json.dump(self.Summary(), output, indent=2, sort_keys=True)
+    output.write('\n')
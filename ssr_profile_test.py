@@ -0,0 +1,100 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for ssr_profile."""
+
+import json
+import StringIO
+import sys
+import time
+
+import ssr_profile
+
+
+def TestNestedStages():
+  profile = ssr_profile.Profile(trace_memory=False)
+  with profile.Stage('outer'):
+    time.sleep(0.02)
+    with profile.Stage('inner'):
+      time.sleep(0.05)
+  stages = profile.Summary()['stage_seconds']
+  # The time spent in inner is not counted in outer.
+  assert 0.04 <= stages['inner']
+  assert 0.01 <= stages['outer'] < 0.04
+
+
+def TestIterate():
+  profile = ssr_profile.Profile(trace_memory=False)
+
+  def SlowNumbers():
+    for number in xrange(3):
+      time.sleep(0.01)
+      yield number
+
+  elements = []
+  for element in profile.Iterate('produce', SlowNumbers(), 'numbers'):
+    with profile.Stage('consume'):
+      elements.append(element)
+  summary = profile.Summary()
+  assert elements == [0, 1, 2]
+  assert summary['counters'] == {'numbers': 3}
+  assert summary['stage_seconds']['produce'] >= 0.03
+  assert summary['stage_seconds']['consume'] < 0.01
+
+
+def TestSummary():
+  profile = ssr_profile.Profile(trace_memory=False)
+  profile.Count('creatives', 2)
+  profile.Count('creatives')
+  profile.AddBytes('csv', 10)
+  profile.AddBytes('csv', 5)
+  profile.Snapshot('start')
+  profile.Enter('unfinished')
+  output = StringIO.StringIO()
+  profile.Write(output)
+  summary = json.loads(output.getvalue())
+  assert summary['counters'] == {'creatives': 3}
+  assert summary['bytes_written'] == {'csv': 15}
+  assert [snapshot['label'] for snapshot in summary['memory']] == [
+      'start', 'summary']
+  assert summary['memory'][0]['peak_rss_kb'] > 0
+  assert 'unfinished' in summary['stage_seconds']
+
+
+def TestReset():
+  profile = ssr_profile.Profile(trace_memory=False)
+  profile.Count('creatives', 2)
+  profile.AddBytes('csv', 10)
+  profile.Snapshot('start')
+  profile.Enter('refresh')
+  time.sleep(0.02)
+  profile.Reset()
+  summary = profile.Summary()
+  assert summary['counters'] == {}
+  assert summary['bytes_written'] == {}
+  assert [snapshot['label'] for snapshot in summary['memory']] == ['summary']
+  # The stage still entered is only timed from the reset.
+  assert summary['stage_seconds']['refresh'] < 0.02
+
+
+def main(_):
+  TestNestedStages()
+  TestIterate()
+  TestSummary()
+  TestReset()
+  print 'All Tests Passed'
+
+if __name__ == '__main__':
+  main(sys.argv)
@@ -0,0 +1,265 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""On-disk state of the previous Snippet Status Report run.
+
+The state maps each creative, keyed by account and buyer creative ID, to a
+hash of the creative as returned by the creatives.list API and to its
+serialized Snippet Status Item.  Creatives whose hash has not changed since
+the previous run do not need to be converted again.
+
+The state file starts with STATE_MAGIC and a _HEADER of the version of the
+items, the number of records and the number of slots of the hash table.  It
+is followed by the records, each a _RECORD of the lengths of the key and of
+the item followed by the UTF-8 encoded key, the content hash and the
+serialized item, and then by the hash table.  Each _SLOT of the table holds
+the 64 bit hash of a key and one more than the offset of its record, or
+zeros if it is empty; keys are placed by linear probing.
+
+The previous state is memory-mapped and records are only read when looked
+up, while the records of the current run are appended to a temporary file
+as they are put, so memory use does not grow with the number of creatives
+beyond a byte per hash table slot of the previous state.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+
+STATE_MAGIC = 'SSRSTAT2'
+
+_HEADER = struct.Struct('<IQQ')
+_HEADER_SIZE = len(STATE_MAGIC) + _HEADER.size
+_RECORD = struct.Struct('<HI')
+_SLOT = struct.Struct('<QQ')
+_HASH_SIZE = hashlib.sha1().digest_size
+
+
+def CreativeKey(item):
+  """Returns the key identifying a creative across runs.
+
+  Args:
+    item: creative dictionary as returned by the creatives.list API, before
+        its keys are translated
+  """
+  creative_id = item.get(u'buyerCreativeId')
+  if creative_id is None:
+    creative_id = item.get(u'creativeId')
+  return u'%s/%s' % (item.get(u'accountId', u''), creative_id)
+
+
+def ContentHash(item):
+  """Returns a hash of the content of a creative dictionary."""
+  content = json.dumps(item, sort_keys=True, separators=(',', ':'))
+  return hashlib.sha1(content).digest()
+
+
+def _KeyHash(key):
+  return struct.unpack_from('<Q', hashlib.sha1(key).digest())[0]
+
+
+def _ReadRecord(data, offset):
+  """Returns the (key, content hash, serialized item) of a record."""
+  key_length, item_length = _RECORD.unpack_from(data, offset)
+  start = offset + _RECORD.size
+  hash_start = start + key_length
+  item_start = hash_start + _HASH_SIZE
+  return (data[start:hash_start], data[hash_start:item_start],
+          data[item_start:item_start + item_length])
+
+
+def _FindSlot(data, table_offset, num_slots, key, key_hash):
+  """Returns the (slot index, record offset) of key in a hash table.
+
+  The record offset is None, and the slot the first empty one of the
+  probing sequence of key, if key is not in the table.
+  """
+  slot = key_hash & (num_slots - 1)
+  while True:
+    slot_hash, record_offset = _SLOT.unpack_from(
+        data, table_offset + slot * _SLOT.size)
+    if not record_offset:
+      return slot, None
+    if slot_hash == key_hash and _ReadRecord(data, record_offset - 1)[0] == key:
+      return slot, record_offset - 1
+    slot = (slot + 1) & (num_slots - 1)
+
+
+def _NumSlots(num_records):
+  """Returns the power of two number of slots for num_records keys."""
+  num_slots = 1
+  while num_slots < 2 * num_records:
+    num_slots *= 2
+  return num_slots
+
+
+class ReportState(object):
+  """Creatives of the previous run and of the current one.
+
+  Use Load to create a ReportState, and Save or Close when done with it.
+
+  Args:
+    path: path of the state file
+    version: version of the serialized items; state saved with another
+        version is ignored
+  """
+
+  def __init__(self, path, version):
+    self._path = path
+    self._version = version
+    self._previous_file = None
+    self._previous = ''
+    self._num_slots = 0
+    self._seen = bytearray()
+    self._current_file = None
+    self._num_current = 0
+
+  @classmethod
+  def Load(cls, path, version):
+    """Loads the state saved by the previous run.
+
+    Args:
+      path: path of the state file
+      version: version of the serialized items expected by the caller
+    Returns:
+      a ReportState; its previous run is empty if there is no state file, or
+      if it was saved with another version or format
+    """
+    state = cls(path, version)
+    if os.path.exists(path) and os.path.getsize(path) >= _HEADER_SIZE:
+      state_file = open(path, 'rb')
+      data = mmap.mmap(state_file.fileno(), 0, access=mmap.ACCESS_READ)
+      saved_version, _, num_slots = _HEADER.unpack_from(data,
+                                                        len(STATE_MAGIC))
+      if data[:len(STATE_MAGIC)] == STATE_MAGIC and saved_version == version:
+        state._previous_file = state_file
+        state._previous = data
+        state._num_slots = num_slots
+        state._seen = bytearray(num_slots)
+      else:
+        data.close()
+        state_file.close()
+    return state
+
+  def _FindPrevious(self, key):
+    """Returns the (slot, record offset) of key in the previous run."""
+    if not self._num_slots:
+      return None, None
+    return _FindSlot(self._previous, len(self._previous) -
+                     self._num_slots * _SLOT.size, self._num_slots,
+                     key, _KeyHash(key))
+
+  def Get(self, key):
+    """Returns the (content hash, serialized item) of key in the previous run.
+
+    Returns None if the creative was not in the previous run.
+    """
+    _, offset = self._FindPrevious(key.encode('utf-8'))
+    if offset is None:
+      return None
+    return _ReadRecord(self._previous, offset)[1:]
+
+  def _OpenCurrent(self):
+    """Creates the temporary file of the current run, if not done yet."""
+    if self._current_file is None:
+      state_dir = os.path.dirname(os.path.abspath(self._path))
+      fd, self._current_path = tempfile.mkstemp(dir=state_dir,
+                                                prefix='.ssr_state')
+      self._current_file = os.fdopen(fd, 'w+b')
+      self._current_file.write('\0' * _HEADER_SIZE)
+
+  def Put(self, key, content_hash, serialized):
+    """Records a creative of the current run."""
+    key = key.encode('utf-8')
+    slot, offset = self._FindPrevious(key)
+    if offset is not None:
+      self._seen[slot] = 1
+    self._OpenCurrent()
+    self._current_file.write(_RECORD.pack(len(key), len(serialized)))
+    self._current_file.write(key)
+    self._current_file.write(content_hash)
+    self._current_file.write(serialized)
+    self._num_current += 1
+
+  def Removed(self):
+    """Yields the serialized items of creatives gone since the previous run.
+
+    Creatives are gone if they were not Put in the current run.  They are
+    yielded in the order of the previous run.
+    """
+    if not self._num_slots:
+      return
+    table_offset = len(self._previous) - self._num_slots * _SLOT.size
+    offset = _HEADER_SIZE
+    while offset < table_offset:
+      key, _, serialized = _ReadRecord(self._previous, offset)
+      slot, found_offset = self._FindPrevious(key)
+      # Only the last record of a key put several times is in the table.
+      if found_offset == offset and not self._seen[slot]:
+        yield serialized
+      offset += _RECORD.size + len(key) + _HASH_SIZE + len(serialized)
+
+  def _WriteTable(self, state_file):
+    """Appends the hash table of the current records to state_file."""
+    num_slots = _NumSlots(self._num_current)
+    table_offset = state_file.tell()
+    state_file.truncate(table_offset + num_slots * _SLOT.size)
+    state_file.flush()
+    data = mmap.mmap(state_file.fileno(), 0)
+    try:
+      data[:len(STATE_MAGIC)] = STATE_MAGIC
+      _HEADER.pack_into(data, len(STATE_MAGIC), self._version,
+                        self._num_current, num_slots)
+      offset = _HEADER_SIZE
+      while offset < table_offset:
+        key, _, serialized = _ReadRecord(data, offset)
+        key_hash = _KeyHash(key)
+        # A key put again replaces its previous record.
+        slot, _ = _FindSlot(data, table_offset, num_slots, key, key_hash)
+        _SLOT.pack_into(data, table_offset + slot * _SLOT.size, key_hash,
+                        offset + 1)
+        offset += _RECORD.size + len(key) + _HASH_SIZE + len(serialized)
+      data.flush()
+    finally:
+      data.close()
+
+  def Save(self):
+    """Saves the creatives of the current run for the next one.
+
+    The state file is replaced atomically, so an interrupted run leaves the
+    previous state in place.
+    """
+    self._OpenCurrent()
+    self._WriteTable(self._current_file)
+    self._current_file.close()
+    self._current_file = None
+    os.rename(self._current_path, self._path)
+    self.Close()
+
+  def Close(self):
+    """Releases the previous state, and discards the current one if unsaved."""
+    if self._current_file is not None:
+      self._current_file.close()
+      self._current_file = None
+      os.remove(self._current_path)
+    if self._previous_file is not None:
+      self._previous.close()
+      self._previous_file.close()
+      self._previous_file = None
+      self._previous = ''
+      self._num_slots = 0
@@ -0,0 +1,131 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for ssr_state."""
+
+import os
+import shutil
+import sys
+import tempfile
+
+import ssr_state
+
+
+def TestCreativeKey():
+  assert ssr_state.CreativeKey(
+      {u'accountId': 123, u'buyerCreativeId': u'abc'}) == u'123/abc'
+  assert ssr_state.CreativeKey({u'creativeId': u'def'}) == u'/def'
+
+
+def TestContentHash():
+  first = {u'a': 1, u'b': [1, 2], u'c': {u'd': u'e'}}
+  second = {u'c': {u'd': u'e'}, u'b': [1, 2], u'a': 1}
+  assert ssr_state.ContentHash(first) == ssr_state.ContentHash(second)
+  second[u'b'].append(3)
+  assert ssr_state.ContentHash(first) != ssr_state.ContentHash(second)
+
+
+def TestReportState():
+  state_dir = tempfile.mkdtemp()
+  try:
+    path = os.path.join(state_dir, 'state')
+    state = ssr_state.ReportState.Load(path, 1)
+    assert state.Get(u'1/a') is None
+    state.Put(u'1/a', 'a' * 20, 'item a')
+    state.Put(u'1/b\xe9', 'b' * 20, 'item b')
+    assert list(state.Removed()) == []
+    state.Save()
+    assert os.listdir(state_dir) == ['state']
+
+    state = ssr_state.ReportState.Load(path, 1)
+    assert state.Get(u'1/a') == ('a' * 20, 'item a')
+    assert state.Get(u'1/b\xe9') == ('b' * 20, 'item b')
+    state.Put(u'1/a', 'A' * 20, 'item a2')
+    state.Put(u'1/c', 'c' * 20, 'item c')
+    assert list(state.Removed()) == ['item b']
+    state.Save()
+
+    state = ssr_state.ReportState.Load(path, 1)
+    assert state.Get(u'1/a') == ('A' * 20, 'item a2')
+    assert state.Get(u'1/b\xe9') is None
+    # The current run is discarded unless saved.
+    state.Put(u'1/d', 'd' * 20, 'item d')
+    state.Close()
+    assert os.listdir(state_dir) == ['state']
+    assert ssr_state.ReportState.Load(path, 2).Get(u'1/a') is None
+  finally:
+    shutil.rmtree(state_dir)
+
+
+def TestReportStateManyCreatives():
+  state_dir = tempfile.mkdtemp()
+  try:
+    path = os.path.join(state_dir, 'state')
+    state = ssr_state.ReportState.Load(path, 1)
+    for i in xrange(1000):
+      state.Put(u'1/%d' % i, '%020d' % i, 'item %d' % i)
+    # A creative listed twice keeps its last item.
+    state.Put(u'1/0', '%020d' % 1000, 'item 0 again')
+    state.Save()
+
+    state = ssr_state.ReportState.Load(path, 1)
+    assert state.Get(u'1/0') == ('%020d' % 1000, 'item 0 again')
+    for i in xrange(1, 1000):
+      assert state.Get(u'1/%d' % i) == ('%020d' % i, 'item %d' % i)
+      if i % 10:
+        state.Put(u'1/%d' % i, '%020d' % i, 'item %d' % i)
+    assert list(state.Removed()) == (
+        ['item %d' % i for i in xrange(10, 1000, 10)] + ['item 0 again'])
+    state.Close()
+
+    # An empty run is saved too.
+    state = ssr_state.ReportState.Load(path, 1)
+    state.Save()
+    state = ssr_state.ReportState.Load(path, 1)
+    assert state.Get(u'1/1') is None
+    assert list(state.Removed()) == []
+    state.Close()
+  finally:
+    shutil.rmtree(state_dir)
+
+
+def TestReportStateOtherFormat():
+  state_dir = tempfile.mkdtemp()
+  try:
+    path = os.path.join(state_dir, 'state')
+    # e.g. the state file of an earlier release.
+    with open(path, 'wb') as state_file:
+      state_file.write('not a state file' * 4)
+    state = ssr_state.ReportState.Load(path, 1)
+    assert state.Get(u'1/a') is None
+    state.Put(u'1/a', 'a' * 20, 'item a')
+    state.Save()
+    state = ssr_state.ReportState.Load(path, 1)
+    assert state.Get(u'1/a') == ('a' * 20, 'item a')
+    state.Close()
+  finally:
+    shutil.rmtree(state_dir)
+
+
+def main(_):
+  TestCreativeKey()
+  TestContentHash()
+  TestReportState()
+  TestReportStateManyCreatives()
+  TestReportStateOtherFormat()
+  print 'All Tests Passed'
+
+if __name__ == '__main__':
+  main(sys.argv)
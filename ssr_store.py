@@ -0,0 +1,280 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Random access to the Snippet Status Items of a .pb report.
+
+A .pb report is a serialized SnippetStatusReport, i.e. a sequence of
+length-delimited snippet_status records each holding a serialized
+SnippetStatusItem.  WriteIndex writes a sidecar .idx file mapping the
+buyer_creative_id and creative_id of each item to the offset of its record,
+sorted by ID.  ReportStore memory-maps the report and its index, and only
+decodes the records of the items looked up.
+
+The index starts with INDEX_MAGIC and a _HEADER of the size of the report
+it was written for and of the number of entries, followed by the entries
+and then by the keys they refer to.  Each entry is an
+_ENTRY struct of the offset and length of its key, and of the offset of the
+record in the report.  A key is the field number of the ID followed by the
+UTF-8 encoded ID.  ReportStore rejects an index whose report size does not
+match, e.g. one left over from a previous report.
+"""
+
+import mmap
+import os
+import struct
+
+import snippet_status_report_pb2
+
+
+INDEX_MAGIC = 'SSRIDX2\n'
+INDEX_EXTENSION = '.idx'
+
+_HEADER = struct.Struct('<QI')
+_ENTRY = struct.Struct('<QIQ')
+_HEADER_SIZE = len(INDEX_MAGIC) + _HEADER.size
+
+_SNIPPET_STATUS_FIELD = (snippet_status_report_pb2.SnippetStatusReport
+                         .DESCRIPTOR.fields_by_name['snippet_status'])
+_SNIPPET_STATUS_TAG = chr((_SNIPPET_STATUS_FIELD.number << 3) | 2)
+_ITEM_FIELDS = snippet_status_report_pb2.SnippetStatusItem.DESCRIPTOR
+_ID_FIELDS = ('buyer_creative_id', 'creative_id')
+_ID_PREFIXES = dict((field_name,
+                     chr(_ITEM_FIELDS.fields_by_name[field_name].number))
+                    for field_name in _ID_FIELDS)
+
+
+class Error(Exception):
+  """Raised when a report or its index is malformed."""
+
+
+def IndexPath(report_path):
+  """Returns the path of the index of the .pb report at report_path."""
+  return os.path.splitext(report_path)[0] + INDEX_EXTENSION
+
+
+def _Key(field_name, creative_id):
+  return _ID_PREFIXES[field_name] + creative_id.encode('utf-8')
+
+
+def _DecodeVarint(data, position):
+  """Decodes the varint of data at position.
+
+  Returns:
+    a tuple of the decoded value and of the position following the varint
+  """
+  value = 0
+  shift = 0
+  while True:
+    if position >= len(data):
+      raise Error('truncated varint at offset %d' % position)
+    byte = ord(data[position])
+    position += 1
+    value |= (byte & 0x7f) << shift
+    if not byte & 0x80:
+      return value, position
+    shift += 7
+
+
+def _Map(report_file):
+  """Memory-maps report_file for reading; empty files map to ''."""
+  if not os.fstat(report_file.fileno()).st_size:
+    return ''
+  return mmap.mmap(report_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _Records(data, start=0, end=None):
+  """Yields the (offset, serialized item) of the records of a .pb report."""
+  position = start
+  if end is None:
+    end = len(data)
+  while position < end:
+    offset = position
+    if data[position] != _SNIPPET_STATUS_TAG:
+      raise Error('unexpected field at offset %d' % position)
+    length, position = _DecodeVarint(data, position + 1)
+    if position + length > end:
+      raise Error('truncated record at offset %d' % offset)
+    yield offset, data[position:position + length]
+    position += length
+
+
+def _ReadRecord(data, offset):
+  """Returns the serialized item of the record at offset."""
+  if offset >= len(data):
+    raise Error('record offset %d is out of range' % offset)
+  for _, serialized in _Records(data, offset):
+    return serialized
+
+
+def _Items(data):
+  """Yields the decoded items of the records of a .pb report."""
+  for _, serialized in _Records(data):
+    snippet_status = snippet_status_report_pb2.SnippetStatusItem()
+    snippet_status.ParseFromString(serialized)
+    yield snippet_status
+
+
+def ReadItems(report_path):
+  """Yields the items of a .pb report in order, without an index.
+
+  The report is memory-mapped and each item is decoded as it is yielded.
+  """
+  with open(report_path, 'rb') as report_file:
+    data = _Map(report_file)
+    try:
+      for snippet_status in _Items(data):
+        yield snippet_status
+    finally:
+      if data:
+        data.close()
+
+
+def WriteIndex(report_path, index_path=None, item_callback=None):
+  """Indexes the items of a .pb report by buyer_creative_id and creative_id.
+
+  Args:
+    report_path: path of the .pb report
+    index_path: path of the index; defaults to IndexPath(report_path)
+    item_callback: function called with each item as it is decoded, if any,
+        e.g. to aggregate the report in the same pass; the item is only
+        valid until the callback returns
+  Returns:
+    the number of items indexed
+  """
+  entries = []
+  num_items = 0
+  with open(report_path, 'rb') as report_file:
+    data = _Map(report_file)
+    report_size = len(data)
+    try:
+      snippet_status = snippet_status_report_pb2.SnippetStatusItem()
+      for offset, serialized in _Records(data):
+        snippet_status.ParseFromString(serialized)
+        num_items += 1
+        if item_callback is not None:
+          item_callback(snippet_status)
+        for field_name in _ID_FIELDS:
+          if snippet_status.HasField(field_name):
+            key = _Key(field_name, getattr(snippet_status, field_name))
+            entries.append((key, offset))
+    finally:
+      if data:
+        data.close()
+  entries.sort()
+
+  index_path = index_path or IndexPath(report_path)
+  with open(index_path, 'wb') as index_file:
+    index_file.write(INDEX_MAGIC)
+    index_file.write(_HEADER.pack(report_size, len(entries)))
+    key_offset = 0
+    for key, offset in entries:
+      index_file.write(_ENTRY.pack(key_offset, len(key), offset))
+      key_offset += len(key)
+    for key, _ in entries:
+      index_file.write(key)
+  return num_items
+
+
+class ReportStore(object):
+  """Reads the Snippet Status Items of an indexed .pb report.
+
+  Args:
+    report_path: path of the .pb report
+    index_path: path of its index, as written by WriteIndex; defaults to
+        IndexPath(report_path)
+  """
+
+  def __init__(self, report_path, index_path=None):
+    self._report_file = open(report_path, 'rb')
+    self._index_file = open(index_path or IndexPath(report_path), 'rb')
+    self._report = _Map(self._report_file)
+    self._index = _Map(self._index_file)
+    if (len(self._index) < _HEADER_SIZE or
+        self._index[:len(INDEX_MAGIC)] != INDEX_MAGIC):
+      self.Close()
+      raise Error('%s is not a report index' % self._index_file.name)
+    report_size, self._num_entries = _HEADER.unpack_from(self._index,
+                                                         len(INDEX_MAGIC))
+    self._keys_offset = _HEADER_SIZE + self._num_entries * _ENTRY.size
+    if report_size != len(self._report):
+      self.Close()
+      raise Error('%s indexes a report of %d bytes, not %s' % (
+          self._index_file.name, report_size, self._report_file.name))
+    if self._keys_offset > len(self._index):
+      self.Close()
+      raise Error('%s is truncated' % self._index_file.name)
+
+  def _Entry(self, index):
+    """Returns the (key, record offset) of the index-th entry."""
+    key_offset, key_length, offset = _ENTRY.unpack_from(
+        self._index, _HEADER_SIZE + index * _ENTRY.size)
+    start = self._keys_offset + key_offset
+    return self._index[start:start + key_length], offset
+
+  def _LowerBound(self, key):
+    """Returns the index of the first entry whose key is not below key."""
+    low, high = 0, self._num_entries
+    while low < high:
+      middle = (low + high) // 2
+      if self._Entry(middle)[0] < key:
+        low = middle + 1
+      else:
+        high = middle
+    return low
+
+  def _Lookup(self, field_name, creative_id):
+    key = _Key(field_name, creative_id)
+    items = []
+    index = self._LowerBound(key)
+    while index < self._num_entries:
+      entry_key, offset = self._Entry(index)
+      if entry_key != key:
+        break
+      snippet_status = snippet_status_report_pb2.SnippetStatusItem()
+      snippet_status.ParseFromString(_ReadRecord(self._report, offset))
+      if (not snippet_status.HasField(field_name) or
+          getattr(snippet_status, field_name) != creative_id):
+        raise Error('record at offset %d of %s is not %s %s' % (
+            offset, self._report_file.name, field_name, creative_id))
+      items.append(snippet_status)
+      index += 1
+    return items
+
+  def Lookup(self, buyer_creative_id):
+    """Returns the items with buyer_creative_id, in report order.
+
+    There can be several, e.g. in the merged report of several accounts.
+    """
+    return self._Lookup('buyer_creative_id', buyer_creative_id)
+
+  def LookupCreativeId(self, creative_id):
+    """Returns the items with creative_id, in report order."""
+    return self._Lookup('creative_id', creative_id)
+
+  def __iter__(self):
+    """Yields the items of the report in order, decoding them lazily."""
+    return _Items(self._report)
+
+  def Close(self):
+    for data in (self._report, self._index):
+      if data:
+        data.close()
+    self._report_file.close()
+    self._index_file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, unused_type, unused_value, unused_traceback):
+    self.Close()
@@ -0,0 +1,153 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for ssr_store."""
+
+import os
+import shutil
+import sys
+import tempfile
+
+import snippet_status_report_pb2
+import ssr_store
+
+
+def _WriteReport(path, items):
+  """Writes a .pb report of (buyer_creative_id, creative_id, width) items."""
+  report = snippet_status_report_pb2.SnippetStatusReport()
+  for buyer_creative_id, creative_id, width in items:
+    snippet_status = report.snippet_status.add()
+    if buyer_creative_id is not None:
+      snippet_status.buyer_creative_id = buyer_creative_id
+    if creative_id is not None:
+      snippet_status.creative_id = creative_id
+    snippet_status.width = width
+  with open(path, 'wb') as report_pb:
+    report_pb.write(report.SerializeToString())
+  return report
+
+
+def TestReportStore():
+  output_dir = tempfile.mkdtemp()
+  try:
+    path = os.path.join(output_dir, 'SnippetStatusReport.pb')
+    items = [(u'creative-%d' % index, None, index) for index in xrange(100)]
+    items += [(u'creative-7', None, 1000), (None, u'c\xe9', 1001)]
+    report = _WriteReport(path, items)
+    assert ssr_store.WriteIndex(path) == 102
+    assert os.path.exists(os.path.join(output_dir, 'SnippetStatusReport.idx'))
+
+    with ssr_store.ReportStore(path) as store:
+      assert [item.width for item in store.Lookup(u'creative-42')] == [42]
+      # IDs of several accounts can collide in merged reports.
+      assert [item.width for item in store.Lookup(u'creative-7')] == [
+          7, 1000]
+      assert store.Lookup(u'creative-100') == []
+      assert store.Lookup(u'c\xe9') == []
+      assert [item.width
+              for item in store.LookupCreativeId(u'c\xe9')] == [1001]
+      assert list(store) == list(report.snippet_status)
+  finally:
+    shutil.rmtree(output_dir)
+
+
+def TestEmptyReport():
+  output_dir = tempfile.mkdtemp()
+  try:
+    path = os.path.join(output_dir, 'SnippetStatusReport.pb')
+    _WriteReport(path, [])
+    assert ssr_store.WriteIndex(path) == 0
+    with ssr_store.ReportStore(path) as store:
+      assert store.Lookup(u'creative') == []
+      assert list(store) == []
+  finally:
+    shutil.rmtree(output_dir)
+
+
+def TestMalformedReport():
+  output_dir = tempfile.mkdtemp()
+  try:
+    path = os.path.join(output_dir, 'SnippetStatusReport.pb')
+    _WriteReport(path, [(u'creative', None, 1)])
+    with open(path, 'ab') as report_pb:
+      report_pb.write('\x0a\x10truncated')
+    try:
+      ssr_store.WriteIndex(path)
+    except ssr_store.Error:
+      pass
+    else:
+      assert False, 'Error not raised'
+
+    with open(ssr_store.IndexPath(path), 'wb') as index_file:
+      index_file.write('not an index')
+    try:
+      ssr_store.ReportStore(path)
+    except ssr_store.Error:
+      pass
+    else:
+      assert False, 'Error not raised'
+  finally:
+    shutil.rmtree(output_dir)
+
+
+def TestStaleIndex():
+  output_dir = tempfile.mkdtemp()
+  try:
+    path = os.path.join(output_dir, 'SnippetStatusReport.pb')
+    _WriteReport(path, [(u'creative-%d' % index, None, index)
+                        for index in xrange(3)])
+    ssr_store.WriteIndex(path)
+    _WriteReport(path, [(u'creative-%d' % index, None, index)
+                        for index in xrange(4)])
+    try:
+      ssr_store.ReportStore(path)
+    except ssr_store.Error:
+      pass
+    else:
+      assert False, 'Error not raised'
+
+    # A report of the same size is caught when its records are looked up.
+    _WriteReport(path, [(u'creative-%d' % index, None, index)
+                        for index in xrange(3, 0, -1)])
+    with ssr_store.ReportStore(path) as store:
+      try:
+        store.Lookup(u'creative-0')
+      except ssr_store.Error:
+        pass
+      else:
+        assert False, 'Error not raised'
+  finally:
+    shutil.rmtree(output_dir)
+
+
+def TestReadRecordOutOfRange():
+  try:
+    ssr_store._ReadRecord('\x0a\x00', 2)
+  except ssr_store.Error:
+    pass
+  else:
+    assert False, 'Error not raised'
+
+
+def main(_):
+  TestReportStore()
+  TestEmptyReport()
+  TestMalformedReport()
+  TestStaleIndex()
+  TestReadRecordOutOfRange()
+  print 'All Tests Passed'
+
+if __name__ == '__main__':
+  main(sys.argv)
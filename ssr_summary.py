@@ -0,0 +1,257 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Summary of a Snippet Status Report.
+
+Aggregates the items of a report into:
+  - the filtering_count of the snippet_filtering items by date and
+    filtering_status,
+  - the number of disapprovals by DisapprovalReason,
+  - the number of items by status,
+  - the number of items by advertiser_id and status.
+
+SummaryBuilder collects the numeric fields of the items into typed arrays,
+which are grouped and summed with NumPy when it is installed, and in pure
+Python otherwise.  Both give the same summary.  With NumPy, values are
+counted with bincount rather than sorted whenever their range allows it.
+"""
+
+import array
+import collections
+import csv
+import itertools
+import json
+
+import snippet_status_report_pb2
+import ssr_store
+
+try:
+  import numpy  # pylint: disable=g-import-not-at-top
+except ImportError:
+  numpy = None
+
+
+SUMMARY_SUFFIX = '_summary'
+CSV_COLUMNS = ('aggregate', 'date', 'filtering_status', 'reason', 'status',
+               'advertiser_id', 'value')
+
+_ITEM = snippet_status_report_pb2.SnippetStatusItem
+# array typecodes of 32 and 64 bit integers.  The items of 'l' arrays are C
+# longs, as are those of numpy arrays of the same typecode.
+_INT32 = 'i'
+_INT64 = 'l'
+# Values are counted in arrays indexed by value when their range is at most
+# this factor times the number of values, and are sorted otherwise.
+_MAX_DENSE_SPAN_FACTOR = 4
+
+
+def _EnumName(enum_type, number):
+  value = enum_type.DESCRIPTOR.values_by_number.get(number)
+  return value.name if value else str(number)
+
+
+def _GroupSum(columns, weights=None):
+  """Sums weights grouped by the values of columns.
+
+  Args:
+    columns: arrays of equal length whose values form the group keys
+    weights: array of the values to sum; rows are counted when None
+  Returns:
+    a list of (key tuple, total) tuples, sorted by key
+  """
+  if numpy is not None:
+    return _NumPyGroupSum(columns, weights)
+  totals = collections.defaultdict(int)
+  if weights is None:
+    for key in itertools.izip(*columns):
+      totals[key] += 1
+  else:
+    for key, weight in itertools.izip(itertools.izip(*columns), weights):
+      totals[key] += weight
+  return sorted(totals.iteritems())
+
+
+def _NumPyCodes(values):
+  """Maps values to dense codes that keep their order.
+
+  Returns:
+    a tuple of the codes of values, in range(len(labels)), and of the
+    labels array, where labels[codes] == values
+  """
+  low, high = int(values.min()), int(values.max())
+  if high - low <= _MAX_DENSE_SPAN_FACTOR * len(values):
+    return (values.astype(numpy.int64) - low,
+            numpy.arange(low, high + 1, dtype=numpy.int64))
+  labels, codes = numpy.unique(values, return_inverse=True)
+  return codes.astype(numpy.int64), labels
+
+
+def _NumPyGroupSum(columns, weights):
+  """_GroupSum with NumPy.
+
+  The values of each column are mapped to dense codes, which are combined
+  into one integer key per row, and keys are counted and weights summed
+  with bincount.  Large weights are split into 21 bit pieces summed
+  separately, so that the float sums of bincount are exact.  Totals are 64
+  bit integers, like filtering_count.
+  """
+  if not len(columns[0]):
+    return []
+  keys = None
+  all_labels = []
+  spans = []
+  for column in columns:
+    codes, labels = _NumPyCodes(numpy.frombuffer(column,
+                                                 dtype=column.typecode))
+    all_labels.append(labels)
+    spans.append(len(labels))
+    keys = codes if keys is None else keys * len(labels) + codes
+  key_labels = None
+  if keys.max() > _MAX_DENSE_SPAN_FACTOR * len(keys):
+    keys, key_labels = _NumPyCodes(keys)
+
+  counts = numpy.bincount(keys)
+  present = numpy.flatnonzero(counts)
+  if weights is None:
+    totals = counts[present]
+  else:
+    weights = numpy.frombuffer(weights, dtype=weights.typecode).astype(
+        numpy.int64)
+    totals = numpy.zeros(len(present), dtype=numpy.int64)
+    for shift in (0, 21, 42):
+      piece = weights >> shift
+      if shift < 42:
+        piece &= (1 << 21) - 1
+      piece_totals = numpy.bincount(keys, weights=piece)[present]
+      totals += piece_totals.astype(numpy.int64) << shift
+
+  # Decode the keys back into the values of each column.
+  present_keys = present if key_labels is None else key_labels[present]
+  key_columns = []
+  for labels, span in reversed(zip(all_labels, spans)):
+    key_columns.append(labels[present_keys % span].tolist())
+    present_keys = present_keys // span
+  return zip(zip(*key_columns[::-1]), totals.tolist())
+
+
+class SummaryBuilder(object):
+  """Collects the fields of Snippet Status Items that are summarized."""
+
+  def __init__(self):
+    self._num_items = 0
+    self._statuses = array.array(_INT32)
+    self._advertiser_ids = array.array(_INT64)
+    self._advertiser_statuses = array.array(_INT32)
+    self._disapproval_reasons = array.array(_INT32)
+    self._dates = {}
+    self._filtering_dates = array.array(_INT32)
+    self._filtering_statuses = array.array(_INT32)
+    self._filtering_counts = array.array(_INT64)
+
+  def Add(self, snippet_status):
+    """Adds a SnippetStatusItem to the summary."""
+    self._num_items += 1
+    status = snippet_status.status
+    self._statuses.append(status)
+    advertiser_ids = snippet_status.advertiser_id
+    self._advertiser_ids.extend(advertiser_ids)
+    self._advertiser_statuses.extend([status] * len(advertiser_ids))
+    self._disapproval_reasons.extend(
+        [disapproval.reason
+         for disapproval in snippet_status.disapproval_reason])
+    if snippet_status.HasField('snippet_filtering'):
+      snippet_filtering = snippet_status.snippet_filtering
+      date = self._dates.setdefault(snippet_filtering.date, len(self._dates))
+      filtering_items = snippet_filtering.item
+      self._filtering_dates.extend([date] * len(filtering_items))
+      self._filtering_statuses.extend(
+          [item.filtering_status for item in filtering_items])
+      self._filtering_counts.extend(
+          [item.filtering_count for item in filtering_items])
+
+  def Summarize(self):
+    """Returns the summary of the items added, as a JSON serializable dict."""
+    dates = dict((index, date) for date, index in self._dates.iteritems())
+    filtering = sorted(
+        (dates[date], filtering_status, total)
+        for (date, filtering_status), total in _GroupSum(
+            [self._filtering_dates, self._filtering_statuses],
+            self._filtering_counts))
+    return {
+        'items': self._num_items,
+        'filtering_count_by_date_and_status': [
+            {'date': date, 'filtering_status': filtering_status,
+             'filtering_count': total}
+            for date, filtering_status, total in filtering],
+        'disapprovals_by_reason': [
+            {'reason': _EnumName(_ITEM.DisapprovalReason, reason),
+             'count': total}
+            for (reason,), total in _GroupSum([self._disapproval_reasons])],
+        'items_by_status': [
+            {'status': _EnumName(_ITEM.Status, status), 'items': total}
+            for (status,), total in _GroupSum([self._statuses])],
+        'items_by_advertiser_and_status': [
+            {'advertiser_id': advertiser_id,
+             'status': _EnumName(_ITEM.Status, status), 'items': total}
+            for (advertiser_id, status), total in _GroupSum(
+                [self._advertiser_ids, self._advertiser_statuses])],
+    }
+
+
+def SummarizeItems(snippet_statuses):
+  """Returns the summary of an iterable of SnippetStatusItems."""
+  builder = SummaryBuilder()
+  for snippet_status in snippet_statuses:
+    builder.Add(snippet_status)
+  return builder.Summarize()
+
+
+def SummarizeReport(report_path):
+  """Returns the summary of the items of a .pb report."""
+  return SummarizeItems(ssr_store.ReadItems(report_path))
+
+
+def _CSVRows(summary):
+  """Yields the rows of the summary csv, as dictionaries of CSV_COLUMNS."""
+  yield {'aggregate': 'items', 'value': summary['items']}
+  for row in summary['filtering_count_by_date_and_status']:
+    yield {'aggregate': 'filtering_count', 'date': row['date'],
+           'filtering_status': row['filtering_status'],
+           'value': row['filtering_count']}
+  for row in summary['disapprovals_by_reason']:
+    yield {'aggregate': 'disapprovals', 'reason': row['reason'],
+           'value': row['count']}
+  for row in summary['items_by_status']:
+    yield {'aggregate': 'items_by_status', 'status': row['status'],
+           'value': row['items']}
+  for row in summary['items_by_advertiser_and_status']:
+    yield {'aggregate': 'items_by_advertiser', 'status': row['status'],
+           'advertiser_id': row['advertiser_id'], 'value': row['items']}
+
+
+def WriteSummary(summary, basename):
+  """Writes a summary to <basename>.json and <basename>.csv.
+
+  The csv file has one row per aggregated value, whose aggregate column
+  names the aggregate and whose other columns hold the keys it is grouped
+  by.
+  """
+  with open(basename + '.json', 'w') as summary_json:
+    json.dump(summary, summary_json, indent=2, sort_keys=True)
+  with open(basename + '.csv', 'w') as summary_csv:
+    writer = csv.DictWriter(summary_csv, CSV_COLUMNS)
+    writer.writerow(dict(zip(CSV_COLUMNS, CSV_COLUMNS)))
+    for row in _CSVRows(summary):
+      writer.writerow(dict((column, unicode(value).encode('utf-8'))
+                           for column, value in row.iteritems()))
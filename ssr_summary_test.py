@@ -0,0 +1,152 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for ssr_summary."""
+
+import csv
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+import snippet_status_report_pb2
+import ssr_summary
+
+
+def _Items():
+  """Returns SnippetStatusItems exercising every aggregate."""
+  item_type = snippet_status_report_pb2.SnippetStatusItem
+  items = []
+  for status, advertiser_ids, reasons, date, filtering in (
+      (item_type.APPROVED, [7, 8], [], u'2014-02-01', [(1, 10), (2, 5)]),
+      (item_type.DISAPPROVED, [7],
+       [item_type.BROKEN_URL, item_type.BROKEN_URL], u'2014-01-31',
+       [(1, 3)]),
+      (item_type.DISAPPROVED, [2 ** 40], [item_type.LANDING_PAGE_ERROR],
+       u'2014-02-01', [(1, 1), (2, 2 ** 40)]),
+      (item_type.NOT_CHECKED, [], [], None, [])):
+    item = item_type(status=status, advertiser_id=advertiser_ids)
+    for reason in reasons:
+      item.disapproval_reason.add(reason=reason)
+    if date:
+      item.snippet_filtering.date = date
+      for filtering_status, filtering_count in filtering:
+        item.snippet_filtering.item.add(filtering_status=filtering_status,
+                                         filtering_count=filtering_count)
+    items.append(item)
+  return items
+
+
+EXPECTED_SUMMARY = {
+    'items': 4,
+    'filtering_count_by_date_and_status': [
+        {'date': u'2014-01-31', 'filtering_status': 1, 'filtering_count': 3},
+        {'date': u'2014-02-01', 'filtering_status': 1, 'filtering_count': 11},
+        {'date': u'2014-02-01', 'filtering_status': 2,
+         'filtering_count': 2 ** 40 + 5}],
+    'disapprovals_by_reason': [
+        {'reason': 'BROKEN_URL', 'count': 2},
+        {'reason': 'LANDING_PAGE_ERROR', 'count': 1}],
+    'items_by_status': [
+        {'status': 'NOT_CHECKED', 'items': 1},
+        {'status': 'APPROVED', 'items': 1},
+        {'status': 'DISAPPROVED', 'items': 2}],
+    'items_by_advertiser_and_status': [
+        {'advertiser_id': 7, 'status': 'APPROVED', 'items': 1},
+        {'advertiser_id': 7, 'status': 'DISAPPROVED', 'items': 1},
+        {'advertiser_id': 8, 'status': 'APPROVED', 'items': 1},
+        {'advertiser_id': 2 ** 40, 'status': 'DISAPPROVED', 'items': 1}],
+}
+
+
+def TestSummarizeItems():
+  assert ssr_summary.SummarizeItems(_Items()) == EXPECTED_SUMMARY
+  assert ssr_summary.SummarizeItems([]) == {
+      'items': 0, 'filtering_count_by_date_and_status': [],
+      'disapprovals_by_reason': [], 'items_by_status': [],
+      'items_by_advertiser_and_status': []}
+
+
+def _RandomItems(num_items):
+  rand = random.Random(2014)
+  item_type = snippet_status_report_pb2.SnippetStatusItem
+  statuses = [value.number for value in item_type.Status.DESCRIPTOR.values]
+  reasons = [value.number
+             for value in item_type.DisapprovalReason.DESCRIPTOR.values]
+  for _ in xrange(num_items):
+    # Sparse advertiser IDs are grouped by sorting, the other fields by
+    # counting.
+    item = item_type(
+        status=rand.choice(statuses),
+        advertiser_id=[rand.randint(1, 2 ** 40)
+                       for _ in xrange(rand.randint(0, 2))])
+    for _ in xrange(rand.randint(0, 2)):
+      item.disapproval_reason.add(reason=rand.choice(reasons))
+    item.snippet_filtering.date = u'2014-01-%02d' % rand.randint(1, 28)
+    for _ in xrange(rand.randint(0, 5)):
+      item.snippet_filtering.item.add(
+          filtering_status=rand.randint(1, 100),
+          filtering_count=rand.randint(0, 2 ** 50))
+    yield item
+
+
+def TestSummarizeItemsWithoutNumPy():
+  summary = ssr_summary.SummarizeItems(_RandomItems(2000))
+  numpy = ssr_summary.numpy
+  ssr_summary.numpy = None
+  try:
+    assert ssr_summary.SummarizeItems(_Items()) == EXPECTED_SUMMARY
+    assert ssr_summary.SummarizeItems(_RandomItems(2000)) == summary
+  finally:
+    ssr_summary.numpy = numpy
+
+
+def TestSummarizeReport():
+  output_dir = tempfile.mkdtemp()
+  try:
+    report = snippet_status_report_pb2.SnippetStatusReport()
+    report.snippet_status.extend(_Items())
+    path = os.path.join(output_dir, 'SnippetStatusReport.pb')
+    with open(path, 'wb') as report_pb:
+      report_pb.write(report.SerializeToString())
+    summary = ssr_summary.SummarizeReport(path)
+    assert summary == EXPECTED_SUMMARY
+
+    basename = os.path.join(output_dir, 'SnippetStatusReport_summary')
+    ssr_summary.WriteSummary(summary, basename)
+    with open(basename + '.json') as summary_json:
+      assert json.load(summary_json) == EXPECTED_SUMMARY
+    with open(basename + '.csv') as summary_csv:
+      rows = list(csv.DictReader(summary_csv))
+    assert len(rows) == 1 + 3 + 2 + 3 + 4
+    assert rows[0] == dict(zip(ssr_summary.CSV_COLUMNS,
+                               ['items', '', '', '', '', '', '4']))
+    assert rows[3] == dict(zip(ssr_summary.CSV_COLUMNS,
+                               ['filtering_count', '2014-02-01', '2', '', '',
+                                '', str(2 ** 40 + 5)]))
+  finally:
+    shutil.rmtree(output_dir)
+
+
+def main(_):
+  TestSummarizeItems()
+  TestSummarizeItemsWithoutNumPy()
+  TestSummarizeReport()
+  print 'All Tests Passed'
+
+if __name__ == '__main__':
+  main(sys.argv)